@@ -0,0 +1,266 @@
+import argparse
+import csv
+import datetime
+import gc
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from contextlib import redirect_stdout
+try: #import as a package member (pytest) or as a sibling script
+    from .utils import loadEnvironmentVariablesFromFile
+    from .transit_requester import TransitRequester
+    from .questions import buildDerivedData, planTrip, planTimedTrip, resolveStopName
+except ImportError:
+    from utils import loadEnvironmentVariablesFromFile
+    from transit_requester import TransitRequester
+    from questions import buildDerivedData, planTrip, planTimedTrip, resolveStopName
+
+OUTPUT_FORMATS = ("jsonl", "csv")
+
+CSV_COLUMNS = ("from", "to", "transfer_count", "routes", "transfer_stops", "departure", "arrival", "error")
+
+#What every worker process answers queries with. Set in the parent right before the pool is created, so forked workers inherit the
+#loaded network (copy on write) instead of each loading it again or having it pickled over to them.
+workerJob = None
+
+def readStopPairs(lines, delimiter=","):
+    '''
+    Reads 'stop A,stop B' pairs one line at a time, so the input can be far bigger than memory. Blank lines, lines starting with '#' and
+    a 'from,to' header are skipped. Fields can be quoted like any CSV file (for stop names containing the delimiter).
+    Parameters:
+        lines (iterable[str]): The input lines, e.g. an open file or sys.stdin.
+        delimiter (str): The field separator.
+    Yields:
+        (stopA, stopB) (tuple[str,str]): Each pair as written. Stop names are resolved later, by the workers.
+    '''
+    for row in csv.reader(lines, delimiter=delimiter):
+        if(len(row) < 2 or row[0].lstrip().startswith("#")):
+            continue
+        stopA, stopB = row[0].strip(), row[1].strip()
+        if(stopA and stopB and (stopA.lower(), stopB.lower()) != ("from", "to")):
+            yield stopA, stopB
+
+def allStopPairs(requesterObject):
+    '''
+    Yields every ordered pair of distinct stops in the network, for building a full origin-destination matrix.
+    '''
+    stops = list(requesterObject.getStopToRoutesDict().keys())
+    for stopA in stops:
+        for stopB in stops:
+            if(stopA != stopB):
+                yield stopA, stopB
+
+def answerStopPair(requesterObject, stopA, stopB, departureSeconds=None, serviceDate=None, itineraryMemo=None):
+    '''
+    Answers one origin-destination pair the way question three does: the fewest-transfer itinerary from planTrip(), plus the earliest
+    timed journey from planTimedTrip() if departureSeconds is given.
+    The itinerary only depends on the routes serving each stop, so it can be memoized on those. Big batches ask about the same couple of
+    hundred route combinations over and over (every stop on the same line has the same routes), so most pairs become a dict lookup.
+    Parameters:
+        requesterObject (TransitRequester): A requester whose network is already loaded.
+        stopA (str): The stop the trip starts at, as the user wrote it.
+        stopB (str): The stop the trip ends at, as the user wrote it.
+        departureSeconds (int): The earliest time to leave stopA, in seconds after midnight. None skips the timed journey.
+        serviceDate (datetime.date): The day of the timed journey.
+        itineraryMemo (dict): Itineraries already planned on this network, keyed by the routes at both stops. Filled in as we go. None plans every pair.
+    Returns:
+        result (dict): 'from' and 'to' (the canonical stop names when they resolve), then 'routes', 'transfers' and 'transferCount' like
+        the query server's /path answer, or 'error' if a stop is unknown or there's no path. With departureSeconds, also 'departure',
+        'arrival' and 'legs' (None if there's no scheduled journey).
+    '''
+    resolvedA = resolveStopName(requesterObject, stopA)
+    resolvedB = resolveStopName(requesterObject, stopB)
+    if(resolvedA == None or resolvedB == None):
+        return {"from" : resolvedA or stopA, "to" : resolvedB or stopB, "error" : "Unknown stop name."}
+    stopToRoutesDict = requesterObject.getStopToRoutesDict()
+    memoKey = (tuple(stopToRoutesDict[resolvedA]), tuple(stopToRoutesDict[resolvedB]))
+    if(itineraryMemo != None and memoKey in itineraryMemo):
+        itinerary = itineraryMemo[memoKey]
+    else:
+        itinerary = planTrip(requesterObject, resolvedA, resolvedB)
+        if(itineraryMemo != None):
+            itineraryMemo[memoKey] = itinerary
+    if(itinerary == None):
+        result = {"from" : resolvedA, "to" : resolvedB, "error" : "No path between these stops."}
+    else:
+        result = {"from" : resolvedA, "to" : resolvedB, "routes" : itinerary["routes"], "transfers" : itinerary["transfers"],
+            "transferCount" : len(itinerary["routes"]) - 1}
+    if(departureSeconds != None):
+        legs = planTimedTrip(requesterObject, resolvedA, resolvedB, departureSeconds, serviceDate)
+        result["departure"] = legs[0]["departure"] if legs else None
+        result["arrival"] = legs[-1]["arrival"] if legs else None
+        result["legs"] = legs
+    return result
+
+def answerChunk(stopPairs):
+    '''
+    Worker entry point: answers a chunk of pairs with the network the worker inherited in workerJob, and formats the answers.
+    Pairs go to the workers in chunks and come back as one block of output text, so passing work between processes costs little next to
+    the work itself, and all the parent has left to do is write.
+    '''
+    requesterObject, departureSeconds, serviceDate, itineraryMemo, outputFormat = workerJob #each worker fills in its own copy of the memo
+    return formatResults([answerStopPair(requesterObject, stopA, stopB, departureSeconds, serviceDate, itineraryMemo) for stopA, stopB in stopPairs], outputFormat)
+
+def chunked(iterable, chunkSize):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if(len(chunk) == chunkSize):
+            yield chunk
+            chunk = []
+    if(chunk):
+        yield chunk
+
+def formatResults(results, outputFormat="jsonl"):
+    '''
+    Formats answers as JSON lines (one object per pair) or CSV rows (one per pair, see CSV_COLUMNS).
+    In CSV, routes are separated by ';', and so are the transfers between them. When there's more than one stop to change at,
+    they're separated by '|'.
+    Parameters:
+        results (list[dict]): Answers from answerStopPair().
+        outputFormat (str): 'jsonl' or 'csv'.
+    Returns:
+        text (str): The formatted answers, each ending in a newline.
+    '''
+    if(outputFormat == "jsonl"):
+        return "".join(json.dumps(result, separators=(",", ":")) + "\n" for result in results)
+    buffer = io.StringIO()
+    csvWriter = csv.writer(buffer, lineterminator="\n")
+    for result in results:
+        routes = result.get("routes")
+        csvWriter.writerow((result["from"], result["to"], result.get("transferCount", ""),
+            ";".join(routes) if routes else "",
+            ";".join("|".join(transferStops) for transferStops in result["transfers"]) if routes else "",
+            result.get("departure") if result.get("departure") != None else "",
+            result.get("arrival") if result.get("arrival") != None else "",
+            result.get("error", "")))
+    return buffer.getvalue()
+
+def runBatch(requesterObject, stopPairs, outputFile, outputFormat="jsonl", workers=None, chunkSize=1000, departureSeconds=None, serviceDate=None):
+    '''
+    Answers every pair in stopPairs and streams the results to outputFile in input order.
+    The network (relationship dicts, route graph, stop name index and, for timed journeys, the connection timetable) is built once here,
+    then workers are forked so they all share it. Input is read and results are written while the workers run, with only a few chunks
+    per worker in flight at a time, so memory stays flat however many pairs there are. Throughput grows with the number of workers
+    until the reader/writer in this process becomes the bottleneck.
+    Forking is only available on Unix. Elsewhere, or with workers=1, everything runs in this process.
+    Parameters:
+        requesterObject (TransitRequester): The requester to answer with. Its network is built now if it hasn't been already.
+        stopPairs (iterable[tuple[str,str]]): The (stop A, stop B) pairs to answer. Consumed lazily.
+        outputFile (file): An open text file to write the results to.
+        outputFormat (str): 'jsonl' or 'csv'.
+        workers (int): How many worker processes to use. Defaults to the number of CPUs.
+        chunkSize (int): How many pairs to send to a worker at once.
+        departureSeconds (int): Also plan timed journeys leaving at this time (seconds after midnight). None skips them.
+        serviceDate (datetime.date): The day of the timed journeys. Defaults to today.
+    Returns:
+        numAnswered (int): How many pairs were answered.
+    '''
+    global workerJob
+    if(outputFormat not in OUTPUT_FORMATS):
+        raise ValueError(f"Unknown output format {outputFormat}. Use one of {OUTPUT_FORMATS}.")
+    if(outputFormat == "csv"):
+        outputFile.write(",".join(CSV_COLUMNS) + "\n")
+    buildDerivedData(requesterObject)
+    requesterObject.getStopNameIndex()
+    if(departureSeconds != None):
+        serviceDate = serviceDate or datetime.date.today()
+        requesterObject.getConnectionTimetable(serviceDate)
+    workerJob = (requesterObject, departureSeconds, serviceDate, {}, outputFormat)
+    workers = workers or os.cpu_count() or 1
+    numAnswered = 0
+    try:
+        if(workers == 1 or "fork" not in multiprocessing.get_all_start_methods()):
+            for chunk in chunked(stopPairs, chunkSize):
+                outputFile.write(answerChunk(chunk))
+                numAnswered += len(chunk)
+            return numAnswered
+
+        gc.freeze() #move the loaded network out of the collector's reach, so collections in the workers don't copy every page it touches
+        try:
+            with multiprocessing.get_context("fork").Pool(workers) as pool:
+                pending = deque() #(chunk size, answer) in input order
+                for chunk in chunked(stopPairs, chunkSize):
+                    pending.append((len(chunk), pool.apply_async(answerChunk, (chunk,))))
+                    if(len(pending) >= workers * 4): #don't read ahead of the workers by more than a few chunks each
+                        numAnswered += writeAnswer(outputFile, *pending.popleft())
+                while pending:
+                    numAnswered += writeAnswer(outputFile, *pending.popleft())
+        finally:
+            gc.unfreeze()
+        return numAnswered
+    finally:
+        workerJob = None
+
+def writeAnswer(outputFile, chunkSize, answer):
+    outputFile.write(answer.get())
+    return chunkSize
+
+def parseDepartureTime(text):
+    '''
+    Parses 'HH:MM' (or 'HH:MM:SS') into seconds after midnight. Hours can go past 24 for trips after midnight, like in GTFS.
+    '''
+    parts = [int(part) for part in text.split(":")]
+    if(len(parts) not in (2, 3)):
+        raise argparse.ArgumentTypeError(f"Expected HH:MM, got {text}")
+    return parts[0] * 3600 + parts[1] * 60 + (parts[2] if len(parts) == 3 else 0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan trips for many stop pairs at once, in parallel.")
+    parser.add_argument("input", nargs="?", default="-", help="file of 'stop A,stop B' lines, or - for stdin (the default)")
+    parser.add_argument("--all-pairs", action="store_true", help="ignore the input and answer every pair of stops in the network")
+    parser.add_argument("--output", default="-", help="file to write the results to, or - for stdout (the default)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, help="output format (default: csv if --output ends in .csv, otherwise jsonl)")
+    parser.add_argument("--delimiter", default=",", help="field separator of the input")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: one per CPU)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="pairs sent to a worker at a time")
+    parser.add_argument("--departure", type=parseDepartureTime, help="also plan timed journeys leaving at HH:MM")
+    parser.add_argument("--date", type=datetime.date.fromisoformat, help="service date for --departure, YYYY-MM-DD (default: today)")
+    arguments = parser.parse_args()
+    outputFormat = arguments.format or ("csv" if arguments.output.endswith(".csv") else "jsonl")
+
+    loadEnvironmentVariablesFromFile()
+    outputFile = sys.stdout if arguments.output == "-" else open(arguments.output, "w", newline="")
+    try:
+        with redirect_stdout(sys.stderr): #progress messages from loading the network would end up in the results otherwise
+            numAnswered, elapsedSeconds = runFromArguments(arguments, outputFile, outputFormat)
+    finally:
+        if(outputFile != sys.stdout):
+            outputFile.close()
+    print(f"Answered {numAnswered} pairs in {elapsedSeconds:.1f}s ({numAnswered / max(elapsedSeconds, 1e-9):.0f} pairs/s) with {arguments.workers} workers",
+        file=sys.stderr)
+
+def runFromArguments(arguments, outputFile, outputFormat):
+    '''
+    Loads the network the same way main.py does (GTFS feed, snapshot or the API) and runs the batch described by the command line.
+    Returns:
+        (numAnswered, elapsedSeconds) (tuple[int, float]): How many pairs were answered, and how long that took (after loading the network).
+    '''
+    requesterObject = TransitRequester(os.getenv('MBTA_API_KEY'), os.getenv('MBTA_API_ENDPOINT'))
+    gtfsPath = os.getenv('MBTA_GTFS_PATH')
+    if(gtfsPath):
+        requesterObject.buildRouteAndStopRelationshipsFromGTFS(gtfsPath)
+    snapshotPath = os.getenv('MBTA_SNAPSHOT_PATH')
+    if(snapshotPath and not gtfsPath):
+        requesterObject.loadRelationshipsFromSnapshot(
+            snapshotPath,
+            ttlSeconds=float(os.getenv('MBTA_SNAPSHOT_TTL_SECONDS', 24 * 60 * 60)),
+            derivedDataBuilder=buildDerivedData)
+
+    buildDerivedData(requesterObject) #before the clock starts
+    inputFile = sys.stdin if arguments.input == "-" else open(arguments.input, newline="")
+    try:
+        stopPairs = allStopPairs(requesterObject) if arguments.all_pairs else readStopPairs(inputFile, arguments.delimiter)
+        startTime = time.perf_counter()
+        numAnswered = runBatch(requesterObject, stopPairs, outputFile, outputFormat, arguments.workers, arguments.chunk_size, arguments.departure, arguments.date)
+        return numAnswered, time.perf_counter() - startTime
+    finally:
+        if(inputFile != sys.stdin):
+            inputFile.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import random
+import time
+from graph_search import shortestPath
+
+def buildSyntheticGraph(numNodes, averageDegree, seed):
+    '''
+    Builds a random connected undirected graph shaped like a large transit network: a long chain (so every node is reachable)
+    plus random extra edges until the average degree is reached.
+    Parameters:
+        numNodes (int): Number of nodes in the graph.
+        averageDegree (int): Roughly how many neighbors each node should have.
+        seed (int): Seed for the random number generator, so runs are repeatable.
+    Returns:
+        graph (dict[str, list[str]]): An adjacency dict in the same shape as the route connection graph.
+    '''
+    randomGenerator = random.Random(seed)
+    nodes = [f"route-{i}" for i in range(numNodes)]
+    edges = set()
+    for i in range(1, numNodes):
+        edges.add((nodes[i - 1], nodes[i]))
+    while len(edges) < numNodes * averageDegree // 2:
+        a, b = randomGenerator.sample(nodes, 2)
+        if (b, a) not in edges:
+            edges.add((a, b))
+    graph = {node : [] for node in nodes}
+    for a, b in edges:
+        graph[a].append(b)
+        graph[b].append(a)
+    return graph
+
+def legacyShortestPath(graph, start, end):
+    '''
+    The original list-based breadth first search (path copies, queue.pop(0), list membership for visited), kept here for comparison.
+    '''
+    if(start == end):
+        return [start]
+    visited = []
+    queue = [[start]]
+    while queue:
+        path = queue.pop(0)
+        node = path[-1]
+        if node not in visited:
+            for neighbor in graph[node]:
+                newPath = list(path)
+                newPath.append(neighbor)
+                queue.append(newPath)
+                if neighbor == end:
+                    return newPath
+        visited.append(node)
+    return []
+
+def timeQueries(name, searchFunction, pairs):
+    '''
+    Runs searchFunction over every (start, end) pair and prints the mean time per query.
+    Returns:
+        paths (list[list[str]]): The path found for each pair, so callers can compare implementations.
+    '''
+    paths = []
+    startTime = time.perf_counter()
+    for start, end in pairs:
+        paths.append(searchFunction(start, end))
+    elapsed = time.perf_counter() - startTime
+    print(f"{name:<16} {len(pairs):>6} queries  {elapsed / max(1, len(pairs)) * 1000:>10.3f} ms/query")
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark shortest path search on synthetic graphs.")
+    parser.add_argument("--nodes", type=int, default=10000)
+    parser.add_argument("--degree", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--legacy-queries", type=int, default=3, help="the legacy search is quadratic, so only run it a few times")
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    graph = buildSyntheticGraph(arguments.nodes, arguments.degree, arguments.seed)
+    randomGenerator = random.Random(arguments.seed + 1)
+    nodes = list(graph.keys())
+    pairs = [tuple(randomGenerator.sample(nodes, 2)) for _ in range(arguments.queries)]
+    print(f"Synthetic graph: {arguments.nodes} nodes, average degree {arguments.degree}")
+
+    unidirectional = timeQueries("bfs", lambda a, b: shortestPath(graph, a, b), pairs)
+    bidirectional = timeQueries("bidirectional", lambda a, b: shortestPath(graph, a, b, True, graph), pairs)
+    assert [len(path) for path in unidirectional] == [len(path) for path in bidirectional]
+    if(arguments.legacy_queries > 0):
+        legacyPairs = pairs[:arguments.legacy_queries]
+        legacy = timeQueries("legacy", lambda a, b: legacyShortestPath(graph, a, b), legacyPairs)
+        assert legacy == unidirectional[:len(legacyPairs)]
+
+if __name__ == "__main__":
+    main()
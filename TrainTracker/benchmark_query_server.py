@@ -0,0 +1,86 @@
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from urllib.parse import urlencode
+
+async def sendRequest(reader, writer, host, target):
+    '''
+    Sends one keep-alive GET request and reads the whole response.
+    Returns:
+        (status, body) (tuple[int, bytes]): The HTTP status code and the response body.
+    '''
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode("latin-1"))
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    contentLength = 0
+    while True:
+        headerLine = await reader.readline()
+        if(headerLine in (b"\r\n", b"")):
+            break
+        name, _, value = headerLine.decode("latin-1").partition(":")
+        if(name.strip().lower() == "content-length"):
+            contentLength = int(value)
+    return status, await reader.readexactly(contentLength)
+
+def percentile(sortedValues, fraction):
+    '''
+    Nearest-rank percentile of an already sorted list.
+    '''
+    return sortedValues[min(len(sortedValues) - 1, int(fraction * len(sortedValues)))]
+
+async def runClient(host, port, targets, deadline, latencies, errors, randomGenerator):
+    '''
+    One simulated client: opens a keep-alive connection and sends random queries back to back until the deadline.
+    '''
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            target = randomGenerator.choice(targets)
+            startTime = time.perf_counter()
+            status, _ = await sendRequest(reader, writer, host, target)
+            latencies.append(time.perf_counter() - startTime)
+            if(status != 200):
+                errors.append(status)
+    finally:
+        writer.close()
+
+async def runBenchmark(host, port, concurrency, durationSeconds, seed):
+    '''
+    Drives the query server with a mix of every query type from many concurrent clients and prints latency percentiles and throughput.
+    '''
+    reader, writer = await asyncio.open_connection(host, port)
+    _, body = await sendRequest(reader, writer, host, "/stops")
+    writer.close()
+    stops = json.loads(body)["stops"]
+    randomGenerator = random.Random(seed)
+    targets = ["/routes/names", "/routes/extremes", "/stops/connecting"]
+    targets += ["/path?" + urlencode({"from" : randomGenerator.choice(stops), "to" : randomGenerator.choice(stops)}) for _ in range(200)]
+
+    latencies = []
+    errors = []
+    startTime = time.perf_counter()
+    deadline = startTime + durationSeconds
+    await asyncio.gather(*[runClient(host, port, targets, deadline, latencies, errors, random.Random(seed + i)) for i in range(concurrency)])
+    elapsed = time.perf_counter() - startTime
+
+    latencies.sort()
+    print(f"{len(latencies)} requests from {concurrency} clients in {elapsed:.2f} s ({len(errors)} non-200 responses)")
+    print(f"throughput: {len(latencies) / elapsed:.0f} requests/s")
+    print(f"latency p50: {percentile(latencies, 0.50) * 1000:.3f} ms  p99: {percentile(latencies, 0.99) * 1000:.3f} ms  "
+        f"mean: {statistics.fmean(latencies) * 1000:.3f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running query_server.py.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+    asyncio.run(runBenchmark(arguments.host, arguments.port, arguments.concurrency, arguments.duration, arguments.seed))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from transit_requester import TransitRequester
+from questions import buildRouteConnectionGraph, findShortestPathBFS, getRoutePathIndex, planTrip
+from mock_mbta_server import MockMbtaServer, RecordedNetwork
+
+def timeIt(function, repeat):
+    '''
+    Runs function repeat times and returns the median wall time in seconds. The median keeps one slow outlier from flagging a regression.
+    '''
+    timings = []
+    for _ in range(repeat):
+        startTime = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - startTime)
+    return statistics.median(timings)
+
+def runBenchmarks(endpoint, repeat, numQueries, seed):
+    '''
+    Measures the stages of a TransitRequester's life against the API at endpoint (normally the local stand-in server).
+    Parameters:
+        endpoint (str): API endpoint to benchmark against.
+        repeat (int): How many times to repeat each measurement. The median is reported.
+        numQueries (int): How many random stop pairs to time path queries over.
+        seed (int): Seed for picking the stop pairs.
+    Returns:
+        results (dict[str, float]): Seconds per metric.
+    '''
+    results = {}
+    newRequester = lambda: TransitRequester("benchmark", endpoint)
+    results["cold_build_sequential"] = timeIt(lambda: newRequester().buildRouteAndStopRelationships(concurrent=False), repeat)
+    results["cold_build_concurrent"] = timeIt(lambda: newRequester().buildRouteAndStopRelationships(), repeat)
+    results["cold_build_bulk"] = timeIt(lambda: newRequester().buildRouteAndStopRelationshipsBulk(), repeat)
+
+    requesterObject = newRequester()
+    requesterObject.buildRouteAndStopRelationships()
+    def buildGraph():
+        requesterObject.invalidateDerivedData()
+        buildRouteConnectionGraph(requesterObject)
+    def buildPathIndex():
+        requesterObject.invalidateDerivedData()
+        getRoutePathIndex(requesterObject)
+    results["graph_construction"] = timeIt(buildGraph, repeat)
+    results["path_index_construction"] = timeIt(buildPathIndex, repeat)
+
+    with tempfile.TemporaryDirectory() as temporaryDirectory:
+        snapshotPath = os.path.join(temporaryDirectory, "network.bin")
+        getRoutePathIndex(requesterObject)
+        results["snapshot_save"] = timeIt(lambda: requesterObject.saveSnapshot(snapshotPath), repeat)
+        results["snapshot_load"] = timeIt(lambda: newRequester().loadRelationshipsFromSnapshot(snapshotPath), repeat)
+
+    randomGenerator = random.Random(seed)
+    stops = list(requesterObject.getStopToRoutesDict().keys())
+    stopPairs = [(randomGenerator.choice(stops), randomGenerator.choice(stops)) for _ in range(numQueries)]
+    graph = buildRouteConnectionGraph(requesterObject)
+    routePathIndex = getRoutePathIndex(requesterObject)
+    stopToRoutesDict = requesterObject.getStopToRoutesDict()
+    routePairs = [(stopToRoutesDict[a][0], stopToRoutesDict[b][0]) for a, b in stopPairs]
+    results["query_bfs"] = timeIt(lambda: [findShortestPathBFS(graph, a, b) for a, b in routePairs], repeat) / numQueries
+    results["query_path_index"] = timeIt(lambda: [routePathIndex.getPath(a, b) for a, b in routePairs], repeat) / numQueries
+    results["query_plan_trip"] = timeIt(lambda: [planTrip(requesterObject, a, b) for a, b in stopPairs], repeat) / numQueries
+    return results
+
+def compareToBaseline(results, baseline, tolerance):
+    '''
+    Flags every metric that got slower than its baseline by more than tolerance (a fraction, so 0.25 means 25% slower).
+    Returns:
+        regressions (list[str]): A description of each regression. Empty if there are none.
+    '''
+    regressions = []
+    for metric, seconds in results.items():
+        if(metric in baseline and seconds > baseline[metric] * (1 + tolerance)):
+            regressions.append(f"{metric}: {seconds * 1000:.3f} ms vs baseline {baseline[metric] * 1000:.3f} ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark TransitRequester and the graph functions against a local stand-in of the MBTA API.")
+    parser.add_argument("--recorded", help="directory of recorded API responses (default: a synthetic network)")
+    parser.add_argument("--routes", type=int, default=12)
+    parser.add_argument("--stops-per-route", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds of simulated latency per API request")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="JSON file of baseline results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="write this run's results to --baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a metric counts as a regression")
+    arguments = parser.parse_args()
+
+    if(arguments.recorded):
+        network = RecordedNetwork.load(arguments.recorded)
+    else:
+        network = RecordedNetwork.synthetic(arguments.routes, arguments.stops_per_route)
+    with MockMbtaServer(network, latencySeconds=arguments.latency) as mockServer:
+        results = runBenchmarks(mockServer.endpoint, arguments.repeat, arguments.queries, arguments.seed)
+        print(f"{mockServer.requestCount} API requests served by the stand-in")
+    for metric, seconds in results.items():
+        print(f"{metric:<26} {seconds * 1000:>12.4f} ms")
+
+    if(arguments.baseline and arguments.save_baseline):
+        with open(arguments.baseline, "w") as baselineFile:
+            json.dump(results, baselineFile, indent=2)
+        print(f"Saved baseline to {arguments.baseline}")
+    elif(arguments.baseline):
+        with open(arguments.baseline) as baselineFile:
+            regressions = compareToBaseline(results, json.load(baselineFile), arguments.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if(regressions):
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+if __name__ == "__main__":
+    main()
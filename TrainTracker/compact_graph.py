@@ -0,0 +1,327 @@
+from array import array
+from collections.abc import Mapping
+try: #NumPy is optional. Without it everything still works on the array module buffers.
+    import numpy
+except ImportError:
+    numpy = None
+
+class CompactRouteGraph(Mapping):
+    '''
+    The route connection graph in compressed sparse row (CSR) form.
+    Routes and transfer stops are interned to small integers, and the adjacency lives in flat array buffers:
+        -neighbors[offsets[r] : offsets[r + 1]] are the route numbers directly connected to route number r.
+        -edgeStops[edgeStopOffsets[e] : edgeStopOffsets[e + 1]] are the stop numbers that make up edge e (e indexes into neighbors).
+    That's a few machine words per edge instead of a Python list of strings per route, and traversals read contiguous memory.
+    Searches should use breadthFirstNumbers()/multiSourceShortestPath(), which walk the buffers with route numbers only (graph_search and
+    RoutePathIndex do this automatically when given a CompactRouteGraph).
+    The class is also a read-only Mapping, so graph[route] still returns a list of route names and any code that expects the
+    dict[str, list[str]] graph works on it unchanged, just slower, since every lookup builds a list of names.
+    The graph can be patched in place with applyStopChanges(). Patched rows live in a small overlay on top of the CSR buffers until
+    there are enough of them to be worth folding back in with compact().
+    '''
+    def __init__(self, routeIds, stopToRoutes):
+        '''
+        Constructor for CompactRouteGraph. Two routes are connected if at least one stop is on both of them.
+        Each route's neighbors are stored in the order they're first seen while walking stopToRoutes, so the graph is deterministic.
+        Parameters:
+            routeIds (iterable[str]): Every route in the network. Routes without connections still become nodes.
+            stopToRoutes (dict[str,list[str]]): A dictionary where each key is a stop and each value is a list of routes that stop is on.
+        '''
+        self.routes = list(routeIds)
+        self.routeNumbers = {route : number for number, route in enumerate(self.routes)}
+        self.stops = [] #only transfer stops get a number, since they're the only ones an edge can refer to
+        self.stopNumbers = {}
+        self.overlay = {} #route number -> patched row, as a list of (neighbor number, list of stop numbers). Overrides the CSR row.
+        self.removedRoutes = set() #route numbers that were removed from the network but not compacted away yet
+        rows = [{} for _ in self.routes] #per route: neighbor number -> list of stop numbers. Appending is O(1), no list concatenation.
+        for stop, routesOnStop in stopToRoutes.items():
+            numbers = list(dict.fromkeys(self.routeNumbers[route] for route in routesOnStop if route in self.routeNumbers))
+            if(len(numbers) < 2):
+                continue
+            stopNumber = self.internStop(stop)
+            for routeNumber in numbers:
+                for otherNumber in numbers:
+                    if(otherNumber != routeNumber):
+                        rows[routeNumber].setdefault(otherNumber, []).append(stopNumber)
+        self.freeze([list(row.items()) for row in rows])
+
+    def internStop(self, stop):
+        '''
+        Returns the number for stop, giving it the next free one if it doesn't have one yet.
+        '''
+        stopNumber = self.stopNumbers.get(stop)
+        if(stopNumber == None):
+            stopNumber = len(self.stops)
+            self.stops.append(stop)
+            self.stopNumbers[stop] = stopNumber
+        return stopNumber
+
+    def freeze(self, rows):
+        '''
+        Writes rows (one list of (neighbor number, stop numbers) per route number) into fresh CSR buffers.
+        '''
+        self.searchRows = None
+        self.offsets = array("i", [0])
+        self.neighbors = array("i")
+        self.edgeStopOffsets = array("i", [0])
+        self.edgeStops = array("i")
+        for row in rows:
+            for neighbor, stopNumbers in row:
+                self.neighbors.append(neighbor)
+                self.edgeStops.extend(stopNumbers)
+                self.edgeStopOffsets.append(len(self.edgeStops))
+            self.offsets.append(len(self.neighbors))
+
+    def row(self, routeNumber):
+        '''
+        Parameters:
+            routeNumber (int): A route's interned number (see self.routeNumbers).
+        Returns:
+            row (list[tuple[int, list[int]]]): Each neighbor's number and the numbers of the stops shared with it.
+        '''
+        if(routeNumber in self.overlay):
+            return self.overlay[routeNumber]
+        if(routeNumber + 1 >= len(self.offsets)): #added after the last compaction and never connected
+            return []
+        return [(self.neighbors[edge], list(self.edgeStops[self.edgeStopOffsets[edge]:self.edgeStopOffsets[edge + 1]]))
+            for edge in range(self.offsets[routeNumber], self.offsets[routeNumber + 1])]
+
+    def neighborNumbers(self, routeNumber):
+        '''
+        Parameters:
+            routeNumber (int): A route's interned number (see self.routeNumbers).
+        Returns:
+            memoryview or list[int]: The numbers of the routes connected to it. A zero-copy slice of the neighbors buffer unless the row is patched.
+        '''
+        if(routeNumber in self.overlay or routeNumber + 1 >= len(self.offsets)):
+            return [neighbor for neighbor, _ in self.row(routeNumber)]
+        return memoryview(self.neighbors)[self.offsets[routeNumber]:self.offsets[routeNumber + 1]]
+
+    def breadthFirstNumbers(self, startNumbers, targetNumbers=()):
+        '''
+        Breadth first search over route numbers, so no route names are looked up or built along the way. Neighbors are explored in the
+        same order graph[route] lists them, so the result matches a search over the Mapping view.
+        Parameters:
+            startNumbers (iterable[int]): The route numbers to search from, all at depth zero. Earlier ones win ties.
+            targetNumbers (set[int]): Optional route numbers to stop at as soon as one is discovered.
+        Returns:
+            (parents, found) (tuple[list[int], int]): parents[r] is the route number r was discovered from, r itself for a start, and -1 if r wasn't
+            reached. found is the target that was discovered, or -1 if none was.
+        '''
+        rows = self.getSearchRows()
+        parents = [-1] * len(self.routes)
+        queue = []
+        for start in startNumbers:
+            if(parents[start] == -1): #starts are their own parent
+                parents[start] = start
+                if(start in targetNumbers):
+                    return parents, start
+                queue.append(start)
+        for node in queue: #the list grows while we walk it, which makes it a FIFO queue without deque overhead
+            for neighbor in rows[node]:
+                if(parents[neighbor] == -1):
+                    parents[neighbor] = node
+                    if(neighbor in targetNumbers):
+                        return parents, neighbor
+                    queue.append(neighbor)
+        return parents, -1
+
+    def getSearchRows(self):
+        '''
+        Returns:
+            rows (list[tuple[int]]): For every route number, the numbers of its neighbors, unpacked from the CSR buffers (and overlay) once
+            and then kept up to date by the incremental updates. Reading an array boxes a new int object for every number past 256, so
+            searches that slice the buffers directly are slower than searches over these tuples, or even over a dict of route names.
+        '''
+        if(self.searchRows == None):
+            self.searchRows = [tuple(self.neighborNumbers(routeNumber)) for routeNumber in range(len(self.routes))]
+        return self.searchRows
+
+    def refreshSearchRows(self, routeNumbers):
+        '''
+        Updates the search rows of routeNumbers (and adds rows for new routes) after they were patched. Free if no search has run yet.
+        '''
+        if(self.searchRows == None):
+            return
+        while len(self.searchRows) < len(self.routes):
+            self.searchRows.append(())
+        for routeNumber in routeNumbers:
+            self.searchRows[routeNumber] = tuple(self.neighborNumbers(routeNumber))
+
+    def multiSourceShortestPath(self, sources, targets):
+        '''
+        Same as graph_search.multiSourceShortestPath(), run over route numbers with breadthFirstNumbers().
+        Parameters:
+            sources (list[str]): Routes the path may start from. Routes not in the graph are skipped.
+            targets (list[str]): Routes the path may end at.
+        Returns:
+            path (list[str]): The fewest-hop path from a source to a target including both ends, or an empty list if none exists.
+        '''
+        startNumbers = [self.routeNumbers[route] for route in sources if route in self]
+        targetNumbers = {self.routeNumbers[route] for route in targets if route in self}
+        parents, node = self.breadthFirstNumbers(startNumbers, targetNumbers)
+        if(node == -1):
+            return []
+        path = [self.routes[node]]
+        while parents[node] != node:
+            node = parents[node]
+            path.append(self.routes[node])
+        path.reverse()
+        return path
+
+    def getTransferStops(self, routeA, routeB):
+        '''
+        Parameters:
+            routeA (str): A route in the graph.
+            routeB (str): Another route in the graph.
+        Returns:
+            transferStops (list[str]): The stops you can change between the two routes at. Empty if they aren't directly connected.
+        '''
+        if(routeA not in self or routeB not in self):
+            return []
+        otherNumber = self.routeNumbers[routeB]
+        for neighbor, stopNumbers in self.row(self.routeNumbers[routeA]):
+            if(neighbor == otherNumber):
+                return [self.stops[stop] for stop in stopNumbers]
+        return []
+
+    def applyStopChanges(self, stopChanges):
+        '''
+        Patches the graph in place after some stops changed which routes they're on. Only the rows of routes serving a changed stop are
+        rewritten, so the cost depends on the size of the change, not the size of the network.
+        Routes that appear for the first time become new nodes. Routes listed in stopChanges can be removed with removeRoute().
+        Parameters:
+            stopChanges (dict[str, tuple[list[str], list[str]]]): For each changed stop, the routes it was on before and the routes it's on now.
+        Returns:
+            changedRoutes (set[str]): The routes whose set of neighbors changed. Empty if only transfer stops moved around, which means
+            route-to-route paths (e.g. a RoutePathIndex) are still valid.
+        '''
+        affectedRoutes = {} #used as an ordered set, so new routes get numbers in a deterministic order
+        for oldRoutes, newRoutes in stopChanges.values():
+            affectedRoutes.update(dict.fromkeys(oldRoutes))
+            affectedRoutes.update(dict.fromkeys(newRoutes))
+        for route in affectedRoutes:
+            self.addRoute(route)
+        changedStopNumbers = {self.internStop(stop) for stop in stopChanges}
+        newRouteNumbers = {self.internStop(stop) : list(dict.fromkeys(self.routeNumbers[route] for route in newRoutes))
+            for stop, (_, newRoutes) in stopChanges.items()}
+
+        changedRoutes = set()
+        for route in affectedRoutes:
+            routeNumber = self.routeNumbers[route]
+            oldRow = self.row(routeNumber)
+            newRow = {}
+            for neighbor, stopNumbers in oldRow: #keep every edge that doesn't come from a changed stop, in its original order
+                keptStops = [stop for stop in stopNumbers if stop not in changedStopNumbers]
+                if(keptStops):
+                    newRow[neighbor] = keptStops
+            for stopNumber, routeNumbersOnStop in newRouteNumbers.items():
+                if(routeNumber in routeNumbersOnStop):
+                    for otherNumber in routeNumbersOnStop:
+                        if(otherNumber != routeNumber):
+                            newRow.setdefault(otherNumber, []).append(stopNumber)
+            if({neighbor for neighbor, _ in oldRow} != set(newRow)):
+                changedRoutes.add(route)
+            self.overlay[routeNumber] = list(newRow.items())
+        self.refreshSearchRows(self.routeNumbers[route] for route in affectedRoutes)
+
+        if(len(self.overlay) > max(8, len(self.routes) // 2)): #folding the overlay back in costs O(E), so only do it once it's big
+            self.compact()
+        return changedRoutes
+
+    def addRoute(self, route):
+        '''
+        Adds route as a node without any edges, if it isn't in the graph already. Edges come from applyStopChanges().
+        '''
+        if(route not in self.routeNumbers):
+            self.routeNumbers[route] = len(self.routes)
+            self.routes.append(route)
+            self.refreshSearchRows([self.routeNumbers[route]])
+        self.removedRoutes.discard(self.routeNumbers[route])
+
+    def removeRoute(self, route):
+        '''
+        Removes a route from the graph. Its edges should already be gone (i.e. its stops were passed to applyStopChanges() without it).
+        '''
+        if(route in self):
+            routeNumber = self.routeNumbers[route]
+            self.removedRoutes.add(routeNumber)
+            self.overlay[routeNumber] = []
+            self.refreshSearchRows([routeNumber])
+
+    def compact(self):
+        '''
+        Folds patched rows back into fresh CSR buffers and drops removed routes. Route numbers are reassigned.
+        '''
+        liveNumbers = [number for number in range(len(self.routes)) if number not in self.removedRoutes]
+        renumber = {oldNumber : newNumber for newNumber, oldNumber in enumerate(liveNumbers)}
+        rows = [[(renumber[neighbor], stopNumbers) for neighbor, stopNumbers in self.row(number) if neighbor in renumber] for number in liveNumbers]
+        self.routes = [self.routes[number] for number in liveNumbers]
+        self.routeNumbers = {route : number for number, route in enumerate(self.routes)}
+        self.overlay = {}
+        self.removedRoutes = set()
+        self.freeze(rows)
+
+    def asNumpy(self):
+        '''
+        Returns the CSR buffers as NumPy arrays that share memory with this graph (no copies). Requires NumPy.
+        Patched rows are compacted in first, so the buffers are complete.
+        Returns:
+            buffers (dict[str, numpy.ndarray]): 'offsets', 'neighbors', 'edgeStopOffsets' and 'edgeStops'.
+        '''
+        if(numpy == None):
+            raise ImportError("NumPy is required for CompactRouteGraph.asNumpy(). Install it with 'pip install numpy'.")
+        if(self.overlay or self.removedRoutes):
+            self.compact()
+        return {name : numpy.frombuffer(getattr(self, name), dtype=numpy.int32)
+            for name in ("offsets", "neighbors", "edgeStopOffsets", "edgeStops")}
+
+    def getTables(self):
+        '''
+        Returns the graph as plain data (names and raw buffer bytes), so it can be stored in a snapshot without pickling this class.
+        Returns:
+            tables (dict): Everything fromTables() needs to rebuild the graph.
+        '''
+        if(self.overlay or self.removedRoutes):
+            self.compact()
+        return {
+            "routes" : self.routes,
+            "stops" : self.stops,
+            "offsets" : self.offsets.tobytes(),
+            "neighbors" : self.neighbors.tobytes(),
+            "edgeStopOffsets" : self.edgeStopOffsets.tobytes(),
+            "edgeStops" : self.edgeStops.tobytes()
+        }
+
+    @classmethod
+    def fromTables(cls, tables):
+        '''
+        Rebuilds a graph from the output of getTables().
+        Parameters:
+            tables (dict): Output of getTables().
+        Returns:
+            CompactRouteGraph: The rebuilt graph.
+        '''
+        graph = cls([], {})
+        graph.routes = list(tables["routes"])
+        graph.routeNumbers = {route : number for number, route in enumerate(graph.routes)}
+        graph.stops = list(tables["stops"])
+        graph.stopNumbers = {stop : number for number, stop in enumerate(graph.stops)}
+        for name in ("offsets", "neighbors", "edgeStopOffsets", "edgeStops"):
+            setattr(graph, name, array("i", tables[name]))
+        graph.searchRows = None
+        return graph
+
+    def __getitem__(self, route):
+        if(route not in self):
+            raise KeyError(route)
+        return [self.routes[neighbor] for neighbor in self.neighborNumbers(self.routeNumbers[route])]
+
+    def __contains__(self, route):
+        return route in self.routeNumbers and self.routeNumbers[route] not in self.removedRoutes
+
+    def __iter__(self):
+        return (route for number, route in enumerate(self.routes) if number not in self.removedRoutes)
+
+    def __len__(self):
+        return len(self.routes) - len(self.removedRoutes)
@@ -0,0 +1,164 @@
+from collections import deque
+try: #import as a package member (pytest) or as a sibling script (main.py)
+    from .compact_graph import CompactRouteGraph
+except ImportError:
+    from compact_graph import CompactRouteGraph
+
+def reconstructPath(parents, node):
+    '''
+    Walks parent pointers back from node to the root of a search and returns the path in root-to-node order.
+    Parameters:
+        parents (dict[str,str]): Maps each discovered node to the node it was discovered from. The root maps to None.
+        node (str): The node to walk back from.
+    Returns:
+        path (list[str]): The path from the root of the search to node, including both.
+    '''
+    path = []
+    while node != None:
+        path.append(node)
+        node = parents[node]
+    path.reverse()
+    return path
+
+def breadthFirstParents(graph, start, end=None):
+    '''
+    Runs breadth first search from start and records, for every node it reaches, the node it was first discovered from.
+    Each node is enqueued at most once (visited is a set checked at discovery time), so this is O(V + E) and no paths are copied while searching.
+    Neighbors are explored in the order the graph lists them, which makes the result deterministic for a given graph.
+    Parameters:
+        graph (dict[str, list[str]]): Each key is a node and each value is a list of nodes that key is connected to.
+        start (str): The node to search from.
+        end (str): Optional node to stop at as soon as it is discovered.
+    Returns:
+        parents (dict[str,str]): Maps every discovered node to its parent in the search tree. start maps to None.
+    '''
+    parents = {start : None}
+    queue = deque([start])
+    while queue:
+        node = queue.popleft()
+        for neighbor in graph.get(node, ()):
+            if neighbor not in parents:
+                parents[neighbor] = node
+                if neighbor == end:
+                    return parents
+                queue.append(neighbor)
+    return parents
+
+def multiSourceShortestPath(graph, sources, targets):
+    '''
+    Finds the fewest-hop path from any of the sources to any of the targets with a single breadth first search.
+    All sources start in the queue at depth zero, and the search stops at the first target it discovers. That's equivalent to (but much
+    cheaper than) running one search per (source, target) pair and keeping the shortest result.
+    Ties are broken deterministically: earlier sources and earlier-listed neighbors win.
+    A CompactRouteGraph is searched over its integer buffers instead of through its Mapping view.
+    Parameters:
+        graph (dict[str, list[str]]): Each key is a node and each value is a list (or any iterable) of nodes that key is connected to.
+        sources (list[str]): Nodes the path may start from.
+        targets (list[str]): Nodes the path may end at.
+    Returns:
+        path (list[str]): The shortest path from a source to a target including both ends, or an empty list if none exists.
+    '''
+    if(isinstance(graph, CompactRouteGraph)):
+        return graph.multiSourceShortestPath(sources, targets)
+    targets = set(targets)
+    parents = {}
+    queue = deque()
+    for source in sources:
+        if source in graph and source not in parents:
+            if source in targets:
+                return [source]
+            parents[source] = None
+            queue.append(source)
+    while queue:
+        node = queue.popleft()
+        for neighbor in graph.get(node, ()):
+            if neighbor not in parents:
+                parents[neighbor] = node
+                if neighbor in targets:
+                    return reconstructPath(parents, neighbor)
+                queue.append(neighbor)
+    return []
+
+def shortestPath(graph, start, end, bidirectional=False, reverseGraph=None):
+    '''
+    Finds a path with the fewest hops from start to end.
+    The default one-directional search returns exactly the same path the original list-based findShortestPathBFS did.
+    The bidirectional search grows one frontier from each end and stops once they meet, which touches far fewer nodes on large graphs.
+    It always finds a path of the same (shortest) length, but when there are several shortest paths it may pick a different one.
+    Parameters:
+        graph (dict[str, list[str]]): Each key is a node and each value is a list of nodes that key is connected to.
+        start (str): The node to start from.
+        end (str): The node to find a path to.
+        bidirectional (bool): Whether to search from both ends at once.
+        reverseGraph (dict[str, list[str]]): Only used when bidirectional. Maps each node to the nodes that link *to* it. Pass graph itself for
+            undirected graphs (like the route connection graph). If None, it's computed from graph, which costs O(V + E).
+    Returns:
+        path (list[str]): The shortest path from start to end including both ends, or an empty list if there is no path.
+    '''
+    if(start == end):
+        return [start]
+    if(start not in graph or end not in graph):
+        return []
+    if(not bidirectional):
+        if(isinstance(graph, CompactRouteGraph)):
+            return graph.multiSourceShortestPath([start], [end])
+        parents = breadthFirstParents(graph, start, end)
+        return reconstructPath(parents, end) if end in parents else []
+
+    if(reverseGraph == None):
+        reverseGraph = reverseAdjacency(graph)
+    forwardParents = {start : None}
+    backwardParents = {end : None}
+    forwardDepth = {start : 0}
+    backwardDepth = {end : 0}
+    forwardFrontier = [start]
+    backwardFrontier = [end]
+    while forwardFrontier and backwardFrontier:
+        #Expand a whole level of the smaller frontier. Every meeting found during that level is a candidate, and the best of them is optimal.
+        expandForward = len(forwardFrontier) <= len(backwardFrontier)
+        if(expandForward):
+            frontier, adjacency, parents, depth, otherDepth = forwardFrontier, graph, forwardParents, forwardDepth, backwardDepth
+        else:
+            frontier, adjacency, parents, depth, otherDepth = backwardFrontier, reverseGraph, backwardParents, backwardDepth, forwardDepth
+        nextFrontier = []
+        bestMeeting = None
+        bestLength = None
+        for node in frontier:
+            for neighbor in adjacency.get(node, ()):
+                if neighbor not in parents:
+                    parents[neighbor] = node
+                    depth[neighbor] = depth[node] + 1
+                    nextFrontier.append(neighbor)
+                if neighbor in otherDepth:
+                    length = depth[node] + 1 + otherDepth[neighbor]
+                    if(bestLength == None or length < bestLength):
+                        bestMeeting, bestLength = (node, neighbor), length
+        if(bestMeeting != None):
+            node, neighbor = bestMeeting
+            if(expandForward):
+                forwardHalf, backwardNode = reconstructPath(forwardParents, node), neighbor
+            else:
+                forwardHalf, backwardNode = reconstructPath(forwardParents, neighbor), node
+            while backwardNode != None: #the backward parents point towards end
+                forwardHalf.append(backwardNode)
+                backwardNode = backwardParents[backwardNode]
+            return forwardHalf
+        if(expandForward):
+            forwardFrontier = nextFrontier
+        else:
+            backwardFrontier = nextFrontier
+    return []
+
+def reverseAdjacency(graph):
+    '''
+    Builds the reverse of a directed graph, i.e. for every edge A -> B in graph, the result has an edge B -> A.
+    Parameters:
+        graph (dict[str, list[str]]): Each key is a node and each value is a list of nodes that key is connected to.
+    Returns:
+        reverseGraph (dict[str, list[str]]): Each key is a node and each value is a list of nodes that link to it.
+    '''
+    reverseGraph = {node : [] for node in graph}
+    for node, neighbors in graph.items():
+        for neighbor in neighbors:
+            reverseGraph.setdefault(neighbor, []).append(node)
+    return reverseGraph
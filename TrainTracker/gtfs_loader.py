@@ -0,0 +1,208 @@
+import csv
+import io
+import zipfile
+from collections import defaultdict
+
+SUBWAY_ROUTE_TYPES = ("0", "1") #0 and 1 represent 'Light Rail' and 'Heavy Rail' in GTFS too.
+
+def readGtfsTable(zipFile, memberName):
+    '''
+    Generator over the rows of one table (like 'stop_times.txt') inside a GTFS zip, parsed with the csv module straight from the
+    compressed stream. Nothing is extracted to disk and only one row is held in memory at a time.
+    Parameters:
+        zipFile (zipfile.ZipFile): The open GTFS feed.
+        memberName (str): The file inside the zip to read.
+    Yields:
+        row (dict[str,str]): One row, keyed by column name.
+    '''
+    with zipFile.open(memberName) as rawMember:
+        textMember = io.TextIOWrapper(rawMember, encoding="utf-8-sig", newline="") #utf-8-sig drops the byte order mark some feeds start with
+        yield from csv.DictReader(textMember)
+
+def readStationNames(zipFile, neededStops):
+    '''
+    Names the given stops the way the API does: platforms are named after their parent station.
+    Parameters:
+        zipFile (zipfile.ZipFile): The open GTFS feed.
+        neededStops (set[str]): The stop ids to name.
+    Returns:
+        stationNames (dict[str,str]): stop id -> station name, for every stop in neededStops that's in stops.txt.
+    '''
+    stopNames = {}
+    parentStations = {}
+    for row in readGtfsTable(zipFile, "stops.txt"): #only keep the stops we need, and stations (location_type 1) since they may be their parents
+        if(row["stop_id"] in neededStops or row.get("location_type") == "1"):
+            stopNames[row["stop_id"]] = row["stop_name"]
+        if(row["stop_id"] in neededStops and row.get("parent_station")):
+            parentStations[row["stop_id"]] = row["parent_station"]
+    return {stopId : stopNames.get(parentStations.get(stopId, stopId), stopNames[stopId]) for stopId in neededStops if stopId in stopNames}
+
+def streamTripStops(zipFile, tripToRoute):
+    '''
+    Generator over the stops of each trip in stop_times.txt, for the trips in tripToRoute. Feeds list each trip's rows together, so we only
+    buffer one trip at a time. The spec doesn't promise that though, so a trip whose rows show up again after another trip's raises.
+    Parameters:
+        zipFile (zipfile.ZipFile): The open GTFS feed.
+        tripToRoute (dict[str,str]): trip id -> route id, for the trips to read.
+    Yields:
+        (tripId, stopSequence) (tuple[str, list[tuple[int,str]]]): A trip and its (stop_sequence, stop_id) pairs, in file order.
+    Raises:
+        ValueError: If stop_times.txt isn't grouped by trip_id.
+    '''
+    finishedTrips = set()
+    currentTrip = None
+    currentStops = []
+    for row in readGtfsTable(zipFile, "stop_times.txt"):
+        tripId = row["trip_id"]
+        if(tripId != currentTrip):
+            if(currentTrip in tripToRoute):
+                finishedTrips.add(currentTrip)
+                yield currentTrip, currentStops
+            if(tripId in finishedTrips):
+                raise ValueError(f"stop_times.txt is not grouped by trip_id (trip {tripId} appears twice)")
+            currentTrip = tripId
+            currentStops = []
+        if(tripId in tripToRoute):
+            currentStops.append((int(row["stop_sequence"]), row["stop_id"]))
+    if(currentTrip in tripToRoute):
+        yield currentTrip, currentStops
+
+def groupTripStops(zipFile, tripToRoute):
+    '''
+    Like streamTripStops(), but works however stop_times.txt is ordered, by holding every trip's stops in memory until the whole table is read.
+    Returns:
+        tripStops (dict[str, list[tuple[int,str]]]): trip id -> (stop_sequence, stop_id) pairs, for the trips in tripToRoute.
+    '''
+    tripStops = defaultdict(list)
+    for row in readGtfsTable(zipFile, "stop_times.txt"):
+        if(row["trip_id"] in tripToRoute):
+            tripStops[row["trip_id"]].append((int(row["stop_sequence"]), row["stop_id"]))
+    return tripStops
+
+def loadRouteAndStopRelationshipsFromGTFS(gtfsPath, routeTypes=SUBWAY_ROUTE_TYPES):
+    '''
+    Builds the route to stops and stop to routes dictionaries from a GTFS static feed (the zip MBTA publishes at
+    https://cdn.mbta.com/MBTA_GTFS.zip) instead of the JSON API.
+    Memory stays bounded no matter how large stop_times.txt is: it's streamed row by row, and we only keep the set of stops seen on each route
+    plus the stops of the trip currently being read. The only per-trip state is the trip to route map for the routes we care about.
+    That relies on the rows being grouped by trip, which every feed we know of does. If one isn't, we read the table again grouped in memory.
+    Like the API, stops are identified by name, and platforms are named after their parent station.
+    Each route's stops are ordered along its longest trip in direction 0 (which is how the API orders them), followed by any stops that
+    trip doesn't serve (e.g. the other branch), in the order they were first seen.
+    Parameters:
+        gtfsPath (str or file-like): Path to the GTFS zip, or an open binary file.
+        routeTypes (tuple[str]): GTFS route_type values to include. Defaults to subway.
+    Returns:
+        (routeToStops, stopToRoutes) (tuple[defaultdict[str,list[str]], defaultdict[str,list[str]]]): Same shape as TransitRequester's members.
+    '''
+    with zipfile.ZipFile(gtfsPath) as zipFile:
+        routes = [row for row in readGtfsTable(zipFile, "routes.txt") if row["route_type"] in routeTypes]
+        if(routes and routes[0].get("route_sort_order")): #match the API's ordering of routes
+            routes.sort(key=lambda row: int(row["route_sort_order"] or 0))
+        routeIds = [row["route_id"] for row in routes]
+        routeSet = set(routeIds)
+
+        tripToRoute = {}
+        tripDirection = {}
+        for row in readGtfsTable(zipFile, "trips.txt"):
+            if(row["route_id"] in routeSet):
+                tripToRoute[row["trip_id"]] = row["route_id"]
+                tripDirection[row["trip_id"]] = row.get("direction_id", "0")
+
+        def summarizeTrips(tripStops):
+            bestTripStops = {} #route -> stop ids of its longest direction 0 trip so far
+            stopsSeenOnRoute = {route : {} for route in routeIds} #route -> stop ids in first seen order (a dict used as an ordered set)
+            for tripId, stopSequence in tripStops:
+                route = tripToRoute[tripId]
+                stopIds = [stopId for _, stopId in sorted(stopSequence)]
+                stopsSeenOnRoute[route].update(dict.fromkeys(stopIds))
+                if(tripDirection[tripId] in ("0", "") and len(stopIds) > len(bestTripStops.get(route, ()))):
+                    bestTripStops[route] = stopIds
+            return bestTripStops, stopsSeenOnRoute
+
+        try:
+            bestTripStops, stopsSeenOnRoute = summarizeTrips(streamTripStops(zipFile, tripToRoute))
+        except ValueError: #not grouped by trip, so a trip we already summarized was only partly read. Start over.
+            bestTripStops, stopsSeenOnRoute = summarizeTrips(groupTripStops(zipFile, tripToRoute).items())
+
+        neededStops = set()
+        for stopIds in stopsSeenOnRoute.values():
+            neededStops.update(stopIds)
+        stationNames = readStationNames(zipFile, neededStops)
+
+    routeToStops = defaultdict(list)
+    stopToRoutes = defaultdict(list)
+    for route in routeIds:
+        orderedStopIds = list(dict.fromkeys(bestTripStops.get(route, []) + list(stopsSeenOnRoute[route])))
+        stopsOnRoute = list(dict.fromkeys(stationNames.get(stopId, stopId) for stopId in orderedStopIds)) #platforms share their station's name
+        routeToStops[route] = stopsOnRoute
+        for stop in stopsOnRoute:
+            stopToRoutes[stop].append(route)
+    return routeToStops, stopToRoutes
+
+def parseGtfsTime(value):
+    '''
+    Converts a GTFS time like '25:10:00' to seconds after midnight of the service day. Times after midnight are above 24 hours, so a
+    late night trip's times keep increasing. Returns None for an empty value.
+    '''
+    if(not value):
+        return None
+    hours, minutes, seconds = value.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+def activeServiceIds(zipFile, serviceDate):
+    '''
+    Works out which service_ids run on serviceDate from calendar.txt (weekly patterns) and calendar_dates.txt (added and removed dates).
+    Parameters:
+        zipFile (zipfile.ZipFile): The open GTFS feed.
+        serviceDate (datetime.date): The day to plan for.
+    Returns:
+        serviceIds (set[str]): The services running that day, or None if the feed has no calendar at all (then every trip counts).
+    '''
+    memberNames = set(zipFile.namelist())
+    if("calendar.txt" not in memberNames and "calendar_dates.txt" not in memberNames):
+        return None
+    dateText = serviceDate.strftime("%Y%m%d")
+    weekday = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")[serviceDate.weekday()]
+    serviceIds = set()
+    if("calendar.txt" in memberNames):
+        for row in readGtfsTable(zipFile, "calendar.txt"):
+            if(row["start_date"] <= dateText <= row["end_date"] and row[weekday] == "1"):
+                serviceIds.add(row["service_id"])
+    if("calendar_dates.txt" in memberNames):
+        for row in readGtfsTable(zipFile, "calendar_dates.txt"):
+            if(row["date"] == dateText):
+                if(row["exception_type"] == "1"):
+                    serviceIds.add(row["service_id"])
+                else:
+                    serviceIds.discard(row["service_id"])
+    return serviceIds
+
+def loadStopTimesFromGTFS(gtfsPath, serviceDate, routeTypes=SUBWAY_ROUTE_TYPES):
+    '''
+    Reads the scheduled stop times of every trip that runs on serviceDate from a GTFS static feed, for building a ConnectionTimetable.
+    stop_times.txt is streamed, and only the rows of trips that run that day on the routes we care about are kept, as compact tuples.
+    Parameters:
+        gtfsPath (str or file-like): Path to the GTFS zip, or an open binary file.
+        serviceDate (datetime.date): The day to load.
+        routeTypes (tuple[str]): GTFS route_type values to include. Defaults to subway.
+    Returns:
+        stopTimes (list[tuple[str, str, int, str, int, int]]): (tripId, routeId, stopSequence, stopName, arrivalSeconds, departureSeconds)
+        for every stop of every trip, with times in seconds after midnight and stops named like the API names them.
+    '''
+    with zipfile.ZipFile(gtfsPath) as zipFile:
+        routeSet = {row["route_id"] for row in readGtfsTable(zipFile, "routes.txt") if row["route_type"] in routeTypes}
+        serviceIds = activeServiceIds(zipFile, serviceDate)
+        tripToRoute = {row["trip_id"] : row["route_id"] for row in readGtfsTable(zipFile, "trips.txt")
+            if row["route_id"] in routeSet and (serviceIds == None or row["service_id"] in serviceIds)}
+        rows = []
+        for row in readGtfsTable(zipFile, "stop_times.txt"):
+            routeId = tripToRoute.get(row["trip_id"])
+            if(routeId != None):
+                arrivalSeconds = parseGtfsTime(row["arrival_time"])
+                departureSeconds = parseGtfsTime(row["departure_time"])
+                rows.append((row["trip_id"], routeId, int(row["stop_sequence"]), row["stop_id"],
+                    arrivalSeconds if arrivalSeconds != None else departureSeconds, departureSeconds if departureSeconds != None else arrivalSeconds))
+        stationNames = readStationNames(zipFile, {row[3] for row in rows})
+    return [(tripId, routeId, stopSequence, stationNames.get(stopId, stopId), arrivalSeconds, departureSeconds)
+        for tripId, routeId, stopSequence, stopId, arrivalSeconds, departureSeconds in rows]
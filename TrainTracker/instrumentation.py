@@ -0,0 +1,264 @@
+import cProfile
+import json
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0) #seconds
+
+METRIC_DESCRIPTIONS = {
+    "traintracker_function_seconds" : "Wall time spent in instrumented TransitRequester methods and graph functions.",
+    "traintracker_function_errors_total" : "Calls to instrumented functions that raised an exception.",
+    "traintracker_http_requests_total" : "HTTP requests sent to the transit API, by endpoint and status code.",
+    "traintracker_http_request_seconds" : "Latency of HTTP requests to the transit API, until the whole body was received.",
+    "traintracker_http_response_bytes_total" : "Response body bytes received from the transit API.",
+    "traintracker_json_decode_seconds" : "Time spent decoding JSON response bodies.",
+    "traintracker_http_retries_total" : "429 and 5xx responses from the transit API that were retried.",
+    "traintracker_rate_limit_wait_seconds" : "Time spent waiting for the API's rate limit window to reset before sending a request.",
+    "traintracker_cache_lookups_total" : "Lookups of cached data (HTTP memo and in-flight requests, relationship dicts, route graph, path index, snapshot...) by result."
+}
+
+class Histogram:
+    '''
+    Counts observations into fixed buckets, like a Prometheus histogram. Keeps the count, sum and max too.
+    '''
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucketCounts = [0] * (len(buckets) + 1) #the last one is the +Inf bucket
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.bucketCounts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def cumulativeCounts(self):
+        '''
+        Returns:
+            counts (list[tuple[str, int]]): Each bucket's upper bound (as Prometheus writes it) and how many observations were at or below it.
+        '''
+        counts = []
+        total = 0
+        for bound, bucketCount in zip([repr(float(bound)) for bound in self.buckets] + ["+Inf"], self.bucketCounts):
+            total += bucketCount
+            counts.append((bound, total))
+        return counts
+
+class MetricsRegistry:
+    '''
+    Collects counters and timing histograms from TransitRequester and the graph functions, and exports them in the Prometheus text
+    format or as JSON. Metrics are keyed by name plus a set of labels, like http_requests_total{endpoint="/stops",status="200"}.
+    A disabled registry (the default) drops everything at the first line of increment()/observe(), and @instrumented functions skip
+    their timing entirely, so leaving the instrumentation in costs next to nothing.
+    To send metrics somewhere else (statsd, logs...), subclass this and override increment() and observe(), then pass it to setMetrics().
+    '''
+    def __init__(self, enabled=False, buckets=DEFAULT_BUCKETS):
+        '''
+        Constructor for MetricsRegistry.
+        Parameters:
+            enabled (bool): Whether to record anything. Can be flipped later with enable()/disable().
+            buckets (tuple[float]): Upper bounds of the histogram buckets, in seconds, in increasing order.
+        '''
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock() #TransitRequester fetches from a thread pool, so updates can come from several threads at once
+        self.counters = {} #(name, labels) -> value, where labels is a sorted tuple of (label, value) pairs
+        self.histograms = {} #(name, labels) -> Histogram
+        self.profiler = None
+        self.profileLock = threading.Lock() #cProfile can only profile one call at a time
+
+    def enable(self, profile=False):
+        '''
+        Starts recording. If profile is True, the outermost instrumented call running at any moment is also run under cProfile,
+        and the accumulated stats are available from profileSummary().
+        '''
+        self.enabled = True
+        if(profile and self.profiler == None):
+            self.profiler = cProfile.Profile()
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        '''
+        Throws away everything recorded so far, including profile data.
+        '''
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            if(self.profiler != None):
+                self.profiler = cProfile.Profile()
+
+    @staticmethod
+    def labelKey(labels):
+        return tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def increment(self, name, amount=1, **labels):
+        '''
+        Adds amount to the counter name{labels}.
+        '''
+        if(not self.enabled):
+            return
+        key = (name, self.labelKey(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        '''
+        Records one observation (normally a duration in seconds) in the histogram name{labels}.
+        '''
+        if(not self.enabled):
+            return
+        key = (name, self.labelKey(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if(histogram == None):
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        '''
+        Context manager that observes how long its block took in the histogram name{labels}.
+        '''
+        if(not self.enabled):
+            yield
+            return
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - startTime, **labels)
+
+    def profileCall(self, function, *args, **kwargs):
+        '''
+        Calls function, under cProfile if profiling is on and no other call is being profiled right now (nested calls are already covered).
+        '''
+        if(self.profiler == None or not self.profileLock.acquire(blocking=False)):
+            return function(*args, **kwargs)
+        try:
+            return self.profiler.runcall(function, *args, **kwargs)
+        finally:
+            self.profileLock.release()
+
+    def profileSummary(self, limit=20):
+        '''
+        Returns:
+            functions (list[dict]): The limit functions with the most cumulative time while profiling, with their call counts and times in seconds.
+            Empty if profiling isn't on.
+        '''
+        if(self.profiler == None):
+            return []
+        with self.profileLock:
+            try:
+                stats = pstats.Stats(self.profiler).stats
+            except TypeError: #nothing has been profiled yet
+                return []
+        rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+        return [{"function" : f"{fileName}:{lineNumber}({functionName})", "calls" : calls, "totalSeconds" : totalTime, "cumulativeSeconds" : cumulativeTime}
+            for (fileName, lineNumber, functionName), (_, calls, totalTime, cumulativeTime, _) in rows]
+
+    def toJson(self):
+        '''
+        Returns:
+            summary (dict): Every counter and histogram (count, sum, mean, max and cumulative buckets), grouped by metric name, plus the
+            profile summary if profiling is on. Only builtin types, so it can go straight to json.dumps().
+        '''
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, histogram.count, histogram.sum, histogram.max, histogram.cumulativeCounts()) for key, histogram in self.histograms.items())
+        summary = {"counters" : {}, "histograms" : {}}
+        for (name, labels), value in counters:
+            summary["counters"].setdefault(name, []).append({"labels" : dict(labels), "value" : value})
+        for (name, labels), count, total, maximum, buckets in histograms:
+            summary["histograms"].setdefault(name, []).append({"labels" : dict(labels), "count" : count, "sum" : total,
+                "mean" : total / count if count else 0.0, "max" : maximum, "buckets" : dict(buckets)})
+        if(self.profiler != None):
+            summary["profile"] = self.profileSummary()
+        return summary
+
+    def toPrometheus(self):
+        '''
+        Returns:
+            text (str): Every counter and histogram in the Prometheus text exposition format (version 0.0.4).
+        '''
+        summary = self.toJson()
+        lines = []
+        for metricType, metrics in (("counter", summary["counters"]), ("histogram", summary["histograms"])):
+            for name, series in metrics.items():
+                if(name in METRIC_DESCRIPTIONS):
+                    lines.append(f"# HELP {name} {METRIC_DESCRIPTIONS[name]}")
+                lines.append(f"# TYPE {name} {metricType}")
+                for entry in series:
+                    if(metricType == "counter"):
+                        lines.append(f"{name}{formatLabels(entry['labels'])} {entry['value']}")
+                        continue
+                    for bound, count in entry["buckets"].items():
+                        lines.append(f"{name}_bucket{formatLabels(dict(entry['labels'], le=bound))} {count}")
+                    lines.append(f"{name}_sum{formatLabels(entry['labels'])} {entry['sum']}")
+                    lines.append(f"{name}_count{formatLabels(entry['labels'])} {entry['count']}")
+        return "\n".join(lines) + "\n"
+
+    def writeSummary(self, path):
+        '''
+        Writes the summary to path: as JSON if the name ends in '.json', otherwise in the Prometheus text format.
+        '''
+        with open(path, "w") as summaryFile:
+            if(path.endswith(".json")):
+                json.dump(self.toJson(), summaryFile, indent=2)
+            else:
+                summaryFile.write(self.toPrometheus())
+
+def formatLabels(labels):
+    '''
+    Formats labels as a Prometheus label set, like {endpoint="/stops",status="200"}. Empty labels give an empty string.
+    '''
+    if(not labels):
+        return ""
+    escape = lambda value: str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join(f"{label}=\"{escape(value)}\"" for label, value in labels.items()) + "}"
+
+activeMetrics = MetricsRegistry() #disabled until someone calls getMetrics().enable() or plugs in their own registry
+
+def getMetrics():
+    '''
+    Returns:
+        MetricsRegistry: The registry everything currently reports to.
+    '''
+    return activeMetrics
+
+def setMetrics(registry):
+    '''
+    Makes registry the one everything reports to, and returns the previous one (so it can be put back).
+    '''
+    global activeMetrics
+    previousRegistry = activeMetrics
+    activeMetrics = registry
+    return previousRegistry
+
+def instrumented(function):
+    '''
+    Decorator that records each call's wall time in traintracker_function_seconds{function="<qualified name>"} and counts the calls
+    that raise in traintracker_function_errors_total. When the active registry is disabled it's a straight pass-through call.
+    '''
+    name = function.__qualname__
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        registry = activeMetrics
+        if(not registry.enabled):
+            return function(*args, **kwargs)
+        startTime = time.perf_counter()
+        try:
+            return registry.profileCall(function, *args, **kwargs)
+        except BaseException:
+            registry.increment("traintracker_function_errors_total", function=name)
+            raise
+        finally:
+            registry.observe("traintracker_function_seconds", time.perf_counter() - startTime, function=name)
+    return wrapper
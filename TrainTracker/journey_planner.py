@@ -0,0 +1,193 @@
+import datetime
+from array import array
+from bisect import bisect_left, bisect_right
+
+UNREACHED = 1 << 40 #later than any real time of day, and still a small int
+
+def formatServiceTime(seconds):
+    '''
+    Formats seconds after midnight as 'HH:MM'. Like GTFS, times after midnight keep counting up ('24:15' is a quarter past midnight).
+    '''
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}"
+
+def secondsAfterMidnight(isoTime, serviceDate):
+    '''
+    Converts an API time like '2026-10-18T05:16:00-04:00' to seconds after midnight of serviceDate. The API gives local times, and trips
+    that run past midnight are dated the next day, so they come out above 24 hours like GTFS times.
+    '''
+    localTime = datetime.datetime.fromisoformat(isoTime)
+    return (localTime.date() - serviceDate).days * 86400 + localTime.hour * 3600 + localTime.minute * 60 + localTime.second
+
+class ConnectionTimetable:
+    '''
+    A day of scheduled service as a timetable for the Connection Scan Algorithm (CSA).
+    Every pair of consecutive stops on every trip is one connection: (departure stop, arrival stop, departure time, arrival time, trip).
+    The connections are sorted by departure time and stored column by column in flat arrays, so a query is one forward (or, for profiles,
+    backward) pass over contiguous memory. There's no priority queue and no graph to walk.
+    Stops are identified by name like everywhere else, so changing lines at a station is just arriving and departing at the same stop.
+    '''
+    def __init__(self, stopTimes, minTransferSeconds=0, serviceDate=None):
+        '''
+        Constructor for ConnectionTimetable.
+        Parameters:
+            stopTimes (iterable[tuple[str, str, int, str, int, int]]): (tripId, routeId, stopSequence, stopName, arrivalSeconds, departureSeconds)
+                for every stop of every trip, in any order. Times are seconds after midnight of the service day.
+            minTransferSeconds (int): How long changing from one trip to another at a station takes.
+            serviceDate (datetime.date): The day the stop times are for. Only kept for reference.
+        '''
+        self.minTransferSeconds = minTransferSeconds
+        self.serviceDate = serviceDate
+        self.stops = []
+        self.stopNumbers = {}
+        self.trips = [] #trip number -> trip id
+        self.tripRoutes = [] #trip number -> route id
+        stopsByTrip = {}
+        for tripId, routeId, stopSequence, stopName, arrivalSeconds, departureSeconds in stopTimes:
+            if(tripId not in stopsByTrip):
+                stopsByTrip[tripId] = []
+                self.tripRoutes.append(routeId)
+                self.trips.append(tripId)
+            stopsByTrip[tripId].append((stopSequence, self.internStop(stopName), arrivalSeconds, departureSeconds))
+
+        connections = []
+        for tripNumber, tripId in enumerate(self.trips):
+            tripStops = sorted(stopsByTrip.pop(tripId))
+            for (_, fromStop, _, departureSeconds), (_, toStop, arrivalSeconds, _) in zip(tripStops, tripStops[1:]):
+                if(fromStop != toStop): #two platforms of the same station
+                    connections.append((departureSeconds, arrivalSeconds, fromStop, toStop, tripNumber))
+        connections.sort()
+        self.departureTimes = array("i", (connection[0] for connection in connections))
+        self.arrivalTimes = array("i", (connection[1] for connection in connections))
+        self.departureStops = array("i", (connection[2] for connection in connections))
+        self.arrivalStops = array("i", (connection[3] for connection in connections))
+        self.connectionTrips = array("i", (connection[4] for connection in connections))
+
+    def internStop(self, stopName):
+        stopNumber = self.stopNumbers.get(stopName)
+        if(stopNumber == None):
+            stopNumber = len(self.stops)
+            self.stops.append(stopName)
+            self.stopNumbers[stopName] = stopNumber
+        return stopNumber
+
+    def __len__(self):
+        return len(self.departureTimes)
+
+    def earliestArrival(self, source, target, departureSeconds):
+        '''
+        Finds the journey from source to target that arrives first, leaving source no earlier than departureSeconds.
+        The scan starts at the first connection departing at departureSeconds (found by binary search) and stops as soon as connections
+        depart after the best arrival at target found so far, so a query only touches the connections that could matter.
+        Ties on arrival time go to the journey with fewer legs, so we don't hop off a train just to catch it again one stop later.
+        Parameters:
+            source (str): The stop to leave from.
+            target (str): The stop to get to.
+            departureSeconds (int): The earliest time to leave, in seconds after midnight.
+        Returns:
+            legs (list[dict]): One dict per trip ridden, in order, each with 'route', 'trip', 'from', 'to', 'departure' and 'arrival'
+            (times in seconds after midnight). Empty if source is target. None if either stop is unknown or target can't be reached that day.
+        '''
+        sourceNumber = self.stopNumbers.get(source)
+        targetNumber = self.stopNumbers.get(target)
+        if(sourceNumber == None or targetNumber == None):
+            return None
+        if(sourceNumber == targetNumber):
+            return []
+        departureTimes, arrivalTimes = self.departureTimes, self.arrivalTimes
+        departureStops, arrivalStops, connectionTrips = self.departureStops, self.arrivalStops, self.connectionTrips
+        transferSeconds = self.minTransferSeconds
+        readyAt = [UNREACHED] * len(self.stops) #when we can board a trip at each stop (arrival plus the transfer time)
+        readyAt[sourceNumber] = departureSeconds
+        legsTo = [0] * len(self.stops) #how many trips it takes to get to each stop by readyAt
+        arrivedBy = [-1] * len(self.stops) #the connection that gave each stop its readyAt...
+        arrivedFrom = [-1] * len(self.stops) #...and the connection where we boarded that trip
+        boardedAt = [-1] * len(self.trips) #the connection where we got on each trip, -1 if we can't be on it
+        tripLegs = [0] * len(self.trips) #how many trips it takes to be on each trip
+        targetArrival = UNREACHED
+        for connection in range(bisect_left(departureTimes, departureSeconds), len(departureTimes)):
+            departureTime = departureTimes[connection]
+            if(departureTime >= targetArrival):
+                break
+            trip = connectionTrips[connection]
+            departureStop = departureStops[connection]
+            if(readyAt[departureStop] <= departureTime and (boardedAt[trip] < 0 or legsTo[departureStop] + 1 < tripLegs[trip])):
+                boardedAt[trip] = connection #(re)board here if it's the first chance or saves a leg
+                tripLegs[trip] = legsTo[departureStop] + 1
+            elif(boardedAt[trip] < 0):
+                continue
+            arrivalStop = arrivalStops[connection]
+            readyTime = arrivalTimes[connection] + (transferSeconds if arrivalStop != targetNumber else 0)
+            if(readyTime < readyAt[arrivalStop] or (readyTime == readyAt[arrivalStop] and tripLegs[trip] < legsTo[arrivalStop])):
+                readyAt[arrivalStop] = readyTime
+                legsTo[arrivalStop] = tripLegs[trip]
+                arrivedBy[arrivalStop] = connection
+                arrivedFrom[arrivalStop] = boardedAt[trip]
+                if(arrivalStop == targetNumber):
+                    targetArrival = readyTime
+        if(targetArrival == UNREACHED):
+            return None
+
+        legs = []
+        stop = targetNumber
+        while stop != sourceNumber and len(legs) <= len(self.stops): #every leg starts at an earlier stop on the journey, so this always ends
+            lastConnection = arrivedBy[stop]
+            firstConnection = arrivedFrom[stop]
+            trip = connectionTrips[lastConnection]
+            legs.append({"route" : self.tripRoutes[trip], "trip" : self.trips[trip], "from" : self.stops[departureStops[firstConnection]],
+                "to" : self.stops[stop], "departure" : departureTimes[firstConnection], "arrival" : arrivalTimes[lastConnection]})
+            stop = departureStops[firstConnection]
+        legs.reverse()
+        return legs
+
+    def profile(self, source, target, earliestDepartureSeconds=0, latestDepartureSeconds=UNREACHED):
+        '''
+        Profile query: every worthwhile departure from source to target in a time window. A departure is worthwhile if no other one leaves
+        later and still arrives as early (the Pareto set of (departure, arrival) pairs). This is what a 'next trains' board shows.
+        One backward pass over the connections, from the latest departure in the window to the earliest, keeps for every stop the
+        worthwhile (departure, arrival at target) pairs seen so far, and for every trip the earliest arrival at target if you stay on it.
+        Parameters:
+            source (str): The stop to leave from.
+            target (str): The stop to get to.
+            earliestDepartureSeconds (int): Start of the window, in seconds after midnight.
+            latestDepartureSeconds (int): End of the window, in seconds after midnight.
+        Returns:
+            departures (list[tuple[int, int]]): (departure from source, arrival at target) pairs, earliest departure first. Use
+            earliestArrival() with one of the departure times to get the legs. None if either stop is unknown.
+        '''
+        sourceNumber = self.stopNumbers.get(source)
+        targetNumber = self.stopNumbers.get(target)
+        if(sourceNumber == None or targetNumber == None):
+            return None
+        departureTimes, arrivalTimes = self.departureTimes, self.arrivalTimes
+        departureStops, arrivalStops, connectionTrips = self.departureStops, self.arrivalStops, self.connectionTrips
+        transferSeconds = self.minTransferSeconds
+        tripArrival = [UNREACHED] * len(self.trips)
+        #Per stop, the worthwhile pairs found so far. They're found in decreasing departure order, so each list is stored with negated
+        #departures to keep it ascending for bisect, and arrivals decrease along with departures.
+        negatedDepartures = [[] for _ in self.stops]
+        profileArrivals = [[] for _ in self.stops]
+        firstConnection = bisect_left(departureTimes, earliestDepartureSeconds)
+        for connection in range(bisect_right(departureTimes, latestDepartureSeconds) - 1, firstConnection - 1, -1):
+            departureTime = departureTimes[connection]
+            arrivalStop = arrivalStops[connection]
+            trip = connectionTrips[connection]
+            if(arrivalStop == targetNumber):
+                arrival = arrivalTimes[connection]
+            else: #change at arrivalStop to the best worthwhile departure we can still catch, or stay on the trip
+                stopDepartures = negatedDepartures[arrivalStop]
+                catchable = bisect_right(stopDepartures, -(arrivalTimes[connection] + transferSeconds)) - 1
+                arrival = profileArrivals[arrivalStop][catchable] if catchable >= 0 else UNREACHED
+            arrival = min(arrival, tripArrival[trip])
+            if(arrival == UNREACHED):
+                continue
+            tripArrival[trip] = arrival
+            departureStop = departureStops[connection]
+            stopDepartures = negatedDepartures[departureStop]
+            stopArrivals = profileArrivals[departureStop]
+            if(not stopArrivals or arrival < stopArrivals[-1]): #otherwise a later departure from here already arrives as early
+                if(stopDepartures and stopDepartures[-1] == -departureTime):
+                    stopArrivals[-1] = arrival
+                else:
+                    stopDepartures.append(-departureTime)
+                    stopArrivals.append(arrival)
+        return [(-negatedDeparture, arrival) for negatedDeparture, arrival in zip(reversed(negatedDepartures[sourceNumber]), reversed(profileArrivals[sourceNumber]))]
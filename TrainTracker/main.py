@@ -1,18 +1,36 @@
 from utils import loadEnvironmentVariablesFromFile
 import os
+import atexit
+from instrumentation import getMetrics
 from transit_requester import TransitRequester
-from questions import doQuestionOne, doQuestionTwo, doQuestionThree
+from questions import doQuestionOne, doQuestionTwo, doQuestionThree, buildDerivedData
 
 def main():
 	loadEnvironmentVariablesFromFile()
 
+	metricsPath = os.getenv('MBTA_METRICS_PATH') #if set, record API calls, cache hits and graph timings, and write a summary there on exit.
+	if(metricsPath):
+		getMetrics().enable(profile=os.getenv('MBTA_PROFILE') == '1')
+		atexit.register(getMetrics().writeSummary, metricsPath)
+
 	requesterObject = TransitRequester( #build a requester object that uses the MBTA api. 
         os.getenv('MBTA_API_KEY'),
         os.getenv('MBTA_API_ENDPOINT'))
 
+	gtfsPath = os.getenv('MBTA_GTFS_PATH') #if set, read the network from a local GTFS feed instead of the API.
+	if(gtfsPath):
+		requesterObject.buildRouteAndStopRelationshipsFromGTFS(gtfsPath)
+
+	snapshotPath = os.getenv('MBTA_SNAPSHOT_PATH') #if set, load the network from a local snapshot instead of crawling the API on every start.
+	if(snapshotPath and not gtfsPath):
+		requesterObject.loadRelationshipsFromSnapshot(
+			snapshotPath,
+			ttlSeconds=float(os.getenv('MBTA_SNAPSHOT_TTL_SECONDS', 24 * 60 * 60)),
+			derivedDataBuilder=buildDerivedData)
+
 	doQuestionOne(requesterObject)
 	doQuestionTwo(requesterObject)
-	doQuestionThree(requesterObject)
+	doQuestionThree(requesterObject, withSchedules=os.getenv('MBTA_USE_SCHEDULES') == '1') #if set, also show departure and arrival times
 
 if __name__ == "__main__":
 	main()
\ No newline at end of file
@@ -0,0 +1,354 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+SCHEDULE_TRIPS = 18 #trips per route and direction in the synthetic timetable
+SCHEDULE_HEADWAY_SECONDS = 600
+SCHEDULE_STOP_SECONDS = 120
+
+class RecordedNetwork:
+    '''
+    The data behind the stand-in server: the subway routes, and the stops on each route in order.
+    It can come from a synthetic generator (any size we like) or from responses recorded from the real MBTA API.
+    '''
+    def __init__(self, routes, routeStops):
+        '''
+        Constructor for RecordedNetwork.
+        Parameters:
+            routes (list[dict]): JSON:API route resources, like the 'data' of a /routes response.
+            routeStops (dict[str, list[dict]]): For each route id, the JSON:API stop resources on it in order, like the 'data' of /stops?filter[route]=id.
+        '''
+        self.routes = routes
+        self.routeStops = routeStops
+
+    @classmethod
+    def synthetic(cls, numRoutes=12, stopsPerRoute=20, seed=0):
+        '''
+        Generates a network shaped like the subway: a handful of long routes where each one shares a transfer stop with the next,
+        and a downtown hub shared by every third route.
+        Parameters:
+            numRoutes (int): How many routes to generate.
+            stopsPerRoute (int): How many stops each route has (at least 3).
+            seed (int): Seed for the random number generator, so the same arguments always give the same network.
+        Returns:
+            RecordedNetwork: The generated network.
+        '''
+        randomGenerator = random.Random(seed)
+        stopsPerRoute = max(3, stopsPerRoute)
+        routes = []
+        routeStops = {}
+        for routeNumber in range(numRoutes):
+            routeId = f"Route-{routeNumber}"
+            routes.append({"type" : "route", "id" : routeId,
+                "attributes" : {"long_name" : f"Synthetic Line {routeNumber}", "type" : randomGenerator.choice([0, 1]), "color" : "DA291C"}})
+            stopNames = [f"Stop {routeNumber}-{position}" for position in range(stopsPerRoute)]
+            if(routeNumber > 0):
+                stopNames[0] = f"Stop {routeNumber - 1}-{stopsPerRoute - 1}" #transfer to the previous route
+            if(routeNumber % 3 == 0):
+                stopNames[stopsPerRoute // 2] = "Central Hub"
+            routeStops[routeId] = [cls.stopResource(name) for name in stopNames]
+        return cls(routes, routeStops)
+
+    @staticmethod
+    def stopResource(name):
+        return {"type" : "stop", "id" : "place-" + hashlib.sha1(name.encode("utf-8")).hexdigest()[:10],
+            "attributes" : {"name" : name, "latitude" : 42.35, "longitude" : -71.06, "wheelchair_boarding" : 1}}
+
+    @classmethod
+    def load(cls, directory):
+        '''
+        Loads responses previously saved with record().
+        Parameters:
+            directory (str): A directory with routes.json and one stops_<route id>.json per route.
+        Returns:
+            RecordedNetwork: The recorded network.
+        '''
+        with open(os.path.join(directory, "routes.json")) as routesFile:
+            routes = json.load(routesFile)["data"]
+        routeStops = {}
+        for route in routes:
+            with open(os.path.join(directory, f"stops_{route['id']}.json")) as stopsFile:
+                routeStops[route["id"]] = json.load(stopsFile)["data"]
+        return cls(routes, routeStops)
+
+    @staticmethod
+    def record(apiKey, apiEndpoint, directory):
+        '''
+        Saves real /routes and /stops responses from the MBTA API to directory, so the stand-in server can replay them offline.
+        Parameters:
+            apiKey (str): MBTA API key.
+            apiEndpoint (str): Something like 'https://api-v3.mbta.com'.
+            directory (str): Where to write the responses. Created if needed.
+        '''
+        import requests #only needed for recording
+        os.makedirs(directory, exist_ok=True)
+        headers = {"x-api-key" : apiKey}
+        routesResponse = requests.get(apiEndpoint + "/routes/", headers=headers, params={"filter[type]" : "0,1"})
+        with open(os.path.join(directory, "routes.json"), "w") as routesFile:
+            routesFile.write(routesResponse.text)
+        for route in routesResponse.json()["data"]:
+            stopsResponse = requests.get(apiEndpoint + "/stops/", headers=headers, params={"filter[route]" : route["id"]})
+            with open(os.path.join(directory, f"stops_{route['id']}.json"), "w") as stopsFile:
+                stopsFile.write(stopsResponse.text)
+
+def applySparseFieldset(resource, query):
+    '''
+    Applies a JSON:API fields[type] parameter like the real API does: only the listed attributes are kept. An empty list keeps none.
+    '''
+    fieldsParameter = f"fields[{resource['type']}]"
+    if(fieldsParameter not in query):
+        return resource
+    wanted = [field for field in query[fieldsParameter][0].split(",") if field]
+    trimmed = {"type" : resource["type"], "id" : resource["id"], "attributes" : {key : resource["attributes"][key] for key in wanted if key in resource["attributes"]}}
+    if("relationships" in resource):
+        trimmed["relationships"] = resource["relationships"]
+    return trimmed
+
+class MockMbtaServer:
+    '''
+    A local stand-in for the MBTA v3 API that replays a RecordedNetwork, for repeatable tests and benchmarks of TransitRequester.
+    It serves the endpoints TransitRequester uses (/routes, /stops, /route_patterns with include and pagination, and a synthetic /schedules
+    timetable), honors sparse fieldsets, sends ETags and answers If-None-Match with 304, and can add latency and enforce a rate limit with
+    the same x-ratelimit-* headers and 429 responses as the real API.
+    '''
+    def __init__(self, network, latencySeconds=0.0, rateLimit=None, rateLimitWindowSeconds=60.0, host="127.0.0.1", port=0):
+        '''
+        Constructor for MockMbtaServer.
+        Parameters:
+            network (RecordedNetwork): The data to serve.
+            latencySeconds (float): Extra delay added to every response, to simulate a round trip to the real API.
+            rateLimit (int): How many requests are allowed per window. None means unlimited.
+            rateLimitWindowSeconds (float): Length of the rate limit window.
+            host (str): Interface to listen on.
+            port (int): Port to listen on. 0 picks a free port.
+        '''
+        self.network = network
+        self.latencySeconds = latencySeconds
+        self.rateLimit = rateLimit
+        self.rateLimitWindowSeconds = rateLimitWindowSeconds
+        self.lock = threading.Lock()
+        self.requestCount = 0
+        self.requestLog = [] #(path, query) of every request, for tests
+        self.windowStart = time.time()
+        self.windowCount = 0
+        self.httpServer = ThreadingHTTPServer((host, port), self.buildHandler())
+        self.httpServer.daemon_threads = True
+        self.endpoint = f"http://{host}:{self.httpServer.server_address[1]}"
+        self.thread = None
+
+    def start(self):
+        '''
+        Starts serving in a background thread. Returns self so it can be used as 'server = MockMbtaServer(...).start()'.
+        '''
+        self.thread = threading.Thread(target=self.httpServer.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exceptionInfo):
+        self.stop()
+
+    def takeRateLimitToken(self):
+        '''
+        Counts a request against the rate limit.
+        Returns:
+            (allowed, remaining, resetAt) (tuple[bool, int, int]): Whether the request may proceed, requests left in this window, and when it resets.
+        '''
+        with self.lock:
+            self.requestCount += 1
+            now = time.time()
+            if(now - self.windowStart >= self.rateLimitWindowSeconds):
+                self.windowStart = now
+                self.windowCount = 0
+            resetAt = math.ceil(self.windowStart + self.rateLimitWindowSeconds) #round up, so clients never retry before the window actually ends
+            if(self.rateLimit == None):
+                return True, 1000000, resetAt
+            if(self.windowCount >= self.rateLimit):
+                return False, 0, resetAt
+            self.windowCount += 1
+            return True, self.rateLimit - self.windowCount, resetAt
+
+    def answer(self, path, query):
+        '''
+        Builds the JSON:API document for a request.
+        Returns:
+            (status, document) (tuple[int, dict]): The HTTP status and the response document.
+        '''
+        path = path.rstrip("/")
+        if(path == "/routes"):
+            routes = self.network.routes
+            if("filter[type]" in query):
+                types = {int(routeType) for routeType in query["filter[type]"][0].split(",")}
+                routes = [route for route in routes if route["attributes"].get("type", 0) in types or "type" not in route["attributes"]]
+            return 200, {"data" : [applySparseFieldset(route, query) for route in routes]}
+        if(path == "/stops"):
+            if("filter[route]" in query):
+                routeIds = query["filter[route]"][0].split(",")
+            else: #filter[route_type] or nothing: every subway stop
+                routeIds = list(self.network.routeStops.keys())
+            stops = {}
+            for routeId in routeIds:
+                for stop in self.network.routeStops.get(routeId, []):
+                    stops.setdefault(stop["id"], stop)
+            return 200, {"data" : [applySparseFieldset(stop, query) for stop in stops.values()]}
+        if(path == "/route_patterns"):
+            return 200, self.answerRoutePatterns(query)
+        if(path == "/schedules"):
+            return 200, self.answerSchedules(query)
+        return 404, {"errors" : [{"status" : "404", "code" : "not_found"}]}
+
+    def answerRoutePatterns(self, query):
+        '''
+        One typical route pattern per route, with its representative trip and stops available through include. Supports page[limit]/page[offset].
+        '''
+        routeIds = query["filter[route]"][0].split(",") if "filter[route]" in query else list(self.network.routeStops.keys())
+        patterns = [routeId for routeId in routeIds if routeId in self.network.routeStops]
+        page, links = self.paginate(patterns, query, "/route_patterns")
+        includeTrips = "include" in query and "representative_trip" in query["include"][0]
+        includeStops = "include" in query and "representative_trip.stops" in query["include"][0]
+        data = []
+        included = {}
+        for routeId in page:
+            tripId = f"trip-{routeId}"
+            data.append(applySparseFieldset({"type" : "route_pattern", "id" : f"{routeId}-0", "attributes" : {"typicality" : 1, "direction_id" : 0},
+                "relationships" : {"route" : {"data" : {"type" : "route", "id" : routeId}}, "representative_trip" : {"data" : {"type" : "trip", "id" : tripId}}}}, query))
+            stops = self.network.routeStops[routeId]
+            if(includeTrips):
+                included[("trip", tripId)] = applySparseFieldset({"type" : "trip", "id" : tripId, "attributes" : {"headsign" : routeId},
+                    "relationships" : {"stops" : {"data" : [{"type" : "stop", "id" : stop["id"]} for stop in stops]}}}, query)
+            if(includeStops):
+                for stop in stops:
+                    included[("stop", stop["id"])] = applySparseFieldset(stop, query)
+        return {"data" : data, "included" : list(included.values()), "links" : links}
+
+    def answerSchedules(self, query):
+        '''
+        A synthetic timetable for filter[date]: on every route, a trip in each direction every SCHEDULE_HEADWAY_SECONDS from 06:00 for
+        SCHEDULE_TRIPS trips, taking SCHEDULE_STOP_SECONDS between stops. Stops are available through include. Supports page[limit]/page[offset].
+        '''
+        serviceDate = query.get("filter[date]", [time.strftime("%Y-%m-%d")])[0]
+        routeIds = query["filter[route]"][0].split(",") if "filter[route]" in query else list(self.network.routeStops.keys())
+        formatTime = lambda seconds: f"{serviceDate}T{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}-04:00"
+        schedules = []
+        for routeId in routeIds:
+            stops = self.network.routeStops.get(routeId, [])
+            for direction, orderedStops in ((0, stops), (1, stops[::-1])):
+                for tripNumber in range(SCHEDULE_TRIPS):
+                    tripId = f"{routeId}-{direction}-{tripNumber}"
+                    for sequence, stop in enumerate(orderedStops):
+                        stopTime = 6 * 3600 + tripNumber * SCHEDULE_HEADWAY_SECONDS + sequence * SCHEDULE_STOP_SECONDS
+                        schedules.append((applySparseFieldset({"type" : "schedule", "id" : f"schedule-{tripId}-{sequence + 1}",
+                            "attributes" : {"arrival_time" : formatTime(stopTime) if sequence > 0 else None,
+                                "departure_time" : formatTime(stopTime) if sequence < len(orderedStops) - 1 else None,
+                                "stop_sequence" : sequence + 1, "direction_id" : direction},
+                            "relationships" : {"route" : {"data" : {"type" : "route", "id" : routeId}}, "trip" : {"data" : {"type" : "trip", "id" : tripId}},
+                                "stop" : {"data" : {"type" : "stop", "id" : stop["id"]}}}}, query), stop))
+        page, links = self.paginate(schedules, query, "/schedules")
+        included = {}
+        if("include" in query and "stop" in query["include"][0].split(",")):
+            for _, stop in page:
+                included[stop["id"]] = applySparseFieldset(stop, query)
+        return {"data" : [schedule for schedule, _ in page], "included" : list(included.values()), "links" : links}
+
+    def paginate(self, resources, query, path):
+        '''
+        Applies page[limit]/page[offset] to resources.
+        Returns:
+            (page, links) (tuple[list, dict]): The resources on this page, and the document's links ('next' if there are more pages).
+        '''
+        offset = int(query.get("page[offset]", ["0"])[0])
+        limit = int(query["page[limit]"][0]) if "page[limit]" in query else len(resources)
+        links = {}
+        if(offset + limit < len(resources)):
+            nextQuery = {key : values[0] for key, values in query.items()}
+            nextQuery["page[offset]"] = str(offset + limit)
+            links["next"] = f"{self.endpoint}{path}/?{urlencode(nextQuery)}"
+        return resources[offset:offset + limit], links
+
+    def buildHandler(self):
+        mockServer = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" #keep-alive, like the real API
+            disable_nagle_algorithm = True #headers and body go out as separate writes. With Nagle on, each keep-alive response waits ~40ms for a delayed ACK.
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                query = parse_qs(url.query, keep_blank_values=True)
+                with mockServer.lock:
+                    mockServer.requestLog.append((url.path, query))
+                if(mockServer.latencySeconds):
+                    time.sleep(mockServer.latencySeconds)
+                allowed, remaining, resetAt = mockServer.takeRateLimitToken()
+                if(not allowed):
+                    self.sendBody(429, {"errors" : [{"status" : "429", "code" : "rate_limited"}]}, remaining, resetAt)
+                    return
+                status, document = mockServer.answer(url.path, query)
+                body = json.dumps(document).encode("utf-8")
+                etag = 'W/"' + hashlib.sha1(body).hexdigest() + '"'
+                if(status == 200 and self.headers.get("If-None-Match") == etag):
+                    self.sendBody(304, None, remaining, resetAt, etag)
+                else:
+                    self.sendBody(status, body, remaining, resetAt, etag)
+
+            def sendBody(self, status, body, remaining, resetAt, etag=None):
+                if(isinstance(body, dict)):
+                    body = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/vnd.api+json")
+                self.send_header("x-ratelimit-limit", str(mockServer.rateLimit or 1000000))
+                self.send_header("x-ratelimit-remaining", str(remaining))
+                self.send_header("x-ratelimit-reset", str(resetAt))
+                if(etag != None):
+                    self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body or b"")))
+                self.end_headers()
+                if(body):
+                    self.wfile.write(body)
+
+            def log_message(self, format, *args): #don't print every request
+                pass
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a stand-in for the MBTA API, or record real responses for it to replay.")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--recorded", help="directory of recorded responses to replay (default: a synthetic network)")
+    parser.add_argument("--record", help="record real MBTA responses into this directory and exit")
+    parser.add_argument("--routes", type=int, default=12, help="synthetic network size")
+    parser.add_argument("--stops-per-route", type=int, default=20, help="synthetic network size")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every response")
+    parser.add_argument("--rate-limit", type=int, help="requests allowed per --rate-limit-window seconds")
+    parser.add_argument("--rate-limit-window", type=float, default=60.0)
+    arguments = parser.parse_args()
+
+    if(arguments.record):
+        from utils import loadEnvironmentVariablesFromFile
+        loadEnvironmentVariablesFromFile()
+        RecordedNetwork.record(os.getenv('MBTA_API_KEY'), os.getenv('MBTA_API_ENDPOINT'), arguments.record)
+        return
+    if(arguments.recorded):
+        network = RecordedNetwork.load(arguments.recorded)
+    else:
+        network = RecordedNetwork.synthetic(arguments.routes, arguments.stops_per_route)
+    mockServer = MockMbtaServer(network, arguments.latency, arguments.rate_limit, arguments.rate_limit_window, port=arguments.port)
+    print(f"Serving a stand-in MBTA API on {mockServer.endpoint}")
+    try:
+        mockServer.httpServer.serve_forever()
+    except KeyboardInterrupt:
+        print("Terminating server")
+
+if __name__ == "__main__":
+    main()
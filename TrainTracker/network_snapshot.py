@@ -0,0 +1,105 @@
+import marshal
+import os
+import struct
+import time
+import zlib
+try: #import as a package member (pytest) or as a sibling script (main.py)
+    from .route_path_index import RoutePathIndex
+    from .compact_graph import CompactRouteGraph
+except ImportError:
+    from route_path_index import RoutePathIndex
+    from compact_graph import CompactRouteGraph
+
+SNAPSHOT_MAGIC = b"TTNS" #Train Tracker Network Snapshot
+SNAPSHOT_VERSION = 5 #Bump this whenever the layout of the payload changes, so old files get rebuilt instead of misread.
+HEADER = struct.Struct("<4sHd") #magic, version, createdAt (unix time). Fixed size so the timestamp can be rewritten in place.
+
+class NetworkSnapshot:
+    '''
+    An on-disk copy of everything we learned about the subway network from the transit API, so a fresh process can start from a local
+    file load instead of crawling the API again.
+    The file is a small fixed-size header followed by a zlib compressed marshal of the payload. The payload only holds builtin types
+    (the route graph and path index are stored as raw tables), so a snapshot written by main.py can be read under pytest and vice versa,
+    and loading a file never runs code the way unpickling one can.
+    '''
+    def __init__(self, routeToStops, stopToRoutes, routeConnectionGraph=None, validators=None, createdAt=None, routePathIndex=None, routeNames=None):
+        '''
+        Constructor for NetworkSnapshot.
+        Parameters:
+            routeToStops (dict[str,list[str]]): A dictionary where each key is a route and each value is a list of stops on that route.
+            stopToRoutes (dict[str,list[str]]): A dictionary where each key is a stop and each value is a list of routes that stop is on.
+            routeConnectionGraph (CompactRouteGraph): Optional route graph derived from the dictionaries above.
+            validators (list[dict[str,str]]): Optional 'etag'/'lastModified' values the API sent with the data, used for conditional requests.
+            createdAt (float): Unix time the data was last known to be current. Defaults to now.
+            routePathIndex (RoutePathIndex): Optional precomputed paths between every pair of routes in routeConnectionGraph.
+            routeNames (list[str]): Optional long name of every route, as returned by TransitRequester.getAllTrainRouteNames().
+        '''
+        self.routeToStops = routeToStops
+        self.stopToRoutes = stopToRoutes
+        self.routeConnectionGraph = routeConnectionGraph
+        self.validators = validators
+        self.routePathIndex = routePathIndex
+        self.routeNames = routeNames
+        self.createdAt = time.time() if createdAt == None else createdAt
+
+    def isFresh(self, ttlSeconds):
+        '''
+        Returns:
+            bool: True if the snapshot is younger than ttlSeconds and can be used without asking the API.
+        '''
+        return time.time() - self.createdAt < ttlSeconds
+
+    def save(self, path):
+        '''
+        Writes the snapshot to path. We write to a temporary file first and then rename it, so a reader never sees a half written file.
+        Parameters:
+            path (str): Where to write the snapshot.
+        '''
+        payload = {
+            "routeToStops" : dict(self.routeToStops),
+            "stopToRoutes" : dict(self.stopToRoutes),
+            "routeGraphTables" : self.routeConnectionGraph.getTables() if self.routeConnectionGraph != None else None,
+            "validators" : self.validators,
+            "routePathTables" : self.routePathIndex.getTables() if self.routePathIndex != None else None,
+            "routeNames" : self.routeNames
+        }
+        body = zlib.compress(marshal.dumps(payload))
+        temporaryPath = f"{path}.tmp"
+        with open(temporaryPath, "wb") as snapshotFile:
+            snapshotFile.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.createdAt))
+            snapshotFile.write(body)
+        os.replace(temporaryPath, path)
+
+    def touch(self, path):
+        '''
+        Marks the snapshot at path as current again (e.g. after the API told us nothing changed) by rewriting only the header.
+        Parameters:
+            path (str): The file this snapshot was loaded from.
+        '''
+        self.createdAt = time.time()
+        with open(path, "r+b") as snapshotFile:
+            snapshotFile.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.createdAt))
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Reads a snapshot from path.
+        Parameters:
+            path (str): The file to read.
+        Returns:
+            NetworkSnapshot: The loaded snapshot, or None if the file is missing, corrupt, or was written by a different snapshot version.
+        '''
+        try:
+            with open(path, "rb") as snapshotFile:
+                magic, version, createdAt = HEADER.unpack(snapshotFile.read(HEADER.size))
+                if(magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION):
+                    return None
+                payload = marshal.loads(zlib.decompress(snapshotFile.read()))
+            routeGraphTables = payload["routeGraphTables"]
+            routeConnectionGraph = CompactRouteGraph.fromTables(routeGraphTables) if routeGraphTables != None else None
+            routePathTables = payload["routePathTables"]
+            routePathIndex = RoutePathIndex.fromTables(routePathTables) if routePathTables != None else None
+            return cls(payload["routeToStops"], payload["stopToRoutes"], routeConnectionGraph, payload["validators"], createdAt, routePathIndex,
+                payload["routeNames"])
+        except Exception: #a snapshot is only a cache, so anything wrong with the file (missing keys, truncated tables...) just means rebuilding
+            return None
@@ -0,0 +1,248 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from urllib.parse import urlsplit, parse_qs
+try: #import as a package member (pytest) or as a sibling script
+    from .utils import loadEnvironmentVariablesFromFile
+    from .transit_requester import TransitRequester
+    from .questions import buildDerivedData, findLongestAndShortestRoutes, findConnectingStops, planTrip, resolveStopName
+except ImportError:
+    from utils import loadEnvironmentVariablesFromFile
+    from transit_requester import TransitRequester
+    from questions import buildDerivedData, findLongestAndShortestRoutes, findConnectingStops, planTrip, resolveStopName
+
+MAX_HEADER_LINES = 100 #Reject clients that send an unreasonable number of headers instead of buffering them forever.
+
+STATUS_REASONS = {200 : "OK", 400 : "Bad Request", 404 : "Not Found", 405 : "Method Not Allowed",
+    431 : "Request Header Fields Too Large", 503 : "Service Unavailable"}
+
+def encodeJson(payload):
+    '''
+    Serializes a response payload to compact JSON bytes.
+    '''
+    return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+class NetworkState:
+    '''
+    Everything the server needs to answer queries, loaded once from a TransitRequester.
+    Answers that don't depend on the query (route names, longest/shortest route, connecting stops) are serialized up front, so serving
+    them is just a write. A refresh builds a whole new NetworkState and swaps it in, so requests never see a half updated network.
+    '''
+    def __init__(self, requesterObject):
+        '''
+        Constructor for NetworkState. Makes blocking API calls (unless the requester was loaded from a snapshot), so run it in a thread.
+        Parameters:
+            requesterObject (TransitRequester): A requester whose relationship dicts are (or can be) built.
+        '''
+        self.requesterObject = requesterObject
+        buildDerivedData(requesterObject)
+        requesterObject.getStopNameIndex()
+        routeToStopsDict = requesterObject.getRouteToStopsDict()
+        stopToRoutesDict = requesterObject.getStopToRoutesDict()
+        (longestRoute, numStopsOnLongestRoute), (shortestRoute, numStopsOnShortestRoute) = findLongestAndShortestRoutes(routeToStopsDict)
+        self.loadedAt = time.time()
+        self.staticResponses = {
+            "/routes/names" : encodeJson({"routeNames" : requesterObject.getRouteNames()}),
+            "/routes/extremes" : encodeJson({
+                "longest" : {"route" : longestRoute, "stops" : numStopsOnLongestRoute},
+                "shortest" : {"route" : shortestRoute, "stops" : numStopsOnShortestRoute}}),
+            "/stops" : encodeJson({"stops" : list(stopToRoutesDict.keys())}),
+            "/stops/connecting" : encodeJson({"connectingStops" : findConnectingStops(stopToRoutesDict)})
+        }
+
+    def answerPath(self, query):
+        '''
+        Answers a 'path from A to B' query with the fewest-transfer itinerary.
+        Parameters:
+            query (dict[str,list[str]]): The parsed query string. Needs 'from' and 'to' stop names (case and punctuation insensitive).
+        Returns:
+            (status, body) (tuple[int, bytes]): The HTTP status code and the JSON body.
+        '''
+        if("from" not in query or "to" not in query):
+            return 400, encodeJson({"error" : "Both 'from' and 'to' query parameters are required."})
+        stopA = resolveStopName(self.requesterObject, query["from"][0])
+        stopB = resolveStopName(self.requesterObject, query["to"][0])
+        if(stopA == None or stopB == None):
+            return 404, encodeJson({"error" : "Unknown stop name.", "from" : stopA, "to" : stopB})
+        itinerary = planTrip(self.requesterObject, stopA, stopB)
+        if(itinerary == None):
+            return 404, encodeJson({"error" : "No path between these stops.", "from" : stopA, "to" : stopB})
+        return 200, encodeJson({"from" : stopA, "to" : stopB, "routes" : itinerary["routes"], "transfers" : itinerary["transfers"]})
+
+class QueryServer:
+    '''
+    A long-running asyncio HTTP/JSON server that answers the questions from main.py for many clients at once:
+        GET /routes/names           long names of every subway route
+        GET /routes/extremes        the routes with the most and fewest stops
+        GET /stops                  every stop name
+        GET /stops/connecting       stops that connect two or more routes, and the routes they connect
+        GET /path?from=A&to=B       the fewest-transfer itinerary between two stops
+        GET /health                 when the network was loaded, and its graph version
+    The network is loaded once at startup and refreshed in the background every refreshSeconds. Loading happens in a worker thread,
+    so the event loop keeps serving the previous network while a refresh is in progress.
+    '''
+    def __init__(self, requesterFactory, snapshotPath=None, snapshotTtlSeconds=24 * 60 * 60, refreshSeconds=60 * 60):
+        '''
+        Constructor for QueryServer.
+        Parameters:
+            requesterFactory (function): Takes no arguments and returns a new TransitRequester. Every load uses a fresh one, so a refresh never
+                mutates the requester that in-flight queries are reading.
+            snapshotPath (str): Optional network snapshot to load from (see TransitRequester.loadRelationshipsFromSnapshot()).
+            snapshotTtlSeconds (float): How long the snapshot can be used without revalidating it.
+            refreshSeconds (float): How often to reload the network in the background. None or 0 disables refreshing.
+        '''
+        self.requesterFactory = requesterFactory
+        self.snapshotPath = snapshotPath
+        self.snapshotTtlSeconds = snapshotTtlSeconds
+        self.refreshSeconds = refreshSeconds
+        self.state = None
+        self.server = None
+        self.refreshTask = None
+
+    def loadNetwork(self, isRefresh=False):
+        '''
+        Builds a new NetworkState from a fresh requester. Blocking, so it's run in a worker thread.
+        Parameters:
+            isRefresh (bool): Whether this is a background refresh. Refreshes always revalidate the snapshot with the API (a conditional
+                request, so an unchanged network still loads from disk). Otherwise a snapshot younger than its TTL would just be reloaded as is.
+        Returns:
+            NetworkState: The loaded network.
+        '''
+        requesterObject = self.requesterFactory()
+        if(self.snapshotPath):
+            ttlSeconds = 0 if isRefresh else self.snapshotTtlSeconds
+            requesterObject.loadRelationshipsFromSnapshot(self.snapshotPath, ttlSeconds, derivedDataBuilder=buildDerivedData)
+        return NetworkState(requesterObject)
+
+    async def start(self, host="127.0.0.1", port=8080):
+        '''
+        Loads the network, starts listening, and starts the background refresh.
+        Parameters:
+            host (str): Interface to listen on.
+            port (int): Port to listen on. 0 picks a free port (see self.port).
+        '''
+        self.state = await asyncio.get_running_loop().run_in_executor(None, self.loadNetwork)
+        self.server = await asyncio.start_server(self.handleConnection, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        if(self.refreshSeconds):
+            self.refreshTask = asyncio.create_task(self.refreshForever())
+
+    async def stop(self):
+        '''
+        Stops the background refresh and closes the listening socket.
+        '''
+        if(self.refreshTask != None):
+            self.refreshTask.cancel()
+        if(self.server != None):
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def refreshForever(self):
+        '''
+        Reloads the network every self.refreshSeconds and swaps it in. A failed refresh keeps serving the previous network.
+        '''
+        while True:
+            await asyncio.sleep(self.refreshSeconds)
+            try:
+                self.state = await asyncio.get_running_loop().run_in_executor(None, self.loadNetwork, True)
+            except Exception as error: #e.g. the API is down. We'll try again next time.
+                print(f"Network refresh failed, still serving the network loaded at {time.ctime(self.state.loadedAt)}: {error!r}")
+
+    def route(self, method, target):
+        '''
+        Answers a single request.
+        Parameters:
+            method (str): The HTTP method.
+            target (str): The request target, like '/path?from=Alewife&to=Kenmore'.
+        Returns:
+            (status, body) (tuple[int, bytes]): The HTTP status code and the JSON body.
+        '''
+        if(method != "GET"):
+            return 405, encodeJson({"error" : "Only GET is supported."})
+        url = urlsplit(target)
+        state = self.state #grab a reference once, so a refresh in the middle of this request can't mix two networks
+        if(url.path in state.staticResponses):
+            return 200, state.staticResponses[url.path]
+        if(url.path == "/path"):
+            return state.answerPath(parse_qs(url.query))
+        if(url.path == "/health"):
+            return 200, encodeJson({"loadedAt" : state.loadedAt, "graphVersion" : state.requesterObject.graphVersion})
+        return 404, encodeJson({"error" : f"Unknown path {url.path}"})
+
+    @staticmethod
+    def formatResponse(status, body, keepAlive):
+        '''
+        Returns:
+            response (bytes): The status line, headers and body of an HTTP/1.1 JSON response, ready to write to the client.
+        '''
+        return (f"HTTP/1.1 {status} {STATUS_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keepAlive else 'close'}\r\n\r\n").encode("latin-1") + body
+
+    async def handleConnection(self, reader, writer):
+        '''
+        Serves HTTP/1.1 requests on one client connection until the client closes it (keep-alive is the default).
+        '''
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if(not requestLine):
+                    break
+                parts = requestLine.decode("latin-1").split()
+                headers = {}
+                for _ in range(MAX_HEADER_LINES):
+                    headerLine = await reader.readline()
+                    if(headerLine in (b"\r\n", b"\n", b"")):
+                        break
+                    name, _, value = headerLine.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                else: #no end of headers yet. Whatever is left of them would be read as the next request, so answer and hang up instead.
+                    writer.write(self.formatResponse(431, encodeJson({"error" : f"More than {MAX_HEADER_LINES} header lines."}), False))
+                    await writer.drain()
+                    break
+                contentLength = int(headers.get("content-length", 0) or 0)
+                if(contentLength):
+                    await reader.readexactly(contentLength) #we don't use request bodies, but they have to be consumed
+                if(len(parts) != 3):
+                    status, body = 400, encodeJson({"error" : "Malformed request line."})
+                else:
+                    status, body = self.route(parts[0], parts[1])
+                keepAlive = headers.get("connection", "").lower() != "close" and parts[-1:] != ["HTTP/1.0"]
+                writer.write(self.formatResponse(status, body, keepAlive))
+                await writer.drain()
+                if(not keepAlive):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+async def serveForever(queryServer, host, port):
+    await queryServer.start(host, port)
+    print(f"Serving transit queries on http://{host}:{queryServer.port}")
+    async with queryServer.server:
+        await queryServer.server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve subway route queries over HTTP/JSON.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--refresh-seconds", type=float, default=60 * 60, help="how often to reload the network in the background, 0 to disable")
+    arguments = parser.parse_args()
+
+    loadEnvironmentVariablesFromFile()
+    requesterFactory = lambda: TransitRequester(os.getenv('MBTA_API_KEY'), os.getenv('MBTA_API_ENDPOINT'))
+    queryServer = QueryServer(
+        requesterFactory,
+        snapshotPath=os.getenv('MBTA_SNAPSHOT_PATH'),
+        snapshotTtlSeconds=float(os.getenv('MBTA_SNAPSHOT_TTL_SECONDS', 24 * 60 * 60)),
+        refreshSeconds=arguments.refresh_seconds)
+    try:
+        asyncio.run(serveForever(queryServer, arguments.host, arguments.port))
+    except KeyboardInterrupt:
+        print("Terminating server")
+
+if __name__ == "__main__":
+    main()
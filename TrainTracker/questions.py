@@ -1,3 +1,19 @@
+import datetime
+try: #import as a package member (pytest) or as a sibling script (main.py)
+    from .graph_search import shortestPath
+    from .route_path_index import RoutePathIndex
+    from .compact_graph import CompactRouteGraph
+    from .instrumentation import getMetrics, instrumented
+    from .journey_planner import formatServiceTime
+except ImportError:
+    from graph_search import shortestPath
+    from route_path_index import RoutePathIndex
+    from compact_graph import CompactRouteGraph
+    from instrumentation import getMetrics, instrumented
+    from journey_planner import formatServiceTime
+
+SERVICE_DAY_OVERLAP_SECONDS = 4 * 3600 #The previous service day's last trips can still be running this long after midnight.
+
 def doQuestionOne(requesterObject):
     '''
     Answers question one in the take home: List all of the long names of each subway route.
@@ -34,95 +50,191 @@ def doQuestionTwo(requesterObject):
         requesterObject (TransitRequester): Object that can be used to query a transit API. 
     '''
     input("Press enter to see the routes with the most and fewest stops.")
+    (longestRoute, numStopsOnLongestRoute), (shortestRoute, numStopsOnShortestRoute) = findLongestAndShortestRoutes(requesterObject.getRouteToStopsDict())
+    print(f"The longest route is {longestRoute} with {numStopsOnLongestRoute} stops.")
+    print(f"The shortest route is {shortestRoute} with {numStopsOnShortestRoute} stops.")
+    input("Press enter to see a list of the stops that connect two or more routes.")
+    for stop, routes in findConnectingStops(requesterObject.getStopToRoutesDict()).items():
+        print(f"The stop {stop} connects: {routes}")
+
+@instrumented
+def findLongestAndShortestRoutes(routeToStopsDict):
+    '''
+    Helper function for question two. Finds the routes with the most and the fewest stops. Ties go to the route that comes first.
+    Parameters:
+        routeToStopsDict (dict[str,list[str]]): A dictionary where each key is a route and each value is a list of stops on that route.
+    Returns:
+        ((longestRoute, numStopsOnLongestRoute), (shortestRoute, numStopsOnShortestRoute)) (tuple[tuple[str,int],tuple[str,int]]): Both routes
+        and their stop counts. Routes are None if the dictionary is empty.
+    '''
     longestRoute = None
     numStopsOnLongestRoute = None
     shortestRoute = None
     numStopsOnShortestRoute = None
-    routeToStopsDict = requesterObject.getRouteToStopsDict()
     for route in routeToStopsDict.keys(): #Iterate through all routes and find which ones are the longest and shortest. 
-        numStops = len(requesterObject.routeToStops[route])
+        numStops = len(routeToStopsDict[route])
         if(longestRoute == None or numStops > numStopsOnLongestRoute):
             longestRoute = route
             numStopsOnLongestRoute = numStops
         if(shortestRoute == None or numStops < numStopsOnShortestRoute):
             shortestRoute = route
             numStopsOnShortestRoute = numStops
-    print(f"The longest route is {longestRoute} with {numStopsOnLongestRoute} stops.")
-    print(f"The shortest route is {shortestRoute} with {numStopsOnShortestRoute} stops.")
-    input("Press enter to see a list of the stops that connect two or more routes.")
-    stopToRoutesDict = requesterObject.getStopToRoutesDict()
-    for stop in stopToRoutesDict.keys(): #Iterate through all stops and find which ones are on more than one route. 
-        if(len(requesterObject.stopToRoutes[stop]) > 1):
-            print(f"The stop {stop} connects: {requesterObject.stopToRoutes[stop]}")
+    return (longestRoute, numStopsOnLongestRoute), (shortestRoute, numStopsOnShortestRoute)
+
+@instrumented
+def findConnectingStops(stopToRoutesDict):
+    '''
+    Helper function for question two. Finds the stops that connect two or more routes.
+    Parameters:
+        stopToRoutesDict (dict[str,list[str]]): A dictionary where each key is a stop and each value is a list of routes that stop is on.
+    Returns:
+        connectingStops (dict[str,list[str]]): The stops that are on more than one route, and the routes they're on.
+    '''
+    return {stop : routes for stop, routes in stopToRoutesDict.items() if len(routes) > 1}
 
 def isValidStopName(requesterObject, stopName):
     '''
     Helper function used to validate user input. If the provided string is a stop name (according to the external API),
     return True. Otherwise, return false.
+    Matching goes through the requester's stop name index, so it's a dict lookup that ignores case and punctuation and accepts aliases
+    like 'Kendall' for 'Kendall/MIT'. Use resolveStopName() to get the canonical name back.
     Parameters:
         requesterObject (TransitRequester): Object that can be used to query a transit API.
         stopName (str): String to test for validity. Likely came from user input.
     Returns:
         bool: True if stop name is valid, false otherwise. 
     '''
-    for stop in requesterObject.getStopToRoutesDict():
-        if(stopName == stop):
-            return True
-    return False
+    return resolveStopName(requesterObject, stopName) != None
+
+def resolveStopName(requesterObject, stopName):
+    '''
+    Helper function that turns a stop name as a user typed it into the stop name the API uses.
+    Parameters:
+        requesterObject (TransitRequester): Object that can be used to query a transit API.
+        stopName (str): The name to look up. Likely came from user input.
+    Returns:
+        str: The canonical stop name, or None if stopName doesn't match any stop.
+    '''
+    return requesterObject.getStopNameIndex().resolve(stopName)
 
 def getStopFromUserInput(requesterObject):
     '''
     Helper function for question three. Will prompt the user to enter the name of a subway stop, validate the input, and return
-	the first valid input. Typing exit will exit the program.
+	the canonical name of the first valid input. If the input doesn't match a stop, we suggest stops that start with it. Typing exit will exit the program.
     '''
     while(True):
         userInput = input("Subway stop: ")
         if(userInput.lower() == "exit"):
             print("Terminating program")
             exit(0)
-        if(isValidStopName(requesterObject, userInput)):
-            return userInput
+        stopName = resolveStopName(requesterObject, userInput)
+        if(stopName != None):
+            return stopName
+        suggestions = requesterObject.getStopNameIndex().suggest(userInput, limit=5)
+        if(suggestions):
+            print(f"Invalid input. Did you mean one of: {suggestions}?")
         else:
             print("Invalid input. Try again.")
 
+@instrumented
 def buildRouteConnectionGraph(requesterObject):
     '''
     Here we build a graph where each node is a subway route, and each edge is a stop that connects two routes.
     We assume that each edge is bidirectional, i.e. if you can get from Route A to Route B through stop X, you can
     also get from Route B to Route A through the same stop. 
-    We'll represent the graph as a dictionary, where each key is a route and each value is a list of routes that the key is 
-    directly connected to. We wont be storing data about the stops that connect the routes for the sake of simplicity.
+    The graph is a CompactRouteGraph: routes and stops are interned to integers and the adjacency is stored as flat arrays, and each
+    edge also remembers the stops that make it up (see getTransferStops()). It still behaves like a dictionary where each key is a route and
+    each value is a list of routes that the key is directly connected to.
+    The graph is cached on the requester object, so it's only built once per set of relationship dicts (or loaded from a snapshot).
     Parameters: 
         requesterObject (TransitRequester): Object that can be used to query a transit API. 
     Returns: 
-        routeConnectionGraph dict[str,list[str]]: A dictionary that represents the connections between subway routes. 
+        routeConnectionGraph (CompactRouteGraph): A read-only dict[str,list[str]] that represents the connections between subway routes. 
+    '''
+    getMetrics().increment("traintracker_cache_lookups_total", cache="route_graph", result="miss" if requesterObject.routeConnectionGraph == None else "hit")
+    if(requesterObject.routeConnectionGraph != None):
+        return requesterObject.routeConnectionGraph
+    routeIds = requesterObject.getRouteToStopsDict().keys() #every route is a key here, so we don't need another API request (or an API at all, for GTFS)
+    routeConnectionGraph = CompactRouteGraph(routeIds, requesterObject.getStopToRoutesDict())
+    requesterObject.routeConnectionGraph = routeConnectionGraph
+    return routeConnectionGraph
+
+@instrumented
+def planTrip(requesterObject, stopA, stopB):
+    '''
+    Finds the itinerary from stopA to stopB with the fewest transfers. Unlike picking one route per stop, this considers every route that
+    serves either stop (which matters at stations like Park Street). The routes come from the route path index, so there's no search per
+    query, just table lookups for each pair of routes at the two stops. The transfer stops come from the route graph, whose edges know them.
+    Parameters: 
+        requesterObject (TransitRequester): Object that can be used to query a transit API.
+        stopA (str): The stop the trip starts at.
+        stopB (str): The stop the trip ends at.
+    Returns:
+        itinerary (dict): {"routes" : [...], "transfers" : [...]}, where routes are the routes to ride in order, and transfers[i] lists the
+        stops where you can change from routes[i] to routes[i + 1]. Returns None if either stop is unknown or no itinerary exists.
     '''
-    routeConnectionGraph = dict() #initialize the routeConnectionGraph with key/value pairs of routeId/empty list. 
-    routeIds = requesterObject.getAllTrainRouteIds()
-    for route in routeIds:
-        routeConnectionGraph[route] = []
-        
     stopToRoutesDict = requesterObject.getStopToRoutesDict()
+    if(stopA not in stopToRoutesDict or stopB not in stopToRoutesDict):
+        return None
+    graph = buildRouteConnectionGraph(requesterObject)
+    routes = getRoutePathIndex(requesterObject).getPathBetween(stopToRoutesDict[stopA], stopToRoutesDict[stopB])
+    if(not routes):
+        return None
+    transfers = [graph.getTransferStops(route, nextRoute) for route, nextRoute in zip(routes, routes[1:])]
+    return {"routes" : routes, "transfers" : transfers}
 
-    for stop in stopToRoutesDict.keys(): #Iterate through all stops and find which ones are on more than one route.
-        routesOnStop = stopToRoutesDict[stop] #the routes associated with this stop
-        if(len(routesOnStop) > 1): #if a stop is on more than one route, create graph edges between each of those routes
-            for route in routesOnStop:
-                routeConnectionGraph[route] = routeConnectionGraph[route] + routesOnStop
-    
-    for route in routeConnectionGraph:
-        routeConnectionGraph[route] = [*set(routeConnectionGraph[route])] #remove all duplicates from the list
-        routeConnectionGraph[route] = [ x for x in routeConnectionGraph[route] if x is not route ] #remove all references to self from the list. 
-    return routeConnectionGraph
-        
-def findShortestPathBFS(graph, start, end):
+@instrumented
+def planTimedTrip(requesterObject, stopA, stopB, departureSeconds, serviceDate=None):
+    '''
+    Like planTrip(), but with real departure and arrival times: finds the journey from stopA to stopB that arrives first when leaving at
+    departureSeconds or later, by scanning the day's scheduled connections (see journey_planner.ConnectionTimetable).
+    Parameters: 
+        requesterObject (TransitRequester): Object that can be used to query a transit API.
+        stopA (str): The stop the trip starts at.
+        stopB (str): The stop the trip ends at.
+        departureSeconds (int): The earliest time to leave stopA, in seconds after midnight.
+        serviceDate (datetime.date): The day to travel. Defaults to today.
+    Returns:
+        legs (list[dict]): The trips to ride in order, each with 'route', 'trip', 'from', 'to', 'departure' and 'arrival'. None if there's
+        no scheduled way to get there that day.
+    '''
+    return requesterObject.getConnectionTimetable(serviceDate).earliestArrival(stopA, stopB, departureSeconds)
+
+def planTimedTripFromNow(requesterObject, stopA, stopB, now=None):
+    '''
+    Like planTimedTrip(), but leaving at a wall clock time instead of a service date and time. Schedules are grouped by service day, and a
+    service day's late trips are dated after midnight of that day (like '24:30'), so in the small hours we also look for a trip on the
+    previous service day, leaving at now + 24 hours, and keep whichever journey arrives first.
+    Parameters:
+        requesterObject (TransitRequester): Object that can be used to query a transit API.
+        stopA (str): The stop the trip starts at.
+        stopB (str): The stop the trip ends at.
+        now (datetime.datetime): When to leave. Defaults to now.
+    Returns:
+        legs (list[dict]): Same as planTimedTrip(), but with times in seconds after midnight of now's date. None if there's no scheduled
+        way to get there.
+    '''
+    now = now or datetime.datetime.now()
+    secondsToday = now.hour * 3600 + now.minute * 60 + now.second
+    bestLegs = planTimedTrip(requesterObject, stopA, stopB, secondsToday, now.date())
+    if(secondsToday < SERVICE_DAY_OVERLAP_SECONDS):
+        lateLegs = planTimedTrip(requesterObject, stopA, stopB, secondsToday + 86400, now.date() - datetime.timedelta(days=1))
+        if(lateLegs != None and (bestLegs == None or lateLegs[-1]["arrival"] - 86400 < bestLegs[-1]["arrival"])):
+            bestLegs = [dict(leg, departure=leg["departure"] - 86400, arrival=leg["arrival"] - 86400) for leg in lateLegs]
+    return bestLegs
+
+@instrumented
+def findShortestPathBFS(graph, start, end, bidirectional=False):
     '''
     This function will perform breadth first search to find the shortest path between start and end, assuming one exists.
+    The search itself lives in graph_search.shortestPath, which tracks visited nodes in a set and rebuilds the path from parent pointers,
+    so it stays linear in the size of the graph.
     Paramaters:
         graph (dict[str, list[str]]): A dictionary representing a graph. Each key in the dictionary is a node in the graph, and each
         value is a list of nodes that that key is connected to. 
         start (str): The node that we should start traversing from. 
         end (str): The node that we are trying to find the shortest path to. 
+        bidirectional (bool): Search from both ends at once. Same path length, but it may pick a different path when there's a tie.
     Returns:
         path (list[str]): The shortest path from start to end. This list will include both the start and end nodes. 
     '''
@@ -131,32 +243,49 @@ def findShortestPathBFS(graph, start, end):
     if(start not in graph.keys() or end not in graph.keys()): #check for case where start and/or end aren't in the graph.
         print("Error: Start or end node not in provided graph")
         return []
-    
-    visited = []
-    queue = [[start]] #this queue is a list of lists, where each list is a potential path from start to end. 
-    while queue:
-        path = queue.pop(0) #get the path we're working on this iteration
-        node = path[-1] #get the last node in the path
-        if node not in visited:
-            neighbors = graph[node]
-            for neighbor in neighbors:
-                newPath = list(path)
-                newPath.append(neighbor) #build a new path that is one node longer than the last and add it to the queue
-                queue.append(newPath)
-                if neighbor == end:
-                    return newPath
-        visited.append(node)
-    print(f"Path not found between {start} and {end}.")
-    return []
-
-def doQuestionThree(requesterObject):
+    path = shortestPath(graph, start, end, bidirectional)
+    if(not path):
+        print(f"Path not found between {start} and {end}.")
+    return path
+
+@instrumented
+def getRoutePathIndex(requesterObject):
+    '''
+    Returns the precomputed paths between every pair of routes, building them if they don't exist yet or if the requester's
+    relationship dicts were rebuilt since they were computed (i.e. requesterObject.graphVersion moved on).
+    Parameters: 
+        requesterObject (TransitRequester): Object that can be used to query a transit API. 
+    Returns:
+        routePathIndex (RoutePathIndex): An index that answers route-to-route path queries with table lookups.
+    '''
+    routePathIndex = requesterObject.routePathIndex
+    isStale = routePathIndex == None or routePathIndex.graphVersion != requesterObject.graphVersion
+    getMetrics().increment("traintracker_cache_lookups_total", cache="route_path_index", result="miss" if isStale else "hit")
+    if(isStale):
+        graph = buildRouteConnectionGraph(requesterObject)
+        routePathIndex = RoutePathIndex(graph, requesterObject.graphVersion)
+        requesterObject.routePathIndex = routePathIndex
+    return routePathIndex
+
+@instrumented
+def buildDerivedData(requesterObject):
+    '''
+    Builds everything we derive from the relationship dicts (the route graph and the route path index) and caches it on the requester.
+    Handy as the derivedDataBuilder for TransitRequester.loadRelationshipsFromSnapshot(), so a snapshot stores all of it.
+    Parameters: 
+        requesterObject (TransitRequester): Object that can be used to query a transit API. 
+    '''
+    buildRouteConnectionGraph(requesterObject)
+    getRoutePathIndex(requesterObject)
+
+def doQuestionThree(requesterObject, withSchedules=False):
     '''
     Answers question three on the takehome. This will prompt for and accept user input. The user can input two train stops, and the program will output 
     a combination of train routes that connects the two stops.
     Parameters: 
         requesterObject (TransitRequester): Object that can be used to query a transit API.
+        withSchedules (bool): Also print when to leave and arrive if you set off now, from today's schedule. Loading the schedule takes a moment.
     '''
-    graph = buildRouteConnectionGraph(requesterObject)
     print("Enter the name of two subway stops. I'll tell you which route(s) you'll need to get from stop A to stop B")
     while(True):
         print("Enter the name for stop A:")
@@ -164,10 +293,19 @@ def doQuestionThree(requesterObject):
         print("Enter the name for stop B:")
         stopB = getStopFromUserInput(requesterObject)
         print(f"Path from {stopA} to {stopB}:")
-        routeA = requesterObject.getStopToRoutesDict()[stopA][0] #get a route that this stop is on
-        routeB = requesterObject.getStopToRoutesDict()[stopB][0]
-        path = findShortestPathBFS(graph, routeA, routeB)
-        print(path)
+        itinerary = planTrip(requesterObject, stopA, stopB) #considers every route serving either stop, not just the first one
+        if(itinerary == None):
+            print([])
+        else:
+            print(itinerary["routes"])
+            for route, nextRoute, transferStops in zip(itinerary["routes"], itinerary["routes"][1:], itinerary["transfers"]):
+                print(f"Transfer from {route} to {nextRoute} at: {transferStops}")
+        if(withSchedules):
+            legs = planTimedTripFromNow(requesterObject, stopA, stopB) #after midnight, yesterday's last trains may still be running
+            if(legs == None):
+                print("No more scheduled trips today.")
+            for leg in legs or []:
+                print(f"{formatServiceTime(leg['departure'])} {leg['route']} from {leg['from']}, arriving at {leg['to']} at {formatServiceTime(leg['arrival'])}")
         userInput = input("Continue? y/n: ")
         if(userInput == "y"):
             continue
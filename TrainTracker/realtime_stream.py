@@ -0,0 +1,228 @@
+import json
+import queue
+import random
+import threading
+from collections import defaultdict
+try: #import as a package member (pytest) or as a sibling script
+    from .response_decoding import relatedId
+except ImportError:
+    from response_decoding import relatedId
+
+def parseServerSentEvents(lines):
+    '''
+    Generator that turns the lines of a text/event-stream response into events.
+    Follows the SSE format: 'event:' and 'data:' fields accumulate until a blank line dispatches the event, and lines starting with ':'
+    are comments (the MBTA API sends them as keep-alives).
+    Parameters:
+        lines (iterable[str]): The response body, one line at a time, without line endings.
+    Yields:
+        (eventName, data) (tuple[str, str]): The event type ('message' if none was given) and its data, with multiple data lines joined by newlines.
+    '''
+    eventName = None
+    dataLines = []
+    for line in lines:
+        if(line == ""):
+            if(dataLines):
+                yield eventName or "message", "\n".join(dataLines)
+            eventName = None
+            dataLines = []
+            continue
+        if(line.startswith(":")):
+            continue
+        field, _, value = line.partition(":")
+        if(value.startswith(" ")):
+            value = value[1:]
+        if(field == "event"):
+            eventName = value
+        elif(field == "data"):
+            dataLines.append(value)
+    if(dataLines): #the stream ended without a final blank line
+        yield eventName or "message", "\n".join(dataLines)
+
+class LiveStateStore:
+    '''
+    In-memory copy of a streamed collection (like /vehicles or /predictions), kept current by applying the API's
+    reset/add/update/remove events one at a time instead of re-fetching the whole collection.
+    Resources are stored by (type, id) and indexed by the route and stop they relate to, so 'vehicles on the Red line' or
+    'predictions at Park Street' are dict lookups. Safe to read from other threads while events are being applied.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.resources = {} #(type, id) -> JSON:API resource
+        self.byRoute = defaultdict(set) #route id -> set of (type, id)
+        self.byStop = defaultdict(set) #stop id -> set of (type, id)
+        self.eventsApplied = 0
+
+    def _index(self, key, resource):
+        routeId = relatedId(resource, "route")
+        stopId = relatedId(resource, "stop")
+        if(routeId != None):
+            self.byRoute[routeId].add(key)
+        if(stopId != None):
+            self.byStop[stopId].add(key)
+
+    def _unindex(self, key):
+        resource = self.resources.pop(key, None)
+        if(resource == None):
+            return
+        for index, relationship in ((self.byRoute, "route"), (self.byStop, "stop")):
+            relatedResourceId = relatedId(resource, relationship)
+            if(relatedResourceId != None):
+                index[relatedResourceId].discard(key)
+                if(not index[relatedResourceId]):
+                    del index[relatedResourceId]
+
+    def _put(self, resource):
+        key = (resource["type"], resource["id"])
+        self._unindex(key) #an update may have moved it to another route or stop
+        self.resources[key] = resource
+        self._index(key, resource)
+
+    def applyEvent(self, eventName, data):
+        '''
+        Applies one streamed event. Unknown event types are ignored.
+        Parameters:
+            eventName (str): 'reset', 'add', 'update' or 'remove'.
+            data (str or object): The event's JSON data, as text or already decoded. reset carries a list of resources, add and update carry one
+                resource, and remove carries a resource identifier ({'type', 'id'}).
+        '''
+        if(isinstance(data, str)):
+            data = json.loads(data)
+        with self.lock:
+            if(eventName == "reset"):
+                self.resources = {}
+                self.byRoute = defaultdict(set)
+                self.byStop = defaultdict(set)
+                for resource in data:
+                    self._put(resource)
+            elif(eventName in ("add", "update")):
+                self._put(data)
+            elif(eventName == "remove"):
+                self._unindex((data["type"], data["id"]))
+            else:
+                return
+            self.eventsApplied += 1
+
+    def get(self, resourceType, resourceId):
+        with self.lock:
+            return self.resources.get((resourceType, resourceId))
+
+    def getForRoute(self, routeId):
+        '''
+        Returns:
+            resources (list[dict]): Every stored resource related to routeId (e.g. the vehicles currently on it).
+        '''
+        with self.lock:
+            return [self.resources[key] for key in self.byRoute.get(routeId, ())]
+
+    def getForStop(self, stopId):
+        '''
+        Returns:
+            resources (list[dict]): Every stored resource related to stopId (e.g. its arrival predictions).
+        '''
+        with self.lock:
+            return [self.resources[key] for key in self.byStop.get(stopId, ())]
+
+    def __len__(self):
+        return len(self.resources)
+
+class StreamingClient:
+    '''
+    Keeps a LiveStateStore current from one of the MBTA API's streaming endpoints (e.g. /vehicles or /predictions with
+    'Accept: text/event-stream').
+    A reader thread parses the stream into a bounded queue and an applier thread drains it into the store. If the store falls behind,
+    the queue fills up and the reader stops reading, so the backlog is pushed back onto the socket instead of piling up in memory.
+    When the connection drops, the reader reconnects with jittered exponential backoff. The API starts every stream with a reset event,
+    so the store is consistent again as soon as the new connection is up.
+    '''
+    def __init__(self, requesterObject, resource, params=None, store=None, maxPendingEvents=1000, initialBackoffSeconds=1.0, maxBackoffSeconds=60.0):
+        '''
+        Constructor for StreamingClient.
+        Parameters:
+            requesterObject (TransitRequester): Supplies the endpoint, API key and pooled HTTP session.
+            resource (str): The collection to stream, like 'vehicles' or 'predictions'.
+            params (dict[str,str]): Query parameters, like {'filter[route]' : 'Red,Orange'}. The API requires a filter for predictions.
+            store (LiveStateStore): Where to apply events. A new store is created if None.
+            maxPendingEvents (int): How many parsed events may wait for the applier before the reader blocks.
+            initialBackoffSeconds (float): Wait before the first reconnect attempt. Doubles (with jitter) after each failure.
+            maxBackoffSeconds (float): Upper bound on the wait between reconnect attempts.
+        '''
+        self.requesterObject = requesterObject
+        self.url = f"{requesterObject.apiEndpoint}/{resource}/"
+        self.params = params or {}
+        self.store = store if store != None else LiveStateStore()
+        self.pendingEvents = queue.Queue(maxsize=maxPendingEvents)
+        self.initialBackoffSeconds = initialBackoffSeconds
+        self.maxBackoffSeconds = maxBackoffSeconds
+        self.stopping = threading.Event()
+        self.response = None
+        self.reconnects = 0
+        self.threads = []
+
+    def start(self):
+        '''
+        Starts the reader and applier threads. Returns self.
+        '''
+        self.threads = [threading.Thread(target=self.readForever, daemon=True), threading.Thread(target=self.applyForever, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        '''
+        Stops streaming and waits for both threads to finish.
+        '''
+        self.stopping.set()
+        if(self.response != None):
+            self.response.close() #unblocks a reader waiting on the socket
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def readForever(self):
+        '''
+        Reader thread: connects to the stream, parses it into events and queues them for the applier, reconnecting with backoff whenever
+        the connection fails, until stop() is called.
+        '''
+        backoffSeconds = self.initialBackoffSeconds
+        headers = dict(self.requesterObject.headerDict)
+        headers["Accept"] = "text/event-stream"
+        while not self.stopping.is_set():
+            try:
+                self.response = self.requesterObject.session.get(self.url, headers=headers, params=self.params, stream=True, timeout=(10, 60))
+                self.response.raise_for_status()
+                self.response.encoding = "utf-8" #SSE is always UTF-8, but without a charset requests would decode text/* as ISO-8859-1
+                for eventName, data in parseServerSentEvents(self.response.iter_lines(decode_unicode=True)):
+                    backoffSeconds = self.initialBackoffSeconds #we're receiving events, so the connection is healthy again
+                    while not self.stopping.is_set():
+                        try:
+                            self.pendingEvents.put((eventName, data), timeout=0.5) #blocks while the applier is behind
+                            break
+                        except queue.Full:
+                            continue
+                    if(self.stopping.is_set()):
+                        return
+            except Exception as error: #dropped connection, HTTP error, timeout... all handled by reconnecting
+                if(self.stopping.is_set()):
+                    return
+                print(f"Stream from {self.url} failed, reconnecting in {backoffSeconds:.1f}s: {error!r}")
+            finally:
+                if(self.response != None):
+                    self.response.close()
+            if(self.stopping.wait(backoffSeconds * random.uniform(0.5, 1.5))):
+                return
+            backoffSeconds = min(self.maxBackoffSeconds, backoffSeconds * 2)
+            self.reconnects += 1
+
+    def applyForever(self):
+        '''
+        Applier thread: applies queued events to the store in order, until stop() is called and the queue is drained.
+        '''
+        while not self.stopping.is_set() or not self.pendingEvents.empty():
+            try:
+                eventName, data = self.pendingEvents.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self.store.applyEvent(eventName, data)
+            except (ValueError, KeyError, TypeError) as error: #one malformed event shouldn't stop the stream
+                print(f"Skipping malformed {eventName} event from {self.url}: {error!r}")
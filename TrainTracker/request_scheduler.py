@@ -0,0 +1,217 @@
+import random
+import requests
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from urllib.parse import unquote, urlsplit
+try: #import as a package member (pytest) or as a sibling script
+    from .instrumentation import getMetrics
+except ImportError:
+    from instrumentation import getMetrics
+
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+class RequestScheduler:
+    '''
+    Sends every GET request a TransitRequester makes, and keeps it within the API's rate limit:
+        -A token bucket driven by the x-ratelimit-remaining/x-ratelimit-reset headers. Once the API says we're out of requests,
+        callers wait for the window to reset instead of collecting 429s. Requests sent from other threads count against the bucket too.
+        -429 and 5xx responses are retried with jittered exponential backoff (or until the rate limit resets, for a 429). So are requests
+        that time out or lose their connection, since every request we send is an idempotent GET.
+        -Single-flight coalescing: concurrent callers asking for the same URL, params and headers share one in-flight request.
+        -A short-lived memo of successful responses with LRU eviction, so asking for the same thing twice in a row costs one request.
+        Only small, unpaginated responses are memoized, and the memo as a whole stays under a byte budget. Big collections like
+        /schedules or a page of route_patterns are read once and thrown away, so keeping them around would only pin memory.
+    '''
+    def __init__(self, session, memoTtlSeconds=5.0, memoMaxEntries=256, maxRetries=4, initialBackoffSeconds=0.5, maxBackoffSeconds=60.0,
+            memoMaxResponseBytes=64 * 1024, memoMaxBytes=2 * 1024 * 1024, requestTimeoutSeconds=(10, 30)):
+        '''
+        Constructor for RequestScheduler.
+        Parameters:
+            session (requests.Session): The pooled session to send requests with.
+            memoTtlSeconds (float): How long a successful response is reused for identical requests. 0 disables the memo.
+            memoMaxEntries (int): How many responses the memo holds before evicting the least recently used one.
+            maxRetries (int): How many times a 429/5xx response (or a timeout or connection error) is retried before it reaches the caller.
+            initialBackoffSeconds (float): Wait before the first retry. Doubles (with jitter) after each one.
+            maxBackoffSeconds (float): Upper bound on any single wait, including waits for the rate limit to reset.
+            memoMaxResponseBytes (int): Responses with a bigger body than this are never memoized.
+            memoMaxBytes (int): How many body bytes the memo holds in total before evicting the least recently used responses.
+            requestTimeoutSeconds (tuple[float, float]): The (connect, read) timeouts for each attempt, so a stalled server can't hang a caller.
+        '''
+        self.session = session
+        self.memoTtlSeconds = memoTtlSeconds
+        self.memoMaxEntries = memoMaxEntries
+        self.maxRetries = maxRetries
+        self.initialBackoffSeconds = initialBackoffSeconds
+        self.maxBackoffSeconds = maxBackoffSeconds
+        self.memoMaxResponseBytes = memoMaxResponseBytes
+        self.memoMaxBytes = memoMaxBytes
+        self.requestTimeoutSeconds = requestTimeoutSeconds
+        self.lock = threading.Lock()
+        self.tokens = None #requests left in the current rate limit window. None until the API tells us.
+        self.resetAt = None #epoch seconds when the current window ends
+        self.inFlight = {} #request key -> Future shared by everyone waiting on that request
+        self.memo = OrderedDict() #request key -> (expiresAt, response, size), least recently used first
+        self.memoBytes = 0 #total body size of everything in self.memo
+
+    @staticmethod
+    def requestKey(url, params, headers):
+        return (url, tuple(sorted((params or {}).items())), tuple(sorted((headers or {}).items())))
+
+    @staticmethod
+    def isPageRequest(url, params):
+        '''
+        Returns:
+            bool: True if the request asks for one page of a paginated collection, either through params or through a 'links.next' URL.
+        '''
+        return any(name.startswith("page[") for name in (params or {})) or "page[" in unquote(urlsplit(url).query)
+
+    def get(self, url, params=None, headers=None, memoize=True):
+        '''
+        Sends a GET request, or joins an identical one that's already in flight, or reuses an identical recent response.
+        Parameters:
+            url (str): The full URL to request.
+            params (dict[str,str]): Query parameters, or None.
+            headers (dict[str,str]): Request headers, or None.
+            memoize (bool): Whether the response may come from (and go into) the memo. Pass False when the caller needs the API's
+                current answer, e.g. for revalidation.
+        Returns:
+            response (requests.Response): The response. Shared with other callers, so treat it as read-only.
+        '''
+        key = self.requestKey(url, params, headers)
+        with self.lock:
+            if(memoize and key in self.memo):
+                expiresAt, response, size = self.memo[key]
+                if(time.monotonic() < expiresAt):
+                    self.memo.move_to_end(key)
+                    getMetrics().increment("traintracker_cache_lookups_total", cache="http_memo", result="hit")
+                    return response
+                del self.memo[key]
+                self.memoBytes -= size
+            future = self.inFlight.get(key)
+            isLeader = future == None
+            if(isLeader):
+                future = self.inFlight[key] = Future()
+        if(not isLeader):
+            getMetrics().increment("traintracker_cache_lookups_total", cache="http_in_flight", result="hit")
+            return future.result()
+
+        try:
+            response = self.sendWithRetries(url, params, headers)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self.lock:
+                del self.inFlight[key]
+        future.set_result(response)
+        if(memoize and self.memoTtlSeconds > 0 and response.status_code == 200 and not self.isPageRequest(url, params)):
+            self.remember(key, response)
+        return response
+
+    def remember(self, key, response):
+        '''
+        Puts a response in the memo if its body is small enough, evicting the least recently used responses until the memo is back
+        under memoMaxEntries and memoMaxBytes.
+        '''
+        size = len(response.content)
+        if(size > self.memoMaxResponseBytes):
+            return
+        with self.lock:
+            if(key in self.memo):
+                self.memoBytes -= self.memo[key][2]
+            self.memo[key] = (time.monotonic() + self.memoTtlSeconds, response, size)
+            self.memo.move_to_end(key)
+            self.memoBytes += size
+            while len(self.memo) > self.memoMaxEntries or self.memoBytes > self.memoMaxBytes:
+                self.memoBytes -= self.memo.popitem(last=False)[1][2]
+
+    def clearMemo(self):
+        '''
+        Forgets every memoized response, so the next request for anything goes to the API.
+        '''
+        with self.lock:
+            self.memo.clear()
+            self.memoBytes = 0
+
+    def sendWithRetries(self, url, params, headers):
+        '''
+        Sends the request once a rate limit token is available, retrying 429/5xx responses, timeouts and connection errors up to
+        self.maxRetries times. The last attempt's response is returned, or its exception raised.
+        '''
+        endpoint = urlsplit(url).path.rstrip("/") or "/"
+        for attempt in range(self.maxRetries + 1):
+            self.acquireToken()
+            metrics = getMetrics()
+            startTime = time.perf_counter()
+            try:
+                response = self.session.get(url, headers=headers, params=params, timeout=self.requestTimeoutSeconds)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                if(attempt == self.maxRetries):
+                    raise
+                metrics.increment("traintracker_http_retries_total", endpoint=endpoint, status=type(error).__name__)
+                time.sleep(self.retryDelay(None, attempt))
+                continue
+            if(metrics.enabled):
+                metrics.observe("traintracker_http_request_seconds", time.perf_counter() - startTime, endpoint=endpoint)
+                metrics.increment("traintracker_http_requests_total", endpoint=endpoint, status=response.status_code)
+                metrics.increment("traintracker_http_response_bytes_total", len(response.content), endpoint=endpoint)
+            self.updateRateLimit(response.headers)
+            if(response.status_code not in RETRYABLE_STATUS_CODES or attempt == self.maxRetries):
+                return response
+            metrics.increment("traintracker_http_retries_total", endpoint=endpoint, status=response.status_code)
+            time.sleep(self.retryDelay(response, attempt))
+
+    def retryDelay(self, response, attempt):
+        '''
+        Parameters:
+            response (requests.Response): The response to retry, or None if the attempt failed without one.
+            attempt (int): How many attempts came before this one, minus one.
+        Returns:
+            seconds (float): How long to wait before retrying response. Retry-After wins if the API sent it. Otherwise a 429 waits for
+            the rate limit window to reset, and anything else backs off exponentially. Jittered so parallel callers don't retry in lockstep.
+        '''
+        backoffSeconds = self.initialBackoffSeconds * 2 ** attempt * random.uniform(0.5, 1.5)
+        if(response == None):
+            return min(self.maxBackoffSeconds, backoffSeconds)
+        retryAfter = response.headers.get("Retry-After")
+        if(retryAfter != None and retryAfter.isdigit()):
+            return min(self.maxBackoffSeconds, float(retryAfter) + random.uniform(0, self.initialBackoffSeconds))
+        if(response.status_code == 429 and self.resetAt != None): #reset times are whole seconds, so keep backing off too in case it already passed
+            return min(self.maxBackoffSeconds, max(backoffSeconds, self.resetAt - time.time() + random.uniform(0, self.initialBackoffSeconds)))
+        return min(self.maxBackoffSeconds, backoffSeconds)
+
+    def updateRateLimit(self, headers):
+        '''
+        Refills the token bucket from a response's x-ratelimit-remaining/x-ratelimit-reset headers. Ignored if they're missing or malformed.
+        '''
+        try:
+            remaining = int(headers["x-ratelimit-remaining"])
+            resetAt = float(headers["x-ratelimit-reset"])
+        except (KeyError, TypeError, ValueError):
+            return
+        with self.lock:
+            if(self.resetAt == None or resetAt > self.resetAt or self.tokens == None): #a new window
+                self.tokens = remaining
+                self.resetAt = resetAt
+            elif(resetAt == self.resetAt): #responses can arrive out of order, so trust whichever count is lower
+                self.tokens = min(self.tokens, remaining)
+
+    def acquireToken(self):
+        '''
+        Takes one request from the token bucket, waiting for the rate limit window to reset if it's empty.
+        '''
+        while True:
+            with self.lock:
+                now = time.time()
+                if(self.resetAt != None and now >= self.resetAt): #the window is over. We'll learn the new budget from the next response.
+                    self.tokens = None
+                    self.resetAt = None
+                if(self.tokens == None or self.tokens > 0):
+                    if(self.tokens != None):
+                        self.tokens -= 1
+                    return
+                waitSeconds = min(self.maxBackoffSeconds, self.resetAt - now)
+            getMetrics().observe("traintracker_rate_limit_wait_seconds", waitSeconds)
+            time.sleep(waitSeconds + random.uniform(0, 0.05))
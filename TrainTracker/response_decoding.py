@@ -0,0 +1,56 @@
+import json
+try: #orjson is optional. It's several times faster than the json module, but everything works without it.
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKEND = "orjson" if orjson != None else "json"
+
+def decodeJson(body):
+    '''
+    Decodes a JSON document straight from the response bytes. Going through response.text first would make requests guess the charset
+    (slow for large bodies) and keep a decoded copy of the whole body around as a str.
+    Parameters:
+        body (bytes): The raw response body.
+    Returns:
+        object: The decoded document.
+    '''
+    if(orjson != None):
+        return orjson.loads(body)
+    return json.loads(body) #the json module reads UTF-8 bytes directly
+
+def sparseFieldset(fields):
+    '''
+    Builds the JSON:API fields[...] query parameters that limit each resource type to the attributes we actually read.
+    Parameters:
+        fields (dict[str, tuple[str]]): For each resource type in the response, the attributes to keep. An empty tuple keeps none (ids and
+            relationships are always sent).
+    Returns:
+        params (dict[str,str]): Query parameters like {'fields[stop]' : 'name'}.
+    '''
+    return {f"fields[{resourceType}]" : ",".join(attributes) for resourceType, attributes in fields.items()}
+
+def extractRows(resources, attributes):
+    '''
+    Pulls just the id and the listed attributes out of each resource, so we keep compact tuples instead of the decoded dicts.
+    Parameters:
+        resources (list[dict]): JSON:API resource objects.
+        attributes (tuple[str]): The attributes to extract, in order.
+    Returns:
+        rows (list[tuple]): One (id, attribute, ...) tuple per resource. Missing attributes are None.
+    '''
+    return [(resource["id"],) + tuple((resource.get("attributes") or {}).get(attribute) for attribute in attributes) for resource in resources]
+
+def relatedIds(resource, relationship):
+    '''
+    Returns:
+        ids (tuple[str]): The ids a to-many relationship of resource points at (empty if it has none).
+    '''
+    return tuple(reference["id"] for reference in ((resource.get("relationships") or {}).get(relationship) or {}).get("data") or ())
+
+def relatedId(resource, relationship):
+    '''
+    Returns:
+        id (str): The id a to-one relationship of resource points at, or None if it has none.
+    '''
+    return (((resource.get("relationships") or {}).get(relationship) or {}).get("data") or {}).get("id")
@@ -0,0 +1,115 @@
+from array import array
+try: #import as a package member (pytest) or as a sibling script (main.py)
+    from .graph_search import breadthFirstParents
+    from .compact_graph import CompactRouteGraph
+except ImportError:
+    from graph_search import breadthFirstParents
+    from compact_graph import CompactRouteGraph
+
+class RoutePathIndex:
+    '''
+    Precomputed shortest paths between every pair of routes in a route connection graph.
+    For each start route we run one breadth first search and keep its predecessor table, stored as a compact array of route numbers.
+    After that, finding a path is a walk back through the table instead of a new search.
+    The route graph is small (one node per route) and rarely changes, so paying V searches up front is cheap next to answering the same
+    pairs over and over.
+    '''
+    def __init__(self, graph, graphVersion=None):
+        '''
+        Constructor for RoutePathIndex. Builds the predecessor tables for graph.
+        Parameters:
+            graph (dict[str, list[str]]): The route connection graph to index.
+            graphVersion (int): The version of the network the graph was built from. Used to tell when the index is out of date.
+        '''
+        self.graphVersion = graphVersion
+        self.routes = list(graph.keys())
+        self.routeNumbers = {route : number for number, route in enumerate(self.routes)}
+        self.predecessors = [] #predecessors[start][end] is the route before end on the path from start, -1 if end is unreachable.
+        if(isinstance(graph, CompactRouteGraph) and not graph.removedRoutes): #same route numbers, so its search results are our tables
+            self.predecessors = [array("i", graph.breadthFirstNumbers([start])[0]) for start in range(len(self.routes))]
+            return
+        for start in self.routes:
+            table = array("i", [-1]) * len(self.routes)
+            for node, parent in breadthFirstParents(graph, start).items():
+                if node in self.routeNumbers: #skip neighbors that aren't nodes of the graph themselves
+                    table[self.routeNumbers[node]] = self.routeNumbers[parent] if parent != None else self.routeNumbers[start]
+            self.predecessors.append(table)
+
+    def getTables(self):
+        '''
+        Returns the index as plain data (route names and raw predecessor bytes), so it can be stored in a snapshot without pickling this class.
+        Returns:
+            tables (dict): Everything fromTables() needs to rebuild the index.
+        '''
+        return {"routes" : self.routes, "predecessors" : [table.tobytes() for table in self.predecessors]}
+
+    @classmethod
+    def fromTables(cls, tables, graphVersion=None):
+        '''
+        Rebuilds an index from the output of getTables(), without running any searches.
+        Parameters:
+            tables (dict): Output of getTables().
+            graphVersion (int): The version of the network the tables belong to.
+        Returns:
+            RoutePathIndex: The rebuilt index.
+        '''
+        index = cls({}, graphVersion)
+        index.routes = list(tables["routes"])
+        index.routeNumbers = {route : number for number, route in enumerate(index.routes)}
+        index.predecessors = [array("i", rawTable) for rawTable in tables["predecessors"]]
+        return index
+
+    def getPath(self, start, end):
+        '''
+        Looks up the shortest path from start to end. This returns the same path findShortestPathBFS would.
+        Parameters:
+            start (str): The route to start from.
+            end (str): The route to get to.
+        Returns:
+            path (list[str]): The routes on the path including both ends, or an empty list if either route is unknown or there is no path.
+        '''
+        if(start not in self.routeNumbers or end not in self.routeNumbers):
+            return []
+        startNumber = self.routeNumbers[start]
+        table = self.predecessors[startNumber]
+        node = self.routeNumbers[end]
+        if(table[node] == -1):
+            return []
+        path = [self.routes[node]]
+        while node != startNumber:
+            node = table[node]
+            path.append(self.routes[node])
+        path.reverse()
+        return path
+
+    def getPathBetween(self, starts, ends):
+        '''
+        Looks up the shortest path from any route in starts to any route in ends, i.e. the shortest getPath() over every (start, end) pair.
+        Path lengths are measured by walking the tables, and only the winning path is built.
+        Parameters:
+            starts (list[str]): The routes the path may start from.
+            ends (list[str]): The routes the path may end at.
+        Returns:
+            path (list[str]): The routes on the path including both ends, or an empty list if no pair is connected. Ties go to the
+            earlier start, then the earlier end.
+        '''
+        endNumbers = [self.routeNumbers[end] for end in ends if end in self.routeNumbers]
+        bestStart, bestEnd, bestLength = None, None, None
+        for start in starts:
+            if(start not in self.routeNumbers):
+                continue
+            startNumber = self.routeNumbers[start]
+            table = self.predecessors[startNumber]
+            for endNumber in endNumbers:
+                if(table[endNumber] == -1):
+                    continue
+                length = 0
+                node = endNumber
+                while node != startNumber and (bestLength == None or length < bestLength):
+                    node = table[node]
+                    length += 1
+                if(node == startNumber and (bestLength == None or length < bestLength)):
+                    bestStart, bestEnd, bestLength = start, self.routes[endNumber], length
+                    if(length == 0): #start serves both stops, nothing beats that
+                        return [start]
+        return self.getPath(bestStart, bestEnd) if bestStart != None else []
@@ -0,0 +1,92 @@
+import re
+from bisect import bisect_left
+
+DEFAULT_STOP_ALIASES = { #Common shorthand riders type. Each alias is only used if its stop actually exists in the network.
+    "DTX" : "Downtown Crossing",
+    "Gov Center" : "Government Center",
+    "Mass Ave" : "Massachusetts Avenue",
+    "BU Central" : "Boston University Central"
+}
+
+_NON_ALPHANUMERIC = re.compile(r"[\W_]+")
+
+def normalizeStopName(name):
+    '''
+    Reduces a stop name to the form we compare on: case-folded, with punctuation and runs of whitespace turned into single spaces.
+    So 'Kendall/MIT', 'kendall mit' and ' KENDALL-MIT ' all normalize to 'kendall mit'.
+    Parameters:
+        name (str): The name to normalize. Anything that isn't a string (None, numbers, dicts from bad input) is allowed.
+    Returns:
+        normalizedName (str): The normalized name, or None if name isn't a string or has no letters or digits.
+    '''
+    if(not isinstance(name, str)):
+        return None
+    normalizedName = _NON_ALPHANUMERIC.sub(" ", name.casefold()).strip()
+    return normalizedName or None
+
+class StopNameIndex:
+    '''
+    Fast lookup of stop names for validating and autocompleting user input.
+    Lookups go through a dict keyed by normalized name, so they're O(1) and forgiving about case and punctuation.
+    Every part of a name joined with '/' becomes an alias as long as it's unambiguous ('Kendall' -> 'Kendall/MIT'), plus DEFAULT_STOP_ALIASES.
+    Prefix search (autocomplete) uses binary search over a sorted list of normalized names.
+    '''
+    def __init__(self, stopNames, aliases=DEFAULT_STOP_ALIASES):
+        '''
+        Constructor for StopNameIndex.
+        Parameters:
+            stopNames (iterable[str]): The canonical stop names, e.g. the keys of the stop to routes dict.
+            aliases (dict[str,str]): Extra alternative names, mapped to the canonical stop name they stand for.
+        '''
+        self.lookup = {} #normalized name or alias -> canonical stop name
+        for stopName in stopNames:
+            normalizedName = normalizeStopName(stopName)
+            if(normalizedName != None):
+                self.lookup[normalizedName] = stopName
+
+        derivedAliases = {} #normalized alias -> set of stops it could mean. Only unambiguous ones are kept.
+        for stopName in list(self.lookup.values()):
+            if("/" in stopName):
+                for part in stopName.split("/"):
+                    normalizedPart = normalizeStopName(part)
+                    if(normalizedPart != None and normalizedPart not in self.lookup):
+                        derivedAliases.setdefault(normalizedPart, set()).add(stopName)
+        for normalizedAlias, stops in derivedAliases.items():
+            if(len(stops) == 1):
+                self.lookup[normalizedAlias] = next(iter(stops))
+        for alias, stopName in (aliases or {}).items():
+            normalizedAlias = normalizeStopName(alias)
+            if(normalizedAlias != None and normalizeStopName(stopName) in self.lookup):
+                self.lookup.setdefault(normalizedAlias, self.lookup[normalizeStopName(stopName)])
+
+        self.sortedKeys = sorted(self.lookup.keys())
+
+    def resolve(self, name):
+        '''
+        Parameters:
+            name (str): A stop name as typed by a user.
+        Returns:
+            stopName (str): The canonical stop name that name refers to, or None if it doesn't match any stop or alias.
+        '''
+        return self.lookup.get(normalizeStopName(name))
+
+    def suggest(self, prefix, limit=10):
+        '''
+        Autocompletes a partially typed stop name.
+        Parameters:
+            prefix (str): The start of a stop name (or alias), compared after normalization.
+            limit (int): The most suggestions to return.
+        Returns:
+            suggestions (list[str]): Up to limit canonical stop names whose name or alias starts with prefix, in alphabetical order of the match.
+        '''
+        normalizedPrefix = normalizeStopName(prefix)
+        if(normalizedPrefix == None):
+            return []
+        suggestions = []
+        position = bisect_left(self.sortedKeys, normalizedPrefix)
+        while position < len(self.sortedKeys) and len(suggestions) < limit and self.sortedKeys[position].startswith(normalizedPrefix):
+            stopName = self.lookup[self.sortedKeys[position]]
+            if(stopName not in suggestions):
+                suggestions.append(stopName)
+            position += 1
+        return suggestions
@@ -1,8 +1,32 @@
 import pytest
 import os
+import time
+import json
+import random
+import asyncio
+import io
+import zipfile
+import requests
+import datetime
+import marshal
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from TrainTracker.transit_requester import TransitRequester
 from TrainTracker.utils import loadEnvironmentVariablesFromFile
-from TrainTracker.questions import findShortestPathBFS, isValidStopName, buildRouteConnectionGraph
+from TrainTracker.questions import findShortestPathBFS, isValidStopName, buildRouteConnectionGraph, getRoutePathIndex, planTrip
+from TrainTracker.network_snapshot import NetworkSnapshot, HEADER, SNAPSHOT_MAGIC, SNAPSHOT_VERSION
+from TrainTracker.graph_search import shortestPath, multiSourceShortestPath
+from TrainTracker.route_path_index import RoutePathIndex
+from TrainTracker.stop_index import StopNameIndex
+from TrainTracker.compact_graph import CompactRouteGraph
+from TrainTracker.query_server import QueryServer, MAX_HEADER_LINES
+from TrainTracker.mock_mbta_server import MockMbtaServer, RecordedNetwork
+from TrainTracker.request_scheduler import RequestScheduler
+from TrainTracker.instrumentation import MetricsRegistry, getMetrics, setMetrics
+from TrainTracker.journey_planner import ConnectionTimetable, UNREACHED
+from TrainTracker.questions import planTimedTrip, planTimedTripFromNow
+from TrainTracker.realtime_stream import parseServerSentEvents, LiveStateStore, StreamingClient
+from TrainTracker.batch_planner import readStopPairs, allStopPairs, runBatch
 
 def buildMBTARequester():
     '''
@@ -14,6 +38,16 @@ def buildMBTARequester():
         os.getenv('MBTA_API_ENDPOINT'))
     return requesterObject
 
+class FakeResponse:
+    '''
+    Minimal stand-in for a requests.Response, so we can feed canned API payloads to a TransitRequester without touching the network.
+    '''
+    def __init__(self, payload, statusCode=200, headers=None):
+        self.text = json.dumps(payload)
+        self.content = self.text.encode("utf-8")
+        self.status_code = statusCode
+        self.headers = headers or {}
+
 class TestTransitRequester:
     '''
     This class will run a few tests to make sure our TransitRequester class is working properly. 
@@ -52,6 +86,96 @@ class TestTransitRequester:
         assert 'Cleveland Circle' in self.requesterObject.stopToRoutes.keys()
         assert 'Green-C' in self.requesterObject.stopToRoutes['Cleveland Circle']
 
+    def test_concurrent_relationship_builder(self, monkeypatch): #Concurrent and sequential builds should produce identical dicts, without touching the network.
+        fakeNetwork = {"A" : ["1", "2", "3"], "B" : ["3", "4"], "C" : ["4", "5", "1"]}
+        def fakeStopsOnRoute(routeId):
+            time.sleep(0.05)
+            return list(fakeNetwork[routeId])
+        requesterObject = TransitRequester("key", "http://localhost", maxConcurrentRequests=3)
+        monkeypatch.setattr(requesterObject, "getAllTrainRouteIds", lambda: list(fakeNetwork.keys()))
+        monkeypatch.setattr(requesterObject, "getAllStopsOnRoute", fakeStopsOnRoute)
+        requesterObject.buildRouteAndStopRelationships(concurrent=False)
+        sequentialResult = (dict(requesterObject.routeToStops), dict(requesterObject.stopToRoutes))
+        startTime = time.perf_counter()
+        requesterObject.buildRouteAndStopRelationships(concurrent=True)
+        elapsed = time.perf_counter() - startTime
+        assert (dict(requesterObject.routeToStops), dict(requesterObject.stopToRoutes)) == sequentialResult
+        assert requesterObject.stopToRoutes["1"] == ["A", "C"] #route order is preserved
+        assert elapsed < 0.05 * len(fakeNetwork) #should take about as long as the slowest request, not the sum of all of them
+
+    def test_bulk_relationship_builder(self, monkeypatch): #The bulk loader should resolve included trips/stops and follow pagination.
+        def stop(stopId, name):
+            return {"type" : "stop", "id" : stopId, "attributes" : {"name" : name}}
+        def trip(tripId, stopIds):
+            return {"type" : "trip", "id" : tripId, "relationships" : {"stops" : {"data" : [{"type" : "stop", "id" : s} for s in stopIds]}}}
+        def pattern(route, tripId, typicality):
+            return {"type" : "route_pattern", "id" : tripId, "attributes" : {"typicality" : typicality},
+                "relationships" : {"route" : {"data" : {"type" : "route", "id" : route}}, "representative_trip" : {"data" : {"type" : "trip", "id" : tripId}}}}
+        pages = {
+            "http://localhost/route_patterns/" : {
+                "data" : [pattern("Red", "t1", 1), pattern("Red", "t2", 4)],
+                "included" : [trip("t1", ["p1", "p2"]), trip("t2", ["p9"]), stop("p1", "Alewife"), stop("p2", "Park Street"), stop("p9", "Shuttle Stop")],
+                "links" : {"next" : "http://localhost/route_patterns/?page[offset]=2"}},
+            "http://localhost/route_patterns/?page[offset]=2" : {
+                "data" : [pattern("Orange", "t3", 1), pattern("Red", "t4", 1)],
+                "included" : [trip("t3", ["p3", "p4"]), trip("t4", ["p2b", "p5"]), stop("p3", "Oak Grove"), stop("p4", "Park Street"), stop("p2b", "Park Street"), stop("p5", "Braintree")],
+                "links" : {}}
+        }
+        requestedUrls = []
+        requesterObject = TransitRequester("key", "http://localhost")
+        monkeypatch.setattr(requesterObject, "getAllTrainRouteIds", lambda: ["Red", "Orange"])
+        monkeypatch.setattr(requesterObject.session, "get", lambda url, headers=None, params=None, timeout=None: requestedUrls.append(url) or FakeResponse(pages[url]))
+        requesterObject.buildRouteAndStopRelationshipsBulk()
+        assert len(requestedUrls) == 2
+        assert requesterObject.routeToStops["Red"] == ["Alewife", "Park Street", "Braintree"] #atypical shuttle stop is ignored
+        assert requesterObject.routeToStops["Orange"] == ["Oak Grove", "Park Street"]
+        assert requesterObject.stopToRoutes["Park Street"] == ["Red", "Orange"]
+
+    def test_snapshot_revalidation(self, monkeypatch, tmp_path): #Fresh snapshots cost no requests, stale ones cost a 304, changed ones are rebuilt.
+        snapshotPath = str(tmp_path / "network.bin")
+        requestLog = []
+        apiState = {"etag" : 'W/"v1"'}
+        def fakeGet(url, headers=None, params=None, timeout=None):
+            requestLog.append(headers.get("If-None-Match"))
+            if(headers.get("If-None-Match") == apiState["etag"]):
+                return FakeResponse({}, 304)
+            return FakeResponse({"data" : []}, 200, {"ETag" : apiState["etag"]})
+        def fakeBuild():
+            requesterObject.routeToStops = {"A" : ["1", "2"], "B" : ["2"]}
+            requesterObject.stopToRoutes = {"1" : ["A"], "2" : ["A", "B"]}
+            requesterObject.routeConnectionGraph = None
+        requesterObject = TransitRequester("key", "http://localhost")
+        monkeypatch.setattr(requesterObject.session, "get", fakeGet)
+        monkeypatch.setattr(requesterObject, "buildRouteAndStopRelationships", fakeBuild)
+        def derivedDataBuilder(requester):
+            requester.routeConnectionGraph = CompactRouteGraph(["A", "B"], requester.stopToRoutes)
+            requester.routePathIndex = RoutePathIndex(requester.routeConnectionGraph, requester.graphVersion)
+
+        assert requesterObject.loadRelationshipsFromSnapshot(snapshotPath, derivedDataBuilder=derivedDataBuilder) == False #no snapshot yet
+        assert NetworkSnapshot.load(snapshotPath).routeConnectionGraph == {"A" : ["B"], "B" : ["A"]}
+        assert NetworkSnapshot.load(snapshotPath).routePathIndex.getPath("B", "A") == ["B", "A"]
+
+        requestLog.clear()
+        assert requesterObject.loadRelationshipsFromSnapshot(snapshotPath) == True
+        assert requestLog == [] #still fresh, no requests at all
+
+        assert requesterObject.loadRelationshipsFromSnapshot(snapshotPath, ttlSeconds=0) == True #stale but unchanged: conditional requests only
+        assert requestLog == ['W/"v1"', 'W/"v1"']
+        assert requesterObject.stopToRoutes["2"] == ["A", "B"]
+
+        apiState["etag"] = 'W/"v2"'
+        assert requesterObject.loadRelationshipsFromSnapshot(snapshotPath, ttlSeconds=0) == False #the network changed, so rebuild
+        assert NetworkSnapshot.load(snapshotPath).validators[0]["etag"] == 'W/"v2"'
+
+        with open(snapshotPath, "wb") as snapshotFile: #corrupt files are treated as missing
+            snapshotFile.write(b"garbage")
+        assert NetworkSnapshot.load(snapshotPath) == None
+        for payload in ({"routeToStops" : {}}, {"routeToStops" : {}, "stopToRoutes" : {}, "validators" : None, "routePathTables" : None,
+                "routeGraphTables" : {"routes" : [], "stops" : [], "offsets" : b"\x00", "neighbors" : b"", "edgeStopOffsets" : b"", "edgeStops" : b""}}):
+            with open(snapshotPath, "wb") as snapshotFile: #so are files that decode but don't hold a whole, well formed snapshot
+                snapshotFile.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, time.time()) + zlib.compress(marshal.dumps(payload)))
+            assert NetworkSnapshot.load(snapshotPath) == None
+
 class TestQuestions:
     '''
     This class will make sure that the input validation and graph building/traversal functions are working as expected.
@@ -113,4 +237,637 @@ class TestQuestions:
             "4" : ["5"],
             "5" : ["4"]
         }
-        assert findShortestPathBFS(graph, "1", "5") == []
\ No newline at end of file
+        assert findShortestPathBFS(graph, "1", "5") == []
+
+    def test_bidirectional_search(self):
+        #Directed graphs need the reverse adjacency, which is computed for us if we don't pass one.
+        graph = {
+            "1" : ["2", "3"],
+            "2" : ["4"],
+            "3" : ["1"],
+            "4" : ["2", "5"],
+            "5" : ["4"]
+        }
+        assert findShortestPathBFS(graph, "1", "5", bidirectional=True) == ["1", "2", "4", "5"]
+        assert shortestPath(graph, "5", "3", bidirectional=True) == []
+
+        #On random graphs both modes should always agree on the shortest path length, and every path should be a real path.
+        randomGenerator = random.Random(4)
+        for _ in range(50):
+            nodes = [str(i) for i in range(30)]
+            graph = {node : [] for node in nodes}
+            for _ in range(40):
+                a, b = randomGenerator.sample(nodes, 2)
+                graph[a].append(b)
+            start, end = randomGenerator.sample(nodes, 2)
+            forwardPath = shortestPath(graph, start, end)
+            bidirectionalPath = shortestPath(graph, start, end, bidirectional=True)
+            assert len(forwardPath) == len(bidirectionalPath)
+            for path in (forwardPath, bidirectionalPath):
+                assert all(b in graph[a] for a, b in zip(path, path[1:]))
+
+    def test_route_path_index(self, monkeypatch):
+        #Every lookup should match a fresh breadth first search, including unreachable pairs.
+        graph = {
+            "1" : ["2", "3"],
+            "2" : ["4"],
+            "3" : ["1"],
+            "4" : ["2", "5"],
+            "5" : ["4"],
+            "6" : []
+        }
+        routePathIndex = RoutePathIndex(graph)
+        for start in graph:
+            for end in graph:
+                assert routePathIndex.getPath(start, end) == shortestPath(graph, start, end)
+        assert routePathIndex.getPath("1", "unknown") == []
+        for starts, ends in ((["1", "6"], ["5", "3"]), (["6", "5"], ["2", "1"]), (["3"], ["3", "5"]), (["6"], ["1"]), (["unknown", "5"], ["4"])):
+            path = routePathIndex.getPathBetween(starts, ends)
+            assert len(path) == len(multiSourceShortestPath(graph, starts, ends)) #as short as one search from every start
+            assert not path or (path[0] in starts and path[-1] in ends and path == routePathIndex.getPath(path[0], path[-1]))
+
+        #The index is cached on the requester and rebuilt once the relationship dicts change.
+        requesterObject = TransitRequester("key", "http://localhost")
+        fakeNetwork = {"A" : ["1", "2"], "B" : ["2", "3"]}
+        monkeypatch.setattr(requesterObject, "getAllTrainRouteIds", lambda: list(fakeNetwork.keys()))
+        monkeypatch.setattr(requesterObject, "getAllStopsOnRoute", lambda routeId: list(fakeNetwork[routeId]))
+        requesterObject.buildRouteAndStopRelationships()
+        firstIndex = getRoutePathIndex(requesterObject)
+        assert firstIndex.getPath("A", "B") == ["A", "B"]
+        assert getRoutePathIndex(requesterObject) is firstIndex
+        fakeNetwork["B"] = ["3"]
+        requesterObject.buildRouteAndStopRelationships()
+        assert getRoutePathIndex(requesterObject) is not firstIndex
+        assert getRoutePathIndex(requesterObject).getPath("A", "B") == []
+
+    def test_transfer_aware_planner(self, monkeypatch):
+        #"Hub" is served by A first, but only B reaches "End" directly. Picking the first route at each stop would need an extra transfer.
+        fakeNetwork = {
+            "A" : ["Start", "Hub", "Middle"],
+            "B" : ["Hub", "Other", "End"],
+            "C" : ["Middle", "Other"],
+            "D" : ["Lonely"]
+        }
+        requesterObject = TransitRequester("key", "http://localhost")
+        monkeypatch.setattr(requesterObject, "getAllTrainRouteIds", lambda: list(fakeNetwork.keys()))
+        monkeypatch.setattr(requesterObject, "getAllStopsOnRoute", lambda routeId: list(fakeNetwork[routeId]))
+        requesterObject.buildRouteAndStopRelationships()
+        assert planTrip(requesterObject, "Hub", "End") == {"routes" : ["B"], "transfers" : []}
+        assert planTrip(requesterObject, "Start", "End") == {"routes" : ["A", "B"], "transfers" : [["Hub"]]}
+        assert planTrip(requesterObject, "Middle", "Other") == {"routes" : ["C"], "transfers" : []}
+        assert planTrip(requesterObject, "Start", "Lonely") == None
+        assert planTrip(requesterObject, "Start", "Nowhere") == None
+
+    def test_stop_name_index(self):
+        stopNameIndex = StopNameIndex(["Kendall/MIT", "Park Street", "Downtown Crossing", "Charles/MGH", "Harvard", "Harvard Avenue", "Haymarket"])
+        assert stopNameIndex.resolve("Kendall/MIT") == "Kendall/MIT"
+        assert stopNameIndex.resolve("  kendall-mit ") == "Kendall/MIT" #case and punctuation don't matter
+        assert stopNameIndex.resolve("Kendall") == "Kendall/MIT" #parts of slashed names are aliases
+        assert stopNameIndex.resolve("DTX") == "Downtown Crossing" #default aliases
+        assert stopNameIndex.resolve("Mass Ave") == None #default aliases for stops that don't exist are ignored
+        for invalidInput in ["", None, 0, dict(), "\n", "Parkk Street"]:
+            assert stopNameIndex.resolve(invalidInput) == None
+        assert stopNameIndex.suggest("har") == ["Harvard", "Harvard Avenue"]
+        assert stopNameIndex.suggest("h", limit=2) == ["Harvard", "Harvard Avenue"]
+        assert stopNameIndex.suggest("mg") == ["Charles/MGH"]
+        assert stopNameIndex.suggest("zzz") == []
+
+    def test_compact_graph(self):
+        stopToRoutes = {
+            "Park Street" : ["Red", "Green-B", "Green-C"],
+            "Downtown Crossing" : ["Red", "Orange"],
+            "Kenmore" : ["Green-B", "Green-C"],
+            "Alewife" : ["Red"],
+            "Loop" : ["Orange", "Orange"] #repeated routes shouldn't create self edges
+        }
+        graph = CompactRouteGraph(["Red", "Orange", "Green-B", "Green-C", "Blue"], stopToRoutes)
+        assert graph == {"Red" : ["Green-B", "Green-C", "Orange"], "Orange" : ["Red"], "Green-B" : ["Red", "Green-C"], "Green-C" : ["Red", "Green-B"], "Blue" : []}
+        assert "Blue" in graph.keys() and "Alewife" not in graph.keys()
+        assert graph.getTransferStops("Green-B", "Green-C") == ["Park Street", "Kenmore"]
+        assert graph.getTransferStops("Orange", "Blue") == []
+        assert [graph.routes[n] for n in graph.neighborNumbers(graph.routeNumbers["Orange"])] == ["Red"]
+        assert findShortestPathBFS(graph, "Orange", "Green-C") == ["Orange", "Red", "Green-C"]
+        copiedGraph = CompactRouteGraph.fromTables(graph.getTables())
+        assert copiedGraph == graph
+        assert copiedGraph.getTransferStops("Red", "Orange") == ["Downtown Crossing"]
+
+        #Searches over the integer rows should match searches over a plain dict, before and after patching (overlay rows, a new route).
+        randomGenerator = random.Random(3)
+        routes = [f"R{i}" for i in range(40)]
+        stopToRoutes = {f"S{i}" : randomGenerator.sample(routes, 2) for i in range(50)}
+        graph = CompactRouteGraph(routes, stopToRoutes)
+        for patch in (None, {"S0" : (stopToRoutes["S0"], ["R1", "R39", "New"]), "S1" : (stopToRoutes["S1"], [])}):
+            if(patch != None):
+                graph.applyStopChanges(patch)
+            plainGraph = {route : list(graph[route]) for route in graph}
+            for _ in range(100):
+                sources, targets = randomGenerator.sample(list(plainGraph), 3), randomGenerator.sample(list(plainGraph), 2)
+                assert multiSourceShortestPath(graph, sources, targets) == multiSourceShortestPath(plainGraph, sources, targets)
+                assert shortestPath(graph, sources[0], targets[0]) == shortestPath(plainGraph, sources[0], targets[0])
+            assert RoutePathIndex(graph).predecessors == RoutePathIndex(plainGraph).predecessors
+
+def buildFakeRequester(fakeNetwork):
+    '''
+    Helper function for testing. Returns a TransitRequester whose API calls are answered from fakeNetwork (route -> list of stops) instead of the network.
+    '''
+    requesterObject = TransitRequester("key", "http://localhost")
+    requesterObject.getAllTrainRouteIds = lambda: list(fakeNetwork.keys())
+    requesterObject.getAllTrainRouteNames = lambda: [f"{route} Line" for route in fakeNetwork]
+    requesterObject.getAllStopsOnRoute = lambda routeId: list(fakeNetwork[routeId])
+    return requesterObject
+
+class TestIncrementalUpdates:
+    '''
+    Applying route changes in place should always leave the same relationships and graph as rebuilding from scratch.
+    '''
+    @staticmethod
+    def canonical(requesterObject):
+        graph = requesterObject.routeConnectionGraph
+        return (
+            {route : list(stops) for route, stops in requesterObject.routeToStops.items()},
+            {stop : sorted(routes) for stop, routes in requesterObject.stopToRoutes.items()},
+            {route : sorted(graph[route]) for route in graph},
+            {(a, b) : sorted(graph.getTransferStops(a, b)) for a in graph for b in graph[a]})
+
+    def test_matches_full_rebuild(self):
+        randomGenerator = random.Random(7)
+        stopNames = [f"S{i}" for i in range(25)]
+        network = {f"R{i}" : randomGenerator.sample(stopNames, 6) for i in range(8)}
+        requesterObject = buildFakeRequester(network)
+        requesterObject.buildRouteAndStopRelationships()
+        buildRouteConnectionGraph(requesterObject)
+        for step in range(40):
+            route = randomGenerator.choice(list(network.keys()) + [f"New{step}"])
+            if(route in network and randomGenerator.random() < 0.15):
+                del network[route]
+                requesterObject.applyRouteStopChanges({route : None})
+            else:
+                network[route] = randomGenerator.sample(stopNames, randomGenerator.randint(1, 8))
+                requesterObject.applyRouteStopChanges({route : list(network[route])})
+            rebuiltRequester = buildFakeRequester(network)
+            rebuiltRequester.buildRouteAndStopRelationships()
+            buildRouteConnectionGraph(rebuiltRequester)
+            assert self.canonical(requesterObject) == self.canonical(rebuiltRequester)
+            assert getRoutePathIndex(requesterObject).getPath("R0", "R1") == shortestPath(requesterObject.routeConnectionGraph, "R0", "R1")
+
+    def test_selective_invalidation(self):
+        requesterObject = buildFakeRequester({"A" : ["1", "2"], "B" : ["2", "3"], "C" : ["3", "4"]})
+        requesterObject.buildRouteAndStopRelationships()
+        routePathIndex = getRoutePathIndex(requesterObject)
+        stopNameIndex = requesterObject.getStopNameIndex()
+        graphVersion = requesterObject.graphVersion
+        assert requesterObject.applyRouteStopChanges({"A" : ["2", "1"]}) == set() #reordered, same stops
+        assert requesterObject.applyRouteStopChanges({"C" : ["3", "4", "1"]}) == {"A", "C"} #A and C are now connected at stop 1
+        assert requesterObject.graphVersion == graphVersion + 2
+        assert requesterObject.routePathIndex == None and requesterObject.stopNameIndex is stopNameIndex
+        routePathIndex = getRoutePathIndex(requesterObject)
+        assert routePathIndex.getPath("A", "C") == ["A", "C"]
+        assert requesterObject.applyRouteStopChanges({"B" : ["2", "3", "5"]}) == set() #a new non-transfer stop: paths stay valid
+        assert requesterObject.routePathIndex is routePathIndex and routePathIndex.graphVersion == requesterObject.graphVersion
+        assert requesterObject.stopNameIndex == None #but there's a new stop name
+        assert requesterObject.routeConnectionGraph.getTransferStops("A", "C") == ["1"]
+
+class TestJourneyPlanner:
+    '''
+    Checks the Connection Scan Algorithm against a brute force search over random timetables.
+    '''
+    @staticmethod
+    def randomStopTimes(randomGenerator, numStops=12, numTrips=60):
+        stopTimes = []
+        for tripNumber in range(numTrips):
+            stops = randomGenerator.sample(range(numStops), randomGenerator.randint(2, 5))
+            currentTime = randomGenerator.randint(0, 3600)
+            for sequence, stop in enumerate(stops):
+                arrival = currentTime
+                currentTime += randomGenerator.randint(0, 60) #dwell
+                stopTimes.append((f"t{tripNumber}", f"R{tripNumber % 4}", sequence, f"S{stop}", arrival, currentTime))
+                currentTime += randomGenerator.randint(30, 300)
+        return stopTimes
+
+    @staticmethod
+    def bruteForceArrival(stopTimes, source, target, departureSeconds):
+        #with no transfer time, the earliest arrival is the fixpoint of relaxing every connection
+        byTrip = {}
+        for tripId, _, sequence, stop, arrival, departure in stopTimes:
+            byTrip.setdefault(tripId, []).append((sequence, stop, arrival, departure))
+        connections = []
+        for tripStops in byTrip.values():
+            tripStops.sort()
+            connections += [(a[1], b[1], a[3], b[2]) for a, b in zip(tripStops, tripStops[1:])]
+        earliest = {source : departureSeconds}
+        changed = True
+        while changed:
+            changed = False
+            for fromStop, toStop, departure, arrival in connections:
+                if(earliest.get(fromStop, UNREACHED) <= departure and arrival < earliest.get(toStop, UNREACHED)):
+                    earliest[toStop] = arrival
+                    changed = True
+        return earliest.get(target)
+
+    def test_earliest_arrival_and_profile(self):
+        randomGenerator = random.Random(3)
+        for _ in range(5):
+            stopTimes = self.randomStopTimes(randomGenerator)
+            timetable = ConnectionTimetable(stopTimes)
+            for _ in range(30):
+                source, target = f"S{randomGenerator.randrange(12)}", f"S{randomGenerator.randrange(12)}"
+                if(source == target or source not in timetable.stopNumbers or target not in timetable.stopNumbers):
+                    continue
+                departureSeconds = randomGenerator.randint(0, 3600)
+                legs = timetable.earliestArrival(source, target, departureSeconds)
+                expectedArrival = self.bruteForceArrival(stopTimes, source, target, departureSeconds)
+                assert (legs[-1]["arrival"] if legs else None) == expectedArrival
+                if(legs):
+                    assert legs[0]["from"] == source and legs[-1]["to"] == target and legs[0]["departure"] >= departureSeconds
+                    for leg, nextLeg in zip(legs, legs[1:]):
+                        assert leg["to"] == nextLeg["from"] and leg["arrival"] <= nextLeg["departure"]
+                departures = timetable.profile(source, target, 600, 3000)
+                assert [departure for departure, _ in departures] == sorted(departure for departure, _ in departures)
+                for departureTime in range(600, 3001, 97): #the profile answers every earliest arrival query in its window
+                    catchable = [arrival for departure, arrival in departures if departure >= departureTime]
+                    expectedArrival = self.bruteForceArrival(stopTimes, source, target, departureTime)
+                    if(catchable):
+                        assert min(catchable) <= expectedArrival
+                    for departure, arrival in departures:
+                        assert self.bruteForceArrival(stopTimes, source, target, departure) == arrival
+
+    def test_transfer_time(self):
+        stopTimes = [("a", "Red", 1, "Alewife", 0, 0), ("a", "Red", 2, "Park Street", 600, 600),
+            ("b", "Green", 1, "Park Street", 630, 630), ("b", "Green", 2, "Kenmore", 1200, 1200),
+            ("c", "Green", 1, "Park Street", 900, 900), ("c", "Green", 2, "Kenmore", 1500, 1500)]
+        assert [leg["trip"] for leg in ConnectionTimetable(stopTimes).earliestArrival("Alewife", "Kenmore", 0)] == ["a", "b"]
+        legs = ConnectionTimetable(stopTimes, minTransferSeconds=120).earliestArrival("Alewife", "Kenmore", 0) #30 seconds is too tight now
+        assert [(leg["route"], leg["from"], leg["to"], leg["departure"], leg["arrival"]) for leg in legs] == [
+            ("Red", "Alewife", "Park Street", 0, 600), ("Green", "Park Street", "Kenmore", 900, 1500)]
+        assert ConnectionTimetable(stopTimes).earliestArrival("Alewife", "Kenmore", 1) == None
+        assert ConnectionTimetable(stopTimes).profile("Alewife", "Kenmore") == [(0, 1200)]
+
+class TestQueryServer:
+    '''
+    Runs the asyncio query server against a small fake network and checks its answers over real HTTP connections on localhost.
+    '''
+    def test_queries(self):
+        fakeNetwork = {"Red" : ["Alewife", "Park Street", "Downtown Crossing"], "Orange" : ["Oak Grove", "Downtown Crossing"], "Green-B" : ["Park Street"]}
+        async def fetch(port, target, connection="keep-alive"):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\nConnection: {connection}\r\n\r\n".encode())
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            headers = {}
+            line = await reader.readline()
+            while line != b"\r\n":
+                name, _, value = line.decode().partition(":")
+                headers[name.lower()] = value.strip()
+                line = await reader.readline()
+            body = json.loads(await reader.readexactly(int(headers["content-length"])))
+            writer.close()
+            return status, body
+        async def scenario():
+            queryServer = QueryServer(lambda: buildFakeRequester(fakeNetwork), refreshSeconds=0)
+            await queryServer.start("127.0.0.1", 0)
+            try:
+                results = await asyncio.gather(
+                    fetch(queryServer.port, "/routes/names"),
+                    fetch(queryServer.port, "/routes/extremes"),
+                    fetch(queryServer.port, "/stops/connecting"),
+                    fetch(queryServer.port, "/path?from=alewife&to=Oak+Grove", "close"),
+                    fetch(queryServer.port, "/path?from=Nowhere&to=Oak+Grove"),
+                    fetch(queryServer.port, "/nothing-here"))
+            finally:
+                await queryServer.stop()
+            return results
+        names, extremes, connecting, path, unknownStop, unknownPath = asyncio.run(scenario())
+        assert names == (200, {"routeNames" : ["Red Line", "Orange Line", "Green-B Line"]})
+        assert extremes == (200, {"longest" : {"route" : "Red", "stops" : 3}, "shortest" : {"route" : "Green-B", "stops" : 1}})
+        assert connecting == (200, {"connectingStops" : {"Park Street" : ["Red", "Green-B"], "Downtown Crossing" : ["Red", "Orange"]}})
+        assert path == (200, {"from" : "Alewife", "to" : "Oak Grove", "routes" : ["Red", "Orange"], "transfers" : [["Downtown Crossing"]]})
+        assert unknownStop[0] == 404 and unknownPath[0] == 404
+
+    def test_too_many_headers(self):
+        async def scenario():
+            queryServer = QueryServer(lambda: buildFakeRequester({"Red" : ["Alewife", "Park Street"]}), refreshSeconds=0)
+            await queryServer.start("127.0.0.1", 0)
+            try:
+                reader, writer = await asyncio.open_connection("127.0.0.1", queryServer.port)
+                headerLines = "".join(f"X-Filler-{number}: x\r\n" for number in range(MAX_HEADER_LINES))
+                writer.write(f"GET /stops HTTP/1.1\r\n{headerLines}GET /routes/names HTTP/1.1\r\n\r\n".encode())
+                await writer.drain()
+                response = await reader.read() #the server hangs up after answering, instead of serving the leftover line as a request
+                writer.close()
+            finally:
+                await queryServer.stop()
+            return response
+        response = asyncio.run(scenario())
+        assert response.startswith(b"HTTP/1.1 431 ") and b"Connection: close" in response
+        assert response.count(b"HTTP/1.1") == 1
+
+    def test_refresh_revalidates_snapshot(self):
+        snapshotTtls = []
+        def requesterFactory():
+            requesterObject = buildFakeRequester({"Red" : ["Alewife", "Park Street"]})
+            requesterObject.loadRelationshipsFromSnapshot = lambda path, ttlSeconds, derivedDataBuilder=None: snapshotTtls.append(ttlSeconds)
+            return requesterObject
+        queryServer = QueryServer(requesterFactory, snapshotPath="network.bin", snapshotTtlSeconds=3600)
+        queryServer.loadNetwork()
+        queryServer.loadNetwork(isRefresh=True)
+        assert snapshotTtls == [3600, 0] #a fresh snapshot is fine at startup, but a refresh has to ask the API
+
+    def test_refresh_from_snapshot_over_http(self, tmp_path):
+        with MockMbtaServer(RecordedNetwork.synthetic(numRoutes=4, stopsPerRoute=4)) as mockServer:
+            queryServer = QueryServer(lambda: TransitRequester("key", mockServer.endpoint), snapshotPath=str(tmp_path / "network.bin"))
+            queryServer.loadNetwork()
+            mockServer.requestLog.clear()
+            state = queryServer.loadNetwork(isRefresh=True)
+            assert len(mockServer.requestLog) == 2 #only the conditional requests, route names come from the snapshot
+            routeNames = json.loads(state.staticResponses["/routes/names"])["routeNames"]
+            assert routeNames == [f"Synthetic Line {routeNumber}" for routeNumber in range(4)]
+
+class TestBatchPlanner:
+    '''
+    Runs the batch entry point over a small fake network, in this process and with forked workers.
+    '''
+    def test_batch(self):
+        fakeNetwork = {"Red" : ["Alewife", "Park Street", "Downtown Crossing"], "Orange" : ["Oak Grove", "Downtown Crossing"], "Blue" : ["Wonderland"]}
+        lines = ["from,to\n", "# comment\n", "\n", "alewife,Oak Grove\n", "Nowhere,Alewife\n", "\"Park Street\",Wonderland\n"]
+        assert list(readStopPairs(lines)) == [("alewife", "Oak Grove"), ("Nowhere", "Alewife"), ("Park Street", "Wonderland")]
+        outputs = []
+        for workers in (1, 3):
+            requesterObject = buildFakeRequester(fakeNetwork)
+            outputFile = io.StringIO()
+            assert runBatch(requesterObject, allStopPairs(requesterObject), outputFile, workers=workers, chunkSize=4) == 5 * 4
+            outputs.append(outputFile.getvalue())
+        assert outputs[0] == outputs[1] #same answers, in input order
+        results = [json.loads(line) for line in outputs[1].splitlines()]
+        assert results[1] == {"from" : "Alewife", "to" : "Downtown Crossing", "routes" : ["Red"], "transfers" : [], "transferCount" : 0}
+        assert {"from" : "Alewife", "to" : "Oak Grove", "routes" : ["Red", "Orange"], "transfers" : [["Downtown Crossing"]], "transferCount" : 1} in results
+        outputFile = io.StringIO()
+        runBatch(buildFakeRequester(fakeNetwork), readStopPairs(lines), outputFile, "csv", workers=2)
+        assert outputFile.getvalue().splitlines() == ["from,to,transfer_count,routes,transfer_stops,departure,arrival,error",
+            "Alewife,Oak Grove,1,Red;Orange,Downtown Crossing,,,", "Nowhere,Alewife,,,,,,Unknown stop name.",
+            "Park Street,Wonderland,,,,,,No path between these stops."]
+
+class TestOfflineRequester:
+    '''
+    Runs TransitRequester against the local stand-in for the MBTA API, so the real HTTP code paths are tested repeatably and without a network.
+    '''
+    @pytest.fixture
+    def mockServer(self):
+        with MockMbtaServer(RecordedNetwork.synthetic(numRoutes=6, stopsPerRoute=5)) as mockServer:
+            yield mockServer
+
+    def test_builders_agree(self, mockServer):
+        sequentialRequester = TransitRequester("key", mockServer.endpoint)
+        sequentialRequester.buildRouteAndStopRelationships(concurrent=False)
+        concurrentRequester = TransitRequester("key", mockServer.endpoint)
+        concurrentRequester.buildRouteAndStopRelationships()
+        bulkRequester = TransitRequester("key", mockServer.endpoint)
+        mockServer.requestLog.clear()
+        bulkRequester.buildRouteAndStopRelationshipsBulk(pageSize=4)
+        assert len(mockServer.requestLog) == 3 #route ids plus two pages of route patterns
+        for requesterObject in (concurrentRequester, bulkRequester):
+            assert requesterObject.routeToStops == sequentialRequester.routeToStops
+            assert requesterObject.stopToRoutes == sequentialRequester.stopToRoutes
+        assert sequentialRequester.stopToRoutes["Central Hub"] == ["Route-0", "Route-3"]
+        assert sequentialRequester.getAllTrainRouteNames()[0] == "Synthetic Line 0"
+
+    def test_snapshot_revalidation_over_http(self, mockServer, tmp_path):
+        snapshotPath = str(tmp_path / "network.bin")
+        assert TransitRequester("key", mockServer.endpoint).loadRelationshipsFromSnapshot(snapshotPath) == False
+        mockServer.requestLog.clear()
+        requesterObject = TransitRequester("key", mockServer.endpoint)
+        assert requesterObject.loadRelationshipsFromSnapshot(snapshotPath, ttlSeconds=0) == True #the stand-in answers 304
+        assert len(mockServer.requestLog) == len(requesterObject.getSnapshotProbes(list(requesterObject.routeToStops)))
+        assert "Central Hub" in requesterObject.stopToRoutes
+
+        #Move a stop from one route to another. No route or stop name changes, but the snapshot is out of date and has to be rebuilt.
+        routeStops = mockServer.network.routeStops
+        routeStops["Route-2"].append(routeStops["Route-1"].pop(2))
+        requesterObject = TransitRequester("key", mockServer.endpoint)
+        assert requesterObject.loadRelationshipsFromSnapshot(snapshotPath, ttlSeconds=0) == False
+        assert requesterObject.stopToRoutes["Stop 1-2"] == ["Route-2"]
+        assert TransitRequester("key", mockServer.endpoint).loadRelationshipsFromSnapshot(snapshotPath, ttlSeconds=0) == True #and the new one sticks
+
+    def test_metrics(self, mockServer):
+        requesterObject = TransitRequester("key", mockServer.endpoint)
+        requesterObject.buildRouteAndStopRelationships() #the default registry is disabled, so this records nothing
+        assert getMetrics().toJson() == {"counters" : {}, "histograms" : {}}
+        metrics = MetricsRegistry(enabled=True)
+        metrics.enable(profile=True)
+        previousMetrics = setMetrics(metrics)
+        try:
+            mockServer.requestLog.clear()
+            requesterObject = TransitRequester("key", mockServer.endpoint) #a new one, so the responses aren't memoized yet
+            requesterObject.buildRouteAndStopRelationships()
+            planTrip(requesterObject, "Central Hub", "Stop 5-4")
+            planTrip(requesterObject, "Central Hub", "Stop 5-4")
+        finally:
+            setMetrics(previousMetrics)
+        summary = json.loads(json.dumps(metrics.toJson()))
+        requestCounts = {entry["labels"]["endpoint"] : entry["value"] for entry in summary["counters"]["traintracker_http_requests_total"]}
+        assert requestCounts == {"/routes" : 1, "/stops" : 6} and sum(requestCounts.values()) == len(mockServer.requestLog)
+        callCounts = {entry["labels"]["function"] : entry["count"] for entry in summary["histograms"]["traintracker_function_seconds"]}
+        assert callCounts["TransitRequester.getAllStopsOnRoute"] == 6 and callCounts["planTrip"] == 2
+        cacheLookups = {(entry["labels"]["cache"], entry["labels"]["result"]) : entry["value"] for entry in summary["counters"]["traintracker_cache_lookups_total"]}
+        assert cacheLookups[("route_graph", "miss")] == 1 and cacheLookups[("route_graph", "hit")] == 2 #the second is the path index being built from it
+        assert cacheLookups[("route_path_index", "miss")] == 1 and cacheLookups[("route_path_index", "hit")] == 1
+        assert summary["histograms"]["traintracker_json_decode_seconds"][0]["count"] == 7
+        assert any("(buildRouteAndStopRelationships)" in row["function"] for row in summary["profile"])
+        assert any("(planTrip)" in row["function"] for row in metrics.profileSummary(limit=1000))
+        prometheusText = metrics.toPrometheus()
+        assert "# TYPE traintracker_http_requests_total counter" in prometheusText
+        assert 'traintracker_http_requests_total{endpoint="/stops",status="200"} 6' in prometheusText
+        assert 'traintracker_function_seconds_count{function="planTrip"} 2' in prometheusText
+        assert 'traintracker_function_seconds_bucket{function="planTrip",le="+Inf"} 2' in prometheusText
+
+    def test_request_coalescing(self):
+        with MockMbtaServer(RecordedNetwork.synthetic(numRoutes=3, stopsPerRoute=4), latencySeconds=0.2) as slowServer:
+            requesterObject = TransitRequester("key", slowServer.endpoint)
+            with ThreadPoolExecutor(max_workers=5) as executor:
+                results = list(executor.map(lambda _: requesterObject.getAllTrainRouteIds(), range(5)))
+            assert results == [["Route-0", "Route-1", "Route-2"]] * 5
+            assert len(slowServer.requestLog) == 1 #everyone shared one in-flight request
+            requesterObject.getAllTrainRouteIds()
+            assert len(slowServer.requestLog) == 1 #and then the memoized response
+            assert slowServer.requestLog[0][1]["fields[route]"] == [""] #only ids were asked for
+            requesterObject.scheduler.clearMemo()
+            requesterObject.getAllTrainRouteIds()
+            assert len(slowServer.requestLog) == 2
+
+    def test_memo_limits(self):
+        class FakeSession:
+            def __init__(self):
+                self.requestedUrls = []
+            def get(self, url, headers=None, params=None, timeout=None):
+                self.requestedUrls.append(url)
+                return FakeResponse({"data" : "x" * int(url.split("?")[0].rsplit("/", 1)[1])})
+        session = FakeSession()
+        scheduler = RequestScheduler(session, memoMaxResponseBytes=1000, memoMaxBytes=2500)
+        for url in ("http://api/400", "http://api/400", "http://api/5000", "http://api/5000"):
+            scheduler.get(url)
+        assert session.requestedUrls == ["http://api/400", "http://api/5000", "http://api/5000"] #too big to keep
+        scheduler.get("http://api/400", {"page[limit]" : "10"})
+        scheduler.get("http://api/400", {"page[limit]" : "10"})
+        scheduler.get("http://api/400?page%5Boffset%5D=10")
+        scheduler.get("http://api/400?page%5Boffset%5D=10")
+        assert len(session.requestedUrls) == 7 #pages aren't kept either
+        for url in ("http://api/800", "http://api/900", "http://api/950"):
+            scheduler.get(url)
+        assert len(scheduler.memo) == 2 and scheduler.memoBytes <= 2500 #the 400 and 800 byte responses were evicted to stay in budget
+        scheduler.get("http://api/900")
+        assert len(session.requestedUrls) == 10
+
+    def test_rate_limit_and_retries(self, monkeypatch):
+        with MockMbtaServer(RecordedNetwork.synthetic(numRoutes=6, stopsPerRoute=5), rateLimit=4, rateLimitWindowSeconds=1.0) as limitedServer:
+            requesterObject = TransitRequester("key", limitedServer.endpoint)
+            requesterObject.scheduler = RequestScheduler(requesterObject.session, initialBackoffSeconds=0.2)
+            requesterObject.buildRouteAndStopRelationships() #7 requests against a limit of 4 per second
+            assert len(requesterObject.routeToStops) == 6 and requesterObject.stopToRoutes["Central Hub"] == ["Route-0", "Route-3"]
+
+        responses = [FakeResponse({}, 503), FakeResponse({}, 429, {"Retry-After" : "0"}), FakeResponse({"data" : [{"type" : "route", "id" : "Red"}]})]
+        requesterObject = TransitRequester("key", "http://localhost")
+        requesterObject.scheduler = RequestScheduler(requesterObject.session, initialBackoffSeconds=0.01)
+        def fakeGet(url, headers=None, params=None, timeout=None):
+            assert timeout == requesterObject.scheduler.requestTimeoutSeconds #nothing is sent without a timeout
+            response = responses.pop(0)
+            if(isinstance(response, Exception)):
+                raise response
+            return response
+        monkeypatch.setattr(requesterObject.session, "get", fakeGet)
+        assert requesterObject.getAllTrainRouteIds() == ["Red"]
+        assert responses == []
+
+        responses = [requests.ConnectionError("reset"), requests.ReadTimeout("stalled"), FakeResponse({"data" : [{"type" : "route", "id" : "Red"}]})]
+        requesterObject.scheduler.clearMemo()
+        assert requesterObject.getAllTrainRouteIds() == ["Red"] #dropped connections and timeouts are retried too
+        responses = [requests.ConnectTimeout("unreachable")] * (requesterObject.scheduler.maxRetries + 1)
+        requesterObject.scheduler.clearMemo()
+        with pytest.raises(requests.ConnectTimeout): #until we run out of retries
+            requesterObject.getAllTrainRouteIds()
+
+    def test_timetable_from_api(self, mockServer):
+        requesterObject = TransitRequester("key", mockServer.endpoint)
+        serviceDate = datetime.date(2026, 10, 19)
+        stopTimes = requesterObject.getScheduledStopTimes(serviceDate, pageSize=250) #several pages
+        assert len(stopTimes) == 6 * 2 * 18 * 5 and stopTimes[0] == ("Route-0-0-0", "Route-0", 1, "Stop 0-0", 6 * 3600, 6 * 3600)
+        legs = planTimedTrip(requesterObject, "Stop 1-1", "Stop 5-3", 6 * 3600 + 60, serviceDate)
+        assert [leg["route"] for leg in legs] == ["Route-1", "Route-0", "Route-3", "Route-4", "Route-5"] #back through Central Hub
+        assert legs[0]["departure"] == 6 * 3600 + 360 and legs[-1]["arrival"] == 6 * 3600 + 36 * 60 #the first train back leaves Stop 1-1 at 06:06
+        assert requesterObject.getConnectionTimetable(serviceDate) is requesterObject.connectionTimetable #cached
+        timetable = requesterObject.connectionTimetable
+        requesterObject.buildRouteAndStopRelationshipsBulk()
+        assert requesterObject.connectionTimetable == None and requesterObject.getConnectionTimetable(serviceDate) is not timetable #rebuilt with the network
+        outputFile = io.StringIO()
+        runBatch(requesterObject, [("Stop 1-1", "Stop 5-3")], outputFile, workers=1, departureSeconds=6 * 3600 + 60, serviceDate=serviceDate)
+        result = json.loads(outputFile.getvalue())
+        assert result["legs"] == legs and (result["departure"], result["arrival"]) == (6 * 3600 + 360, 6 * 3600 + 36 * 60)
+
+    def test_trip_after_midnight(self):
+        yesterday, today = datetime.date(2026, 10, 18), datetime.date(2026, 10, 19)
+        stopTimes = {
+            yesterday : [("late", "Red", 1, "Alewife", 24 * 3600 + 1800, 24 * 3600 + 1800), ("late", "Red", 2, "Park Street", 24 * 3600 + 2400, 24 * 3600 + 2400)],
+            today : [("early", "Red", 1, "Alewife", 5 * 3600, 5 * 3600), ("early", "Red", 2, "Park Street", 5 * 3600 + 600, 5 * 3600 + 600)]}
+        requesterObject = buildFakeRequester({"Red" : ["Alewife", "Park Street"]})
+        requesterObject.getScheduledStopTimes = lambda serviceDate: stopTimes[serviceDate]
+        legs = planTimedTripFromNow(requesterObject, "Alewife", "Park Street", datetime.datetime(2026, 10, 19, 0, 20))
+        assert [(leg["trip"], leg["departure"], leg["arrival"]) for leg in legs] == [("late", 1800, 2400)] #yesterday's last train, on today's clock
+        legs = planTimedTripFromNow(requesterObject, "Alewife", "Park Street", datetime.datetime(2026, 10, 19, 0, 45))
+        assert [(leg["trip"], leg["departure"], leg["arrival"]) for leg in legs] == [("early", 5 * 3600, 5 * 3600 + 600)]
+        assert set(requesterObject.connectionTimetables) == {yesterday, today} #both days stay loaded
+        requesterObject.getScheduledStopTimes = None #so loading any other day would fail
+        legs = planTimedTripFromNow(requesterObject, "Alewife", "Park Street", datetime.datetime(2026, 10, 19, 13, 0))
+        assert legs == None
+
+    def test_gtfs_loader(self, tmp_path):
+        #A tiny feed: Red has two directions with separate platforms, the bus route should be ignored, and stop_times isn't sorted by stop_sequence.
+        gtfsPath = str(tmp_path / "gtfs.zip")
+        with zipfile.ZipFile(gtfsPath, "w") as zipFile:
+            zipFile.writestr("routes.txt", "route_id,route_long_name,route_type,route_sort_order\nOrange,Orange Line,1,2\nRed,Red Line,1,1\n1,Bus 1,3,3\n")
+            zipFile.writestr("trips.txt", "route_id,service_id,trip_id,direction_id\nRed,s,r0,0\nRed,s,r1,1\nOrange,s,o0,0\n1,s,b0,0\n")
+            zipFile.writestr("stop_times.txt", "trip_id,arrival_time,departure_time,stop_id,stop_sequence\n"
+                "r0,08:00:00,08:00:00,alewife-0,1\nr0,08:10:00,08:10:00,dtx-red-0,3\nr0,08:05:00,08:05:00,park-0,2\n"
+                "b0,08:00:00,08:00:00,bus-stop,1\n"
+                "r1,09:00:00,09:00:00,dtx-red-1,1\nr1,09:05:00,09:05:00,park-1,2\nr1,09:10:00,09:10:00,alewife-1,3\n"
+                "o0,08:00:00,08:00:00,oak,1\no0,08:10:00,08:10:00,dtx-orange,2\n")
+            zipFile.writestr("stops.txt", "\ufeffstop_id,stop_name,location_type,parent_station\n"
+                "place-alfcl,Alewife,1,\nalewife-0,Alewife - Track 1,0,place-alfcl\nalewife-1,Alewife - Track 2,0,place-alfcl\n"
+                "place-pktrm,Park Street,1,\npark-0,Park Street,0,place-pktrm\npark-1,Park Street,0,place-pktrm\n"
+                "place-dwnxg,Downtown Crossing,1,\ndtx-red-0,Downtown Crossing,0,place-dwnxg\ndtx-red-1,Downtown Crossing,0,place-dwnxg\n"
+                "dtx-orange,Downtown Crossing,0,place-dwnxg\noak,Oak Grove,0,\nbus-stop,Some Bus Stop,0,\n")
+        requesterObject = TransitRequester("key", "http://localhost")
+        requesterObject.buildRouteAndStopRelationshipsFromGTFS(gtfsPath)
+        assert dict(requesterObject.routeToStops) == {"Red" : ["Alewife", "Park Street", "Downtown Crossing"], "Orange" : ["Oak Grove", "Downtown Crossing"]}
+        assert requesterObject.stopToRoutes["Downtown Crossing"] == ["Red", "Orange"]
+        assert "Some Bus Stop" not in requesterObject.stopToRoutes
+        assert buildRouteConnectionGraph(requesterObject) == {"Red" : ["Orange"], "Orange" : ["Red"]} #no API needed for the graph either
+
+        with zipfile.ZipFile(gtfsPath) as zipFile: #the same feed with its stop_times split up: r0's rows come before and after r1's
+            members = {name : zipFile.read(name).decode("utf-8") for name in zipFile.namelist()}
+        header, *rows = members["stop_times.txt"].splitlines()
+        members["stop_times.txt"] = "\n".join([header, rows[0], *rows[4:7], rows[1], rows[2], rows[3], *rows[7:]]) + "\n"
+        with zipfile.ZipFile(gtfsPath, "w") as zipFile:
+            for name, text in members.items():
+                zipFile.writestr(name, text)
+        ungroupedRequester = TransitRequester("key", "http://localhost")
+        ungroupedRequester.buildRouteAndStopRelationshipsFromGTFS(gtfsPath)
+        assert ungroupedRequester.routeToStops == requesterObject.routeToStops
+        assert ungroupedRequester.stopToRoutes == requesterObject.stopToRoutes
+
+class TestRealtimeStream:
+    '''
+    Checks the event-stream parser, incremental state updates, and that the streaming client reconnects after a dropped connection.
+    '''
+    @staticmethod
+    def vehicle(vehicleId, route, stop):
+        return {"type" : "vehicle", "id" : vehicleId, "relationships" : {"route" : {"data" : {"id" : route}}, "stop" : {"data" : {"id" : stop}}}}
+
+    def test_event_parsing(self):
+        lines = [": keep-alive", "event: reset", "data: [", "data: ]", "", "event: remove", 'data: {"type":"vehicle","id":"1"}', "", "data: no event name"]
+        assert list(parseServerSentEvents(lines)) == [("reset", "[\n]"), ("remove", '{"type":"vehicle","id":"1"}'), ("message", "no event name")]
+
+    def test_store_updates(self):
+        store = LiveStateStore()
+        store.applyEvent("reset", json.dumps([self.vehicle("1", "Red", "park"), self.vehicle("2", "Red", "dtx")]))
+        assert len(store.getForRoute("Red")) == 2
+        store.applyEvent("update", self.vehicle("2", "Orange", "dtx")) #moved routes, so both indexes must follow
+        assert [v["id"] for v in store.getForRoute("Red")] == ["1"]
+        assert [v["id"] for v in store.getForRoute("Orange")] == ["2"]
+        store.applyEvent("add", self.vehicle("3", "Red", "dtx"))
+        assert sorted(v["id"] for v in store.getForStop("dtx")) == ["2", "3"]
+        store.applyEvent("remove", {"type" : "vehicle", "id" : "1"})
+        assert store.get("vehicle", "1") == None
+        assert store.getForStop("park") == []
+        assert store.eventsApplied == 4
+
+    def test_client_reconnects(self, monkeypatch):
+        class FakeStreamResponse:
+            def __init__(self, lines):
+                self.lines = lines
+                self.encoding = "ISO-8859-1" #what requests picks for text/event-stream without a charset
+            def raise_for_status(self):
+                pass
+            def iter_lines(self, decode_unicode=False):
+                for line in self.lines:
+                    yield line.encode("utf-8").decode(self.encoding) if decode_unicode else line.encode("utf-8")
+            def close(self):
+                pass
+        connections = [
+            ["event: reset", "data: " + json.dumps([self.vehicle("1", "Red", "park")]), "", "event: add", "data: " + json.dumps(self.vehicle("2", "Red", "dtx")), ""],
+            ["event: reset", "data: " + json.dumps([self.vehicle("2", "Red", "dtx"), self.vehicle("3", "Red", "Café")], ensure_ascii=False), ""]
+        ]
+        requestedHeaders = []
+        def fakeGet(url, headers=None, params=None, stream=False, timeout=None):
+            requestedHeaders.append(headers)
+            if(not connections):
+                raise ConnectionError("the stream is gone")
+            return FakeStreamResponse(connections.pop(0))
+        requesterObject = TransitRequester("key", "http://localhost")
+        monkeypatch.setattr(requesterObject.session, "get", fakeGet)
+        client = StreamingClient(requesterObject, "vehicles", {"filter[route]" : "Red"}, initialBackoffSeconds=0.01).start()
+        deadline = time.time() + 5
+        while client.store.eventsApplied < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        client.stop()
+        assert client.reconnects >= 1
+        assert requestedHeaders[0]["Accept"] == "text/event-stream"
+        assert sorted(v["id"] for v in client.store.getForRoute("Red")) == ["2", "3"] #the second connection's reset replaced the old state
+        assert [v["id"] for v in client.store.getForStop("Café")] == ["3"] #decoded as UTF-8
@@ -1,24 +1,100 @@
 import requests
 import json
+import datetime
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+try: #import as a package member (pytest) or as a sibling script (main.py)
+    from .network_snapshot import NetworkSnapshot
+    from .stop_index import StopNameIndex
+    from .gtfs_loader import loadRouteAndStopRelationshipsFromGTFS, loadStopTimesFromGTFS
+    from .journey_planner import ConnectionTimetable, secondsAfterMidnight
+    from .instrumentation import getMetrics, instrumented
+    from .request_scheduler import RequestScheduler
+    from .response_decoding import decodeJson, sparseFieldset, extractRows, relatedIds, relatedId
+except ImportError:
+    from network_snapshot import NetworkSnapshot
+    from stop_index import StopNameIndex
+    from gtfs_loader import loadRouteAndStopRelationshipsFromGTFS, loadStopTimesFromGTFS
+    from journey_planner import ConnectionTimetable, secondsAfterMidnight
+    from instrumentation import getMetrics, instrumented
+    from request_scheduler import RequestScheduler
+    from response_decoding import decodeJson, sparseFieldset, extractRows, relatedIds, relatedId
+
+MAX_CACHED_TIMETABLES = 2 #Enough for yesterday's and today's service, which both run in the small hours (see questions.planTimedTripFromNow()).
 
 class TransitRequester:
     '''
     This class represents an object that can query a transit API in order to learn different things about a subway system.
     '''
-    def __init__(self, apiKey, apiEndpoint):
+    def __init__(self, apiKey, apiEndpoint, maxConcurrentRequests=8):
         '''
         Constructor for TransitRequester.
         Parameters:
             apiKey (str): A secret key that will be included in HTTP headers in order to gain access to the external API.
             apiEndpoint (str): A URI that HTTP requests should be sent to. Looks like 'https://api-v3.mbta.com'
+            maxConcurrentRequests (int): The most API requests we'll have in flight at once when fetching concurrently.
         '''
         self.apiKey = apiKey
         self.apiEndpoint = apiEndpoint
         self.headerDict = {"x-api-key" : self.apiKey} #We can use this dict as an HTTP header when sending requests.
+        self.maxConcurrentRequests = max(1, maxConcurrentRequests)
+        self.session = requests.Session() #A shared session lets every request reuse pooled connections instead of doing a new TLS handshake.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.maxConcurrentRequests)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.scheduler = RequestScheduler(self.session) #Rate limiting, retries, and sharing of identical requests. See RequestScheduler.
         self.routeToStops = None #Dictionaries that we may build later, if required.
         self.stopToRoutes = None
+        self.graphVersion = 0 #Bumped every time the dictionaries are rebuilt or reloaded, so anything derived from them knows it's out of date.
+        self.routeConnectionGraph = None #Route graph derived from the dictionaries above. Cleared whenever they're rebuilt.
+        self.routePathIndex = None #Precomputed paths between every pair of routes in routeConnectionGraph.
+        self.stopNameIndex = None #Normalized stop name lookup and autocomplete, built from the stop to routes dict.
+        self.snapshotValidators = None #ETag/Last-Modified values the API sent along with the data we currently hold.
+        self.gtfsPath = None #The GTFS feed the network was loaded from, if any. Schedules are read from it too.
+        self.connectionTimetable = None #A day of scheduled service for journey planning, built on demand by getConnectionTimetable().
+        self.connectionTimetables = {} #service date -> timetable, for the last couple of days asked for (a trip after midnight needs two).
+        self.routeNames = None #Long names of the routes in routeToStops, fetched on demand by getRouteNames() or loaded from a snapshot.
+
+    def sendRequest(self, url, params=None, headers=None, memoize=True):
+        '''
+        Sends a GET request to the API. Every API call goes through here and on to self.scheduler, which keeps us under the rate limit,
+        retries 429/5xx responses, and lets identical requests share one response. Request counts, latency and bytes received are measured
+        there when metrics are enabled (see instrumentation.getMetrics()).
+        Parameters:
+            url (str): The full URL to request.
+            params (dict[str,str]): Query parameters, or None.
+            headers (dict[str,str]): Request headers. Defaults to self.headerDict.
+            memoize (bool): Whether an identical response from the last few seconds may be reused. False for revalidation requests.
+        Returns:
+            response (requests.Response): The API's response.
+        '''
+        return self.scheduler.get(url, params, headers or self.headerDict, memoize)
+
+    def decodeResponse(self, response):
+        '''
+        Decodes a JSON response body straight from its bytes (with orjson if it's installed), timing it when metrics are enabled.
+        Parameters:
+            response (requests.Response): A response from sendRequest().
+        Returns:
+            responseDict (dict): The decoded JSON document.
+        '''
+        with getMetrics().timer("traintracker_json_decode_seconds"):
+            return decodeJson(response.content)
+
+    def fetchDocument(self, url, params, fields):
+        '''
+        Requests and decodes a JSON:API document. fields is required, so every query asks only for the attributes it actually reads.
+        Parameters:
+            url (str): The full URL to request.
+            params (dict[str,str]): Query parameters other than fields[...].
+            fields (dict[str, tuple[str]]): The attributes to request for each resource type in the response (see response_decoding.sparseFieldset()).
+        Returns:
+            responseDict (dict): The decoded JSON document.
+        '''
+        return self.decodeResponse(self.sendRequest(url, dict(params, **sparseFieldset(fields))))
 
+    @instrumented
     def getAllTrainRouteNames(self):
         '''
         Queries the Transit API to get the long name (which is human readable) of each subway route.
@@ -27,16 +103,12 @@ class TransitRequester:
         '''
         routeEndpoint = self.apiEndpoint + "/routes/"
         filterParams = {
-            "filter[type]" : "0,1",  # 0 and 1 represent 'Light Rail' and 'Heavy Rail' according to the API spec. 
-            "fields[route]" : "long_name" # filter the request to only ask for the 'long_name' field. 
+            "filter[type]" : "0,1"  # 0 and 1 represent 'Light Rail' and 'Heavy Rail' according to the API spec. 
         }
-        response = requests.get(routeEndpoint, headers=self.headerDict, params=filterParams)
-        responseDict = json.loads(response.text)
-        route_names = []
-        for trainRoute in responseDict["data"]:
-            route_names.append(trainRoute["attributes"]["long_name"])
-        return route_names
+        responseDict = self.fetchDocument(routeEndpoint, filterParams, {"route" : ("long_name",)}) # only ask for the 'long_name' field.
+        return [longName for _, longName in extractRows(responseDict["data"], ("long_name",))]
 
+    @instrumented
     def getAllTrainRouteIds(self):
         '''
         Queries the Transit API to get a unique ID for each subway route. 
@@ -47,13 +119,10 @@ class TransitRequester:
         filterParams = {
             "filter[type]" : "0,1",  # 0 and 1 represent 'Light Rail' and 'Heavy Rail' according to the API spec. 
         }
-        response = requests.get(routeEndpoint, headers=self.headerDict, params=filterParams)
-        responseDict = json.loads(response.text)
-        routeIds = []
-        for trainRoute in responseDict["data"]:
-            routeIds.append(trainRoute["id"])
-        return routeIds
+        responseDict = self.fetchDocument(routeEndpoint, filterParams, {"route" : ()}) # ids are always sent, so we don't need any attributes.
+        return [trainRoute["id"] for trainRoute in responseDict["data"]]
 
+    @instrumented
     def getAllStopsOnRoute(self, routeId):
         '''
         Queries the Transit API to get the name of each stop on the specified route.
@@ -64,21 +133,20 @@ class TransitRequester:
         '''
         stopEndpoint = self.apiEndpoint + "/stops/"
         filterParams = {
-            "filter[route]" : f"{routeId}",
-            "fields[stop]" : "name"
+            "filter[route]" : f"{routeId}"
         }
+        responseDict = self.fetchDocument(stopEndpoint, filterParams, {"stop" : ("name",)})
+        return [name for _, name in extractRows(responseDict["data"], ("name",))]
 
-        response = requests.get(stopEndpoint, headers=self.headerDict, params=filterParams)
-        responseDict = json.loads(response.text)
-        stop_names = []
-        for stop in responseDict["data"]:
-            stop_names.append(stop["attributes"]["name"])
-        return stop_names
-
-    def buildRouteAndStopRelationships(self):
+    @instrumented
+    def buildRouteAndStopRelationships(self, concurrent=True):
         '''
         This funciton performs multiple queries on the Transit API to store the many-to-many relationship between routes and stops as two member dictionaries.
         Because this function performs multiple API requests (~ one for each route in the subway network), it can take a few seconds to complete.
+        When concurrent is True, the per-route requests are sent from a thread pool (at most self.maxConcurrentRequests at a time), so the
+        build takes about as long as the slowest request instead of the sum of all of them. The results are identical either way.
+        Parameters:
+            concurrent (bool): Whether to fetch the stops on each route concurrently. Defaults to True.
         This function builds the members:
             self.routeToStops (dict[str, list[str]): A dictionary where each key is a route and each value is a list of stops on that route.
             self.stopToRoutes (dictpstr, list[str]): A dictionary where each key is a stop and each value is a list of routes that that stop is on. 
@@ -86,14 +154,393 @@ class TransitRequester:
         print("Building route and stop relationships. This could take a second...")
         self.routeToStops = defaultdict(list)
         self.stopToRoutes = defaultdict(list)
+        self.invalidateDerivedData()
         routeIds = self.getAllTrainRouteIds() #get the unique ID for every route in the system.
 
+        if(concurrent and len(routeIds) > 1):
+            with ThreadPoolExecutor(max_workers=min(self.maxConcurrentRequests, len(routeIds))) as executor:
+                stopsPerRoute = list(executor.map(self.getAllStopsOnRoute, routeIds)) #map() keeps results in the same order as routeIds
+        else:
+            stopsPerRoute = [self.getAllStopsOnRoute(route) for route in routeIds]
+
+        for route, stopsOnRoute in zip(routeIds, stopsPerRoute):
+            self.routeToStops[route] = stopsOnRoute
+            for stop in stopsOnRoute:
+                self.stopToRoutes[stop].append(route)
+
+    def getAllPages(self, endpoint, params, fields, pageSize=None):
+        '''
+        Generator that walks a paginated JSON:API collection by following each page's 'links.next' URL until there are no pages left.
+        Pages are yielded as they arrive, so callers can process a large collection without holding every page in memory at once.
+        Parameters:
+            endpoint (str): The full URL of the collection, like 'https://api-v3.mbta.com/route_patterns/'.
+            params (dict[str,str]): Query parameters for the first page. Later pages already have them baked into 'links.next'.
+            fields (dict[str, tuple[str]]): The attributes to request for each resource type, primary and included (see fetchDocument()).
+            pageSize (int): Optional number of resources per page. If None, the API decides (the MBTA API returns everything in one page).
+        Yields:
+            (data, included) (tuple[list[dict], dict[tuple[str,str],dict]]): The primary resources on the page, and the page's included
+            resources keyed by (type, id) so relationships can be resolved with a dict lookup.
+        '''
+        params = dict(params)
+        if(pageSize != None):
+            params["page[limit]"] = str(pageSize)
+        responseDict = self.fetchDocument(endpoint, params, fields)
+        while True:
+            included = {(resource["type"], resource["id"]) : resource for resource in responseDict.get("included", [])}
+            yield responseDict["data"], included
+            url = (responseDict.get("links") or {}).get("next")
+            if(not url):
+                return
+            responseDict = self.decodeResponse(self.sendRequest(url)) #the next link already contains the query string, fields included
+
+    @instrumented
+    def buildRouteAndStopRelationshipsBulk(self, pageSize=None):
+        '''
+        Builds the same members as buildRouteAndStopRelationships(), but with a couple of bulk requests instead of one request per route.
+        We ask for the route patterns of every subway route at once (comma separated filter[route]) and use the JSON:API include parameter to
+        get each pattern's representative trip and that trip's stops in the same response. Only typical patterns (typicality 1) are used when
+        a route has any, so shuttles and detours don't add stops. Each route keeps its stops in the order they are first seen along its patterns.
+        Parameters:
+            pageSize (int): Optional number of route patterns per page. Pages are processed as they stream in.
+        This function builds the members:
+            self.routeToStops (dict[str, list[str]): A dictionary where each key is a route and each value is a list of stops on that route.
+            self.stopToRoutes (dict[str, list[str]): A dictionary where each key is a stop and each value is a list of routes that that stop is on.
+        '''
+        print("Building route and stop relationships in bulk...")
+        routeIds = self.getAllTrainRouteIds()
+        patternEndpoint, filterParams, fields = self.getRoutePatternRequest(routeIds)
+        typicalStops = {route : [] for route in routeIds} #stop names per route, from typical patterns
+        otherStops = {route : [] for route in routeIds} #stop names per route, from every other pattern. Only used if a route has no typical ones.
+        for patterns, included in self.getAllPages(patternEndpoint, filterParams, fields, pageSize):
+            for pattern in patterns:
+                route = pattern["relationships"]["route"]["data"]["id"]
+                if(route not in typicalStops):
+                    continue
+                tripReference = pattern["relationships"]["representative_trip"]["data"]
+                trip = included.get(("trip", tripReference["id"])) if tripReference else None
+                if(trip == None):
+                    continue
+                stopNames = typicalStops[route] if pattern["attributes"].get("typicality") == 1 else otherStops[route]
+                for stopId in relatedIds(trip, "stops"):
+                    stopNames.append(included[("stop", stopId)]["attributes"]["name"])
+
+        self.routeToStops = defaultdict(list)
+        self.stopToRoutes = defaultdict(list)
+        self.invalidateDerivedData()
         for route in routeIds:
-            stopsOnRoute = self.getAllStopsOnRoute(route)
+            stopsOnRoute = list(dict.fromkeys(typicalStops[route] or otherStops[route])) #platforms share their station's name, so dedupe in order
             self.routeToStops[route] = stopsOnRoute
             for stop in stopsOnRoute:
                 self.stopToRoutes[stop].append(route)
 
+    def getRoutePatternRequest(self, routeIds):
+        '''
+        The bulk request for the route patterns of routeIds, with each pattern's representative trip and that trip's stops included.
+        Its body spells out which stops are on which route, so it's also what we revalidate snapshots with (see getSnapshotProbes()).
+        Parameters:
+            routeIds (list[str]): The routes to ask about.
+        Returns:
+            (endpoint, params, fields) (tuple[str, dict[str,str], dict[str, tuple[str]]]): The URL, the filter/include parameters and the
+            sparse fieldsets, ready for getAllPages().
+        '''
+        params = {
+            "filter[route]" : ",".join(routeIds),
+            "include" : "representative_trip.stops"
+        }
+        fields = {
+            "route_pattern" : ("typicality",),
+            "trip" : (), #we only need the trip's relationships, not its attributes
+            "stop" : ("name",)
+        }
+        return self.apiEndpoint + "/route_patterns/", params, fields
+
+    @instrumented
+    def buildRouteAndStopRelationshipsFromGTFS(self, gtfsPath):
+        '''
+        Builds the same members as buildRouteAndStopRelationships(), but from a local GTFS static feed zip instead of the API. No requests are
+        made, so there's no rate limit, and the feed is stream-parsed so even a very large stop_times.txt loads in bounded memory.
+        Parameters:
+            gtfsPath (str): Path to a GTFS zip, like the one MBTA publishes at https://cdn.mbta.com/MBTA_GTFS.zip.
+        This function builds the members:
+            self.routeToStops (dict[str, list[str]): A dictionary where each key is a route and each value is a list of stops on that route.
+            self.stopToRoutes (dict[str, list[str]): A dictionary where each key is a stop and each value is a list of routes that that stop is on.
+        '''
+        print("Building route and stop relationships from the GTFS feed...")
+        self.routeToStops, self.stopToRoutes = loadRouteAndStopRelationshipsFromGTFS(gtfsPath)
+        self.gtfsPath = gtfsPath
+        self.invalidateDerivedData()
+
+    @instrumented
+    def getScheduledStopTimes(self, serviceDate, pageSize=None):
+        '''
+        Queries the Transit API's /schedules for every stop of every subway trip on serviceDate, with the stops included in the same response.
+        Only the ids, times and stop names are kept, as compact tuples.
+        Parameters:
+            serviceDate (datetime.date): The service day to load.
+            pageSize (int): Optional number of schedules per page. Pages are processed as they stream in.
+        Returns:
+            stopTimes (list[tuple[str, str, int, str, int, int]]): (tripId, routeId, stopSequence, stopName, arrivalSeconds, departureSeconds)
+            for every scheduled stop, with times in seconds after midnight of serviceDate. Same shape as gtfs_loader.loadStopTimesFromGTFS().
+        '''
+        scheduleEndpoint = self.apiEndpoint + "/schedules/"
+        filterParams = {
+            "filter[route]" : ",".join(self.getAllTrainRouteIds()),
+            "filter[date]" : serviceDate.isoformat(),
+            "include" : "stop"
+        }
+        fields = {
+            "schedule" : ("arrival_time", "departure_time", "stop_sequence"),
+            "stop" : ("name",)
+        }
+        stopTimes = []
+        for schedules, included in self.getAllPages(scheduleEndpoint, filterParams, fields, pageSize):
+            for schedule in schedules:
+                attributes = schedule["attributes"]
+                arrivalTime = attributes["arrival_time"] or attributes["departure_time"] #the first stop has no arrival, the last has no departure
+                departureTime = attributes["departure_time"] or attributes["arrival_time"]
+                stop = included.get(("stop", relatedId(schedule, "stop")))
+                if(arrivalTime == None or stop == None): #not a real stop, e.g. a skipped one
+                    continue
+                stopTimes.append((relatedId(schedule, "trip"), relatedId(schedule, "route"), attributes["stop_sequence"], stop["attributes"]["name"],
+                    secondsAfterMidnight(arrivalTime, serviceDate), secondsAfterMidnight(departureTime, serviceDate)))
+        return stopTimes
+
+    @instrumented
+    def getConnectionTimetable(self, serviceDate=None):
+        '''
+        This function provides external access to the connection timetable used for journey planning, building it the first time it's asked
+        for (and again if a different day is asked for). It's read from the GTFS feed if the network came from one, otherwise from the API.
+        The last MAX_CACHED_TIMETABLES days are kept, so alternating between yesterday's and today's service doesn't reload either.
+        Parameters:
+            serviceDate (datetime.date): The service day. Defaults to today.
+        Returns:
+            self.connectionTimetable (ConnectionTimetable): Every scheduled connection that day, ready for earliest arrival and profile queries.
+        '''
+        serviceDate = serviceDate or datetime.date.today()
+        isCached = serviceDate in self.connectionTimetables
+        getMetrics().increment("traintracker_cache_lookups_total", cache="connection_timetable", result="hit" if isCached else "miss")
+        if(isCached):
+            self.connectionTimetables[serviceDate] = self.connectionTimetables.pop(serviceDate) #dicts keep insertion order, so this marks it most recent
+        else:
+            print("Loading the schedule. This could take a second...")
+            if(self.gtfsPath):
+                stopTimes = loadStopTimesFromGTFS(self.gtfsPath, serviceDate)
+            else:
+                stopTimes = self.getScheduledStopTimes(serviceDate)
+            self.connectionTimetables[serviceDate] = ConnectionTimetable(stopTimes, serviceDate=serviceDate)
+            while len(self.connectionTimetables) > MAX_CACHED_TIMETABLES:
+                del self.connectionTimetables[next(iter(self.connectionTimetables))]
+        self.connectionTimetable = self.connectionTimetables[serviceDate]
+        return self.connectionTimetable
+
+    @instrumented
+    def applyRouteStopChanges(self, changedRoutes):
+        '''
+        Diff-based update path: patches routeToStops, stopToRoutes and the cached route graph in place for just the routes that changed,
+        instead of rebuilding everything. The cost depends on the size of the change, not the size of the network.
+        graphVersion is bumped, and caches that depend on it are only dropped if the change affects them:
+            -The route path index is kept (and restamped with the new version) unless some route gained or lost a neighbor.
+            -The stop name index is kept unless a stop was added to or removed from the network.
+        Parameters:
+            changedRoutes (dict[str, list[str]]): For each changed route, its complete new list of stops. None removes the route. New routes are added.
+        Returns:
+            graphChangedRoutes (set[str]): The routes whose neighbors in the route graph changed (only known if the graph was built).
+        '''
+        routeToStops = self.getRouteToStopsDict()
+        stopToRoutes = self.getStopToRoutesDict()
+        oldRoutesAtStop = {} #stop -> the routes it was on before this update, for every stop we touch
+        addedRoutes = []
+        removedRoutes = []
+        for route, newStops in changedRoutes.items():
+            oldStops = routeToStops.get(route)
+            if(newStops != None and oldStops != None and list(newStops) == oldStops):
+                continue
+            oldStopSet = set(oldStops or [])
+            newStopSet = set(newStops or [])
+            removedStops = [stop for stop in dict.fromkeys(oldStops or []) if stop not in newStopSet]
+            addedStops = [stop for stop in dict.fromkeys(newStops or []) if stop not in oldStopSet]
+            for stop in removedStops + addedStops:
+                oldRoutesAtStop.setdefault(stop, list(stopToRoutes.get(stop, [])))
+            for stop in removedStops:
+                stopToRoutes[stop] = [otherRoute for otherRoute in stopToRoutes[stop] if otherRoute != route]
+                if(not stopToRoutes[stop]):
+                    del stopToRoutes[stop]
+            for stop in addedStops:
+                stopToRoutes[stop].append(route)
+            if(newStops == None):
+                routeToStops.pop(route, None)
+                removedRoutes.append(route)
+            else:
+                if(oldStops == None):
+                    addedRoutes.append(route)
+                routeToStops[route] = list(newStops)
+
+        self.graphVersion += 1
+        stopSetChanged = any((stop in stopToRoutes) != bool(oldRoutes) for stop, oldRoutes in oldRoutesAtStop.items())
+        if(stopSetChanged):
+            self.stopNameIndex = None
+        graphChangedRoutes = set()
+        if(self.routeConnectionGraph != None):
+            stopChanges = {stop : (oldRoutes, list(stopToRoutes.get(stop, []))) for stop, oldRoutes in oldRoutesAtStop.items()}
+            graphChangedRoutes = self.routeConnectionGraph.applyStopChanges(stopChanges)
+            for route in addedRoutes: #a new route with no transfers still needs to be a node
+                self.routeConnectionGraph.addRoute(route)
+            for route in removedRoutes:
+                self.routeConnectionGraph.removeRoute(route)
+        if(self.routePathIndex != None):
+            if(self.routeConnectionGraph != None and not graphChangedRoutes and not addedRoutes and not removedRoutes):
+                self.routePathIndex.graphVersion = self.graphVersion #no route gained or lost a neighbor, so every stored path is still right
+            else:
+                self.routePathIndex = None
+        self.snapshotValidators = None #our data no longer matches what the API sent, so a saved snapshot must not be revalidated against it
+        return graphChangedRoutes
+
+    @instrumented
+    def refreshRoutes(self, routeIds):
+        '''
+        Re-fetches the stops on just the given routes (concurrently) and applies whatever changed with applyRouteStopChanges().
+        Parameters:
+            routeIds (list[str]): The routes to refresh.
+        Returns:
+            changedRoutes (list[str]): The routes whose stops actually changed.
+        '''
+        routeIds = list(routeIds)
+        self.scheduler.clearMemo() #a refresh has to see the API's current answer
+        with ThreadPoolExecutor(max_workers=max(1, min(self.maxConcurrentRequests, len(routeIds)))) as executor:
+            stopsPerRoute = list(executor.map(self.getAllStopsOnRoute, routeIds))
+        routeToStops = self.getRouteToStopsDict()
+        changedRoutes = {route : stops for route, stops in zip(routeIds, stopsPerRoute) if routeToStops.get(route) != stops}
+        if(changedRoutes):
+            self.applyRouteStopChanges(changedRoutes)
+        return list(changedRoutes.keys())
+
+    def invalidateDerivedData(self):
+        '''
+        Call this whenever routeToStops/stopToRoutes change. It bumps graphVersion and drops the cached route graph, path index, stop name
+        index, connection timetable and route names, so they get rebuilt from the new network the next time they're needed.
+        '''
+        self.graphVersion += 1
+        self.routeNames = None
+        self.routeConnectionGraph = None
+        self.routePathIndex = None
+        self.stopNameIndex = None
+        self.connectionTimetable = None
+        self.connectionTimetables = {}
+
+    def getSnapshotProbes(self, routeIds):
+        '''
+        The requests we use to ask the API whether the network changed since we saved a snapshot: the subway routes, and the route patterns
+        of routeIds with their stops included. The second one lists every route's stops, so its body (and ETag) changes whenever a stop
+        moves between routes or a route's stop list changes, not just when names do.
+        Parameters:
+            routeIds (list[str]): The routes in the snapshot, in the order getAllTrainRouteIds() returned them (so the URL is the same every time).
+        Returns:
+            probes (list[tuple[str, dict[str,str]]]): A list of (endpoint, params) pairs.
+        '''
+        patternEndpoint, patternParams, patternFields = self.getRoutePatternRequest(routeIds)
+        return [
+            (self.apiEndpoint + "/routes/", {"filter[type]" : "0,1", "fields[route]" : "long_name"}),
+            (patternEndpoint, dict(patternParams, **sparseFieldset(patternFields)))
+        ]
+
+    @instrumented
+    def fetchSnapshotValidators(self, routeIds):
+        '''
+        Requests each snapshot probe and records the cache validators the API sent back.
+        Parameters:
+            routeIds (list[str]): The routes the snapshot will hold.
+        Returns:
+            validators (list[dict[str,str]]): One dict per probe with its 'etag' and 'lastModified' response headers (either may be None).
+        '''
+        validators = []
+        for endpoint, params in self.getSnapshotProbes(routeIds):
+            response = self.sendRequest(endpoint, params, memoize=False) #we need the API's current validators, not a recent copy
+            validators.append({"etag" : response.headers.get("ETag"), "lastModified" : response.headers.get("Last-Modified")})
+        return validators
+
+    @instrumented
+    def isNetworkUnchanged(self, validators, routeIds):
+        '''
+        Revalidates previously saved validators with conditional requests (If-None-Match / If-Modified-Since). An unchanged collection
+        costs a bodyless 304 response instead of a full download.
+        Parameters:
+            validators (list[dict[str,str]]): Validators previously returned by fetchSnapshotValidators().
+            routeIds (list[str]): The routes the validators were fetched for (the snapshot's routes).
+        Returns:
+            bool: True only if the API answered 304 Not Modified for every probe.
+        '''
+        probes = self.getSnapshotProbes(routeIds)
+        if(not validators or len(validators) != len(probes)):
+            return False
+        for (endpoint, params), validator in zip(probes, validators):
+            conditionalHeaders = dict(self.headerDict)
+            if(validator.get("etag")):
+                conditionalHeaders["If-None-Match"] = validator["etag"]
+            if(validator.get("lastModified")):
+                conditionalHeaders["If-Modified-Since"] = validator["lastModified"]
+            if(len(conditionalHeaders) == len(self.headerDict)): #nothing to revalidate with
+                return False
+            response = self.sendRequest(endpoint, params, conditionalHeaders, memoize=False)
+            if(response.status_code != 304):
+                return False
+        return True
+
+    @instrumented
+    def saveSnapshot(self, path):
+        '''
+        Writes the relationship dicts (and the route graph, if one has been built) to path, so later processes can load them from disk.
+        Parameters:
+            path (str): Where to write the snapshot.
+        '''
+        NetworkSnapshot(self.getRouteToStopsDict(), self.getStopToRoutesDict(), self.routeConnectionGraph, self.snapshotValidators,
+            routePathIndex=self.routePathIndex, routeNames=self.getRouteNames()).save(path)
+
+    @instrumented
+    def loadRelationshipsFromSnapshot(self, path, ttlSeconds=24 * 60 * 60, derivedDataBuilder=None, bulk=False):
+        '''
+        Fills routeToStops, stopToRoutes, routeConnectionGraph and routePathIndex from the snapshot at path, talking to the API as little as possible:
+            -If the snapshot is younger than ttlSeconds, it's used as is. No requests at all.
+            -If it's older, we revalidate it with conditional requests. If the API says nothing changed, we use it and reset its age.
+            -Otherwise (missing, outdated or changed network), we rebuild from the API and write a new snapshot.
+        Parameters:
+            path (str): The snapshot file to read from and write to.
+            ttlSeconds (float): How long a snapshot can be trusted without asking the API. Defaults to one day.
+            derivedDataBuilder (function): Optional function that takes this requester and builds its route graph and path index, so a rebuilt
+                snapshot includes them. See questions.buildDerivedData().
+            bulk (bool): Whether a rebuild should use buildRouteAndStopRelationshipsBulk() instead of buildRouteAndStopRelationships().
+        Returns:
+            bool: True if the data came from the snapshot, False if it had to be rebuilt from the API.
+        '''
+        snapshot = NetworkSnapshot.load(path)
+        if(snapshot != None and (snapshot.isFresh(ttlSeconds) or self.isNetworkUnchanged(snapshot.validators, list(snapshot.routeToStops)))):
+            if(snapshot.isFresh(ttlSeconds)):
+                getMetrics().increment("traintracker_cache_lookups_total", cache="snapshot", result="hit")
+            else:
+                getMetrics().increment("traintracker_cache_lookups_total", cache="snapshot", result="revalidated")
+                snapshot.touch(path)
+            self.routeToStops = defaultdict(list, snapshot.routeToStops)
+            self.stopToRoutes = defaultdict(list, snapshot.stopToRoutes)
+            self.invalidateDerivedData()
+            self.routeConnectionGraph = snapshot.routeConnectionGraph
+            self.routePathIndex = snapshot.routePathIndex
+            if(self.routePathIndex != None):
+                self.routePathIndex.graphVersion = self.graphVersion #the stored index was built from exactly this data
+            self.snapshotValidators = snapshot.validators
+            self.routeNames = snapshot.routeNames
+            return True
+
+        getMetrics().increment("traintracker_cache_lookups_total", cache="snapshot", result="miss")
+        validators = self.fetchSnapshotValidators(self.getAllTrainRouteIds()) #fetch these before building, so a change made mid-build triggers a rebuild next time
+        if(bulk):
+            self.buildRouteAndStopRelationshipsBulk()
+        else:
+            self.buildRouteAndStopRelationships()
+        self.snapshotValidators = validators
+        if(derivedDataBuilder != None):
+            derivedDataBuilder(self)
+        self.saveSnapshot(path)
+        return False
+
     def prettyPrintResponse(self, response):
         '''
         Prints python response objects to the console in a human readable format. Helper function for debugging.
@@ -112,10 +559,23 @@ class TransitRequester:
             self.routeToStops (dict[str,list[str]]): A dictionary where each key is a subway route, and each value is a list of stops
             on that subway route. 
         '''
+        getMetrics().increment("traintracker_cache_lookups_total", cache="relationships", result="miss" if self.routeToStops == None else "hit")
         if(self.routeToStops == None):
             self.buildRouteAndStopRelationships() #build the dictionary if one doesn't already exist. 
         return self.routeToStops
     
+    def getRouteNames(self):
+        '''
+        Provides the long name of every subway route, like getAllTrainRouteNames(), but only asks the API the first time. After that (or after
+        loading a snapshot, which stores them) the names are served from memory until the network is rebuilt.
+        Returns:
+            self.routeNames (list[str]): The 'long_name' of each subway route.
+        '''
+        getMetrics().increment("traintracker_cache_lookups_total", cache="route_names", result="miss" if self.routeNames == None else "hit")
+        if(self.routeNames == None):
+            self.routeNames = self.getAllTrainRouteNames()
+        return self.routeNames
+
     def getStopToRoutesDict(self):
         '''
         This function provides external access to the stop to routes dict. It also allows us to lazily build the dictionary 
@@ -124,9 +584,22 @@ class TransitRequester:
             self.stopToRoutes (dict[str,list[str]]): A dictionary where each key is a subway stop, and each value is a list of routes
             associated with that subway stop.
         '''
+        getMetrics().increment("traintracker_cache_lookups_total", cache="relationships", result="miss" if self.stopToRoutes == None else "hit")
         if(self.stopToRoutes == None):
             self.buildRouteAndStopRelationships()
         return self.stopToRoutes
 
+    def getStopNameIndex(self):
+        '''
+        This function provides external access to the stop name index, building it (and the stop to routes dict, if needed) the first time
+        it's asked for. The index is dropped whenever the relationship dicts are rebuilt, so it always matches them.
+        Returns:
+            self.stopNameIndex (StopNameIndex): Case and punctuation insensitive stop name lookup with aliases and prefix search.
+        '''
+        getMetrics().increment("traintracker_cache_lookups_total", cache="stop_name_index", result="miss" if self.stopNameIndex == None else "hit")
+        if(self.stopNameIndex == None):
+            self.stopNameIndex = StopNameIndex(self.getStopToRoutesDict().keys())
+        return self.stopNameIndex
+
     def __str__(self):
         return f"Transit Requester object using API Endpoint {self.apiEndpoint}"